@@ -0,0 +1,134 @@
+"""
+Benchmark of the lxml single-parse extraction against the previous BeautifulSoup implementation.
+Runs offline on generated pages that look like news articles: a large <head> full of scripts and meta tags,
+followed by a body with navigation, ads and paragraphs.
+
+    python -m benchmarks.bench_extraction --pages 200
+"""
+
+from modules.extraction import (
+    HEAD_END,
+    compile_query_pattern,
+    extract_canonical_url,
+    extract_paragraphs,
+    parse_html,
+    read_until,
+)
+
+import argparse
+import random
+import time
+from typing import Callable, List
+
+from bs4 import BeautifulSoup
+from lxml import etree
+
+WORDS = (
+    "shares market investors quarter revenue growth analysts stock earnings guidance "
+    "company report trading outlook demand supply margin forecast"
+).split()
+
+
+def make_page(rng: random.Random, n_paragraphs: int = 60) -> bytes:
+    def sentence() -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(12, 30)))
+
+    head = ["<head>", "<meta charset='utf-8'>", "<title>Article</title>"]
+    head += [f"<meta name='m{i}' content='{sentence()}'>" for i in range(40)]
+    head += [f"<script>var x{i} = '{sentence()}';</script>" for i in range(20)]
+    head += ["<link rel='canonical' href='https://news.example.com/article/123'>"]
+    head += ["</head>"]
+    body = [
+        "<body>",
+        "<nav>" + "".join(f"<a href='#'>{w}</a>" for w in WORDS) + "</nav>",
+    ]
+    for i in range(n_paragraphs):
+        # Roughly a third of the paragraphs mention the company
+        mention = " Apple Inc. (AAPL)" if rng.random() < 0.3 else ""
+        body.append(f"<p class='para'>{sentence()}<b>{mention}</b> {sentence()}.</p>")
+        if i % 10 == 0:
+            body.append(f"<div class='ad'><script>ad({i})</script></div>")
+    body += ["</body>"]
+
+    return ("<html>" + "".join(head) + "".join(body) + "</html>").encode("utf-8")
+
+
+def chunked(body: bytes, chunk_size: int = 16384):
+    for i in range(0, len(body), chunk_size):
+        yield body[i : i + chunk_size]
+
+
+def legacy_canonical_url(body: bytes) -> str:
+    soup = BeautifulSoup(body.decode("utf-8"), "lxml")
+    dom = etree.HTML(str(soup))
+    element = dom.xpath("//head//link[@rel='canonical']")
+    return element[0].get("href")
+
+
+def legacy_paragraphs(body: bytes, query_terms: List[str]) -> List[str]:
+    soup = BeautifulSoup(body.decode("utf-8"), "lxml")
+    content = []
+    for x in soup.find_all("p"):
+        for q in query_terms:
+            if q in str(x):
+                content.append(str(x))
+                break
+    return content
+
+
+def canonical_url(body: bytes) -> str:
+    return extract_canonical_url(parse_html(read_until(chunked(body), HEAD_END)))
+
+
+def paragraphs(body: bytes, query_terms: List[str]) -> List[str]:
+    return extract_paragraphs(parse_html(body), compile_query_pattern(query_terms))
+
+
+def time_per_page(func: Callable, pages: List[bytes], repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for page in pages:
+            func(page)
+        best = min(best, time.perf_counter() - start)
+    return best / len(pages) * 1000
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--paragraphs", type=int, default=60)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    pages = [make_page(rng, args.paragraphs) for _ in range(args.pages)]
+    query_terms = ["AAPL", "Apple Inc."]
+
+    # Both implementations must agree before their timings mean anything
+    for page in pages[:10]:
+        assert legacy_canonical_url(page) == canonical_url(page)
+        assert len(legacy_paragraphs(page, query_terms)) == len(
+            paragraphs(page, query_terms)
+        )
+
+    head_bytes = sum(len(read_until(chunked(p), HEAD_END)) for p in pages)
+    total_bytes = sum(len(p) for p in pages)
+    print(
+        f"{args.pages} pages, {total_bytes / args.pages / 1024:.1f} KiB per page, "
+        f"canonical resolution reads {head_bytes / total_bytes:.0%} of the bytes"
+    )
+    for name, legacy, current in [
+        ("canonical url", legacy_canonical_url, canonical_url),
+        (
+            "paragraphs",
+            lambda p: legacy_paragraphs(p, query_terms),
+            lambda p: paragraphs(p, query_terms),
+        ),
+    ]:
+        legacy_ms = time_per_page(legacy, pages)
+        current_ms = time_per_page(current, pages)
+        print(
+            f"{name:>14}: beautifulsoup {legacy_ms:.3f} ms/page, lxml {current_ms:.3f} ms/page "
+            f"({legacy_ms / current_ms:.1f}x)"
+        )
@@ -0,0 +1,73 @@
+"""
+Scaling of the sharded multi-process scoring against scoring on the main process.
+The queries are the titles and paragraphs of the recorded Google News fixtures, repeated up to --queries, and the
+corpus is a random unit-norm matrix of --corpus-size rows unless the embedding cache for the labeled data exists.
+
+    python -m benchmarks.bench_sharded --queries 5000 --workers 1 2 4 8 16 32
+"""
+
+from modules.scoring import news_queries
+from modules.sentiment import EmbeddedSentiment, RuleBasedSentiment
+from modules.sharded import ShardedScorer
+from benchmarks.run_benchmarks import BenchmarkSuite
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--corpus-size", type=int, default=100000)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    suite = BenchmarkSuite(corpus_size=args.corpus_size)
+    queries, _ = news_queries(suite._news_df())
+    queries = (queries * -(-args.queries // len(queries)))[: args.queries]
+    embed = EmbeddedSentiment()
+    embeddings, labels, corpus = suite._corpus(embed)
+    print(
+        f"{len(queries)} queries, {corpus} corpus of {embeddings.shape[0]} x {embeddings.shape[1]}, "
+        f"{os.cpu_count()} cores"
+    )
+
+    # Main process baseline, with the model already loaded
+    embed.create_embeddings(["warm up"])
+    start = time.perf_counter()
+    expected_embed = embed.score_batch(
+        queries=queries,
+        corpus_embeddings=embeddings,
+        sentiment_labels=labels,
+        limit=args.k,
+    )
+    expected_rules = (
+        RuleBasedSentiment().score_many(queries=queries)["compound"].to_numpy()
+    )
+    baseline_s = time.perf_counter() - start
+    print(f"{'main process':>14}: {len(queries) / baseline_s:9.1f} queries/s")
+
+    for n_workers in args.workers:
+        with ShardedScorer(
+            corpus_embeddings=embeddings,
+            sentiment_labels=labels,
+            model_name=embed.model_name,
+            n_workers=n_workers,
+        ) as scorer:
+            # Start every worker and load its model before timing
+            scorer.score(queries=queries[: n_workers * 2], k=args.k)
+            start = time.perf_counter()
+            embed_scores, rules_scores = scorer.score(queries=queries, k=args.k)
+            sharded_s = time.perf_counter() - start
+
+        assert np.allclose(embed_scores, expected_embed, atol=1e-6)
+        assert np.array_equal(rules_scores, expected_rules)
+        speedup = baseline_s / sharded_s
+        print(
+            f"{f'{n_workers} workers':>14}: {len(queries) / sharded_s:9.1f} queries/s "
+            f"({speedup:.2f}x, {speedup / n_workers:.0%} parallel efficiency)"
+        )
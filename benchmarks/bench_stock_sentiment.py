@@ -0,0 +1,84 @@
+"""
+Throughput of the Reddit ticker sentiment, one post at a time against the batched nlp.pipe and flair path.
+The recorded Reddit posts in benchmarks/fixtures are repeated up to the requested number of comments.
+Needs spaCy with en_core_web_sm and flair.
+
+    python -m benchmarks.bench_stock_sentiment --comments 2000 --n-process 1 2 4
+"""
+
+from benchmarks.fixtures import load_reddit_posts
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "trending_stock_sentiment",
+    ),
+)
+import stock_sentiment  # noqa: E402
+
+
+def legacy_stock_sentiment(df: pd.DataFrame) -> pd.DataFrame:
+    # Previous implementation: the full spaCy pipeline and one flair prediction per row
+    df = df.copy()
+    df["entities"] = df["posts"].apply(stock_sentiment.get_entities)
+    df = df[df["entities"].str.len() > 0].copy()
+    df["sentiment"] = df["posts"].apply(stock_sentiment.get_sentiment)
+    return df
+
+
+def entity_texts(entities) -> list:
+    return sorted(entity.text for entity in entities)
+
+
+def labels(df: pd.DataFrame) -> list:
+    return [s.split(" ")[-1] for s in df["sentiment"]]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--comments", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--sentiment-batch-size", type=int, default=32)
+    parser.add_argument("--n-process", type=int, nargs="+", default=[1, 2])
+    args = parser.parse_args()
+
+    posts = load_reddit_posts()
+    repeats = -(-args.comments // posts.shape[0])
+    df = pd.concat([posts] * repeats, ignore_index=True).iloc[: args.comments]
+
+    start = time.perf_counter()
+    legacy = legacy_stock_sentiment(df)
+    legacy_s = time.perf_counter() - start
+    print(
+        f"{'per row':>24}: {df.shape[0] / legacy_s:8.1f} comments/s ({legacy_s:.2f} s)"
+    )
+
+    for n_process in args.n_process:
+        start = time.perf_counter()
+        batched = stock_sentiment.StockSentiment(
+            df.copy(),
+            batch_size=args.batch_size,
+            n_process=n_process,
+            sentiment_batch_size=args.sentiment_batch_size,
+        ).get_stock_sentiment()
+        batched_s = time.perf_counter() - start
+
+        # The disabled components do not feed NER, so the entities and labels must not change
+        assert list(batched.index) == list(legacy.index)
+        assert [entity_texts(e) for e in batched["entities"]] == [
+            entity_texts(e) for e in legacy["entities"]
+        ]
+        assert labels(batched) == labels(legacy)
+        print(
+            f"{f'batched, n_process={n_process}':>24}: {df.shape[0] / batched_s:8.1f} comments/s "
+            f"({batched_s:.2f} s, {legacy_s / batched_s:.1f}x)"
+        )
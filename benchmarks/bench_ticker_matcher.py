@@ -0,0 +1,108 @@
+"""
+Throughput and agreement of the ticker matcher against spaCy NER on Reddit posts.
+The posts are the recorded Reddit posts in benchmarks/fixtures, or the 'posts' column of --posts-file, repeated up
+to --posts. The ORG entities found by NER are mapped to tickers with the same matcher, the precision is the share
+of (post, ticker) pairs of the matcher that NER also found and the recall the share of NER pairs the matcher found.
+The NER part needs spaCy with en_core_web_sm and is skipped without it.
+
+    python -m benchmarks.bench_ticker_matcher --posts 5000 --posts-file trending_stock_sentiment/posts.csv
+"""
+
+from benchmarks.fixtures import load_reddit_posts
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "trending_stock_sentiment",
+    ),
+)
+import stock_sentiment  # noqa: E402
+from ticker_matcher import TickerMatcher  # noqa: E402
+
+
+def pairs(tickers_per_post: list) -> set:
+    return set(
+        (i, ticker) for i, tickers in enumerate(tickers_per_post) for ticker in tickers
+    )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--posts-file", default=None)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument(
+        "--symbol-table",
+        default=None,
+        help="Match every symbol of a modules/symbol_table.py SQLite file instead of tickers.csv.",
+    )
+    args = parser.parse_args()
+
+    if args.posts_file is None:
+        posts = load_reddit_posts()
+    else:
+        posts = pd.read_csv(args.posts_file)
+    texts = posts["posts"].fillna("").astype(str).tolist()
+    texts = (texts * -(-args.posts // len(texts)))[: args.posts]
+
+    start = time.perf_counter()
+    if args.symbol_table is None:
+        matcher = TickerMatcher.from_file()
+    else:
+        matcher = TickerMatcher.from_symbol_table(args.symbol_table)
+    build_s = time.perf_counter() - start
+    print(
+        f"{len(texts)} posts, {len(matcher.symbols)} symbols and {len(matcher.goto) - 1} name states "
+        f"built in {build_s * 1000:.1f} ms"
+    )
+
+    start = time.perf_counter()
+    matched = matcher.match_many(texts)
+    matcher_s = time.perf_counter() - start
+    print(
+        f"{'ticker matcher':>16}: {len(texts) / matcher_s:10.1f} posts/s, "
+        f"{sum(len(m) > 0 for m in matched)} posts with a ticker"
+    )
+
+    try:
+        # Model loading is not part of the throughput
+        stock_sentiment.get_nlp()
+    except (ImportError, OSError) as e:
+        print(f"{'spaCy NER':>16}: skipped, could not load the spaCy model: {e}")
+        sys.exit(0)
+
+    start = time.perf_counter()
+    entities = stock_sentiment.get_entities_batch(texts, batch_size=args.batch_size)
+    ner_s = time.perf_counter() - start
+    print(
+        f"{'spaCy NER':>16}: {len(texts) / ner_s:10.1f} posts/s, "
+        f"{sum(len(e) > 0 for e in entities)} posts with an ORG entity "
+        f"(matcher is {ner_s / matcher_s:.0f}x faster)"
+    )
+
+    ner_tickers = []
+    unmapped = 0
+    for post_entities in entities:
+        tickers = []
+        for entity in post_entities:
+            mapped = matcher.match(entity.text)
+            unmapped += len(mapped) == 0
+            tickers.extend(t for t in mapped if t not in tickers)
+        ner_tickers.append(tickers)
+
+    matcher_pairs, ner_pairs = pairs(matched), pairs(ner_tickers)
+    both = len(matcher_pairs & ner_pairs)
+    print(
+        f"precision against NER: {both / max(len(matcher_pairs), 1):.1%}, "
+        f"recall against NER: {both / max(len(ner_pairs), 1):.1%}, "
+        f"{unmapped} ORG entities did not map to a ticker"
+    )
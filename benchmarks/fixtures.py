@@ -0,0 +1,142 @@
+"""
+Recorded responses for the offline benchmarks.
+The fixtures folder holds one Google News RSS feed, the redirect and article pages its items point to, a
+yahooquery price frame and Reddit listing/comment JSON, plus a manifest that maps each URL to its file.
+ReplayHttpClient serves those files through the same interface as modules.http_client.HttpClient, so the
+pipeline classes run unchanged without any network access.
+"""
+
+from modules.extraction import read_until
+from modules.yahoo_finance import YahooFinance
+
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pandas as pd
+import requests
+from requests.structures import CaseInsensitiveDict
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+MANIFEST = "manifest.json"
+
+
+def load_manifest(fixture_dir: str = FIXTURE_DIR) -> dict:
+    with open(os.path.join(fixture_dir, MANIFEST), "r") as f:
+        return json.load(f)
+
+
+class ReplayHttpClient(object):
+    """
+    Serves recorded responses by URL. Routes ending in '*' match any URL with that prefix, e.g. the RSS search URL.
+    Unknown URLs raise a ConnectionError like an unreachable host would.
+    """
+
+    def __init__(self, fixture_dir: str = FIXTURE_DIR) -> None:
+        self.fixture_dir = fixture_dir
+        self.routes = load_manifest(fixture_dir)["routes"]
+        self._bodies = {}
+        self.requests = 0
+
+    def _body(self, filename: str) -> bytes:
+        if filename not in self._bodies:
+            with open(os.path.join(self.fixture_dir, filename), "rb") as f:
+                self._bodies[filename] = f.read()
+        return self._bodies[filename]
+
+    def _route(self, url: str) -> Optional[dict]:
+        if url in self.routes:
+            return self.routes[url]
+        for pattern, route in self.routes.items():
+            if pattern.endswith("*") and url.startswith(pattern[:-1]):
+                return route
+        return None
+
+    def get(
+        self,
+        url: str,
+        source: Optional[str] = None,
+        stop_at: Optional[bytes] = None,
+        **kwargs,
+    ) -> requests.models.Response:
+        self.requests += 1
+        route = self._route(url)
+        if route is None:
+            raise requests.exceptions.ConnectionError(f"No fixture for '{url}'.")
+        body = self._body(route["file"])
+        if stop_at is not None:
+            body = read_until([body], marker=stop_at)
+
+        response = requests.models.Response()
+        response.status_code = route.get("status", 200)
+        response.headers = CaseInsensitiveDict(
+            {"Content-Type": route.get("content_type", "text/html; charset=utf-8")}
+        )
+        response._content = body
+        response.url = url
+        response.encoding = "utf-8"
+
+        return response
+
+    def post(self, url: str, **kwargs) -> requests.models.Response:
+        return self.get(url, **kwargs)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"requests": self.requests}
+
+    def close(self) -> None:
+        pass
+
+
+class ReplayYahooFinance(YahooFinance):
+    # Price history comes from the recorded yahooquery frames instead of yahooquery
+    def __init__(self, fixture_dir: str = FIXTURE_DIR, **kwargs) -> None:
+        super().__init__(http_client=ReplayHttpClient(fixture_dir), **kwargs)
+        self.fixture_dir = fixture_dir
+        self.prices = load_manifest(fixture_dir)["prices"]
+
+    def get_historical_data(
+        self, ticker: str, start: datetime, end: datetime, type: str = "history"
+    ) -> pd.DataFrame:
+        filename = self.prices.get(ticker.upper())
+        if filename is None:
+            return pd.DataFrame()
+        data = pd.read_csv(os.path.join(self.fixture_dir, filename))
+        dates = pd.to_datetime(data["date"])
+        data = data[(dates >= start) & (dates < end)].reset_index(drop=True)
+        data["index"] = data.index
+
+        return data
+
+
+def load_reddit_posts(fixture_dir: str = FIXTURE_DIR) -> pd.DataFrame:
+    """
+    Titles and comments of the recorded Reddit posts in one 'posts' column, like Subreddit.get_all_comments.
+    """
+    manifest = load_manifest(fixture_dir)
+    with open(os.path.join(fixture_dir, manifest["reddit"]["listing"]), "r") as f:
+        listing = json.load(f)
+    with open(os.path.join(fixture_dir, manifest["reddit"]["comments"]), "r") as f:
+        comments = json.load(f)
+
+    posts = [child["data"] for child in listing["data"]["children"]]
+    texts = [post["title"] for post in posts]
+    for post in posts:
+        texts.extend(comments.get(post["id"], []))
+
+    return pd.DataFrame(texts, columns=["posts"])
+
+
+def article_files(fixture_dir: str = FIXTURE_DIR) -> List[str]:
+    # Paths of the recorded article pages, used as input for the extraction benchmarks
+    manifest = load_manifest(fixture_dir)
+    return [
+        os.path.join(fixture_dir, route["file"])
+        for route in manifest["routes"].values()
+        if route.get("kind") == "article"
+    ]
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,125 @@
+"""
+Records fresh fixtures for the offline benchmarks from the live services.
+Needs network access. The bundled fixtures can be replaced with a recording for any ticker:
+
+    python -m benchmarks.record_fixtures AAPL --articles 30 --subreddit stocks
+"""
+
+from modules.extraction import extract_canonical_url, parse_html
+from modules.googlenews import GoogleNews
+from modules.http_client import HttpClient
+from modules.yahoo_finance import YahooFinance
+from benchmarks.fixtures import FIXTURE_DIR, MANIFEST
+
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+
+REDDIT_HEADERS = {"User-Agent": "CS410_Project/0.0.1"}
+
+
+def save(fixture_dir: str, filename: str, body: bytes) -> str:
+    with open(os.path.join(fixture_dir, filename), "wb") as f:
+        f.write(body)
+    return filename
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Record benchmark fixtures.")
+    parser.add_argument("ticker")
+    parser.add_argument("--articles", type=int, default=30)
+    parser.add_argument("--subreddit", default="stocks")
+    parser.add_argument("--comment-posts", type=int, default=10)
+    parser.add_argument("--fixture-dir", default=FIXTURE_DIR)
+    args = parser.parse_args()
+    ticker = args.ticker.upper()
+    fixture_dir = args.fixture_dir
+    if not os.path.exists(fixture_dir):
+        os.makedirs(fixture_dir)
+
+    # No response cache so every recording comes from the network
+    http = HttpClient()
+    gn = GoogleNews(http_client=http)
+    yfin = YahooFinance(http_client=http)
+    company = yfin.fetch_company_name(ticker=ticker)
+    if company is None:
+        raise Exception(f"'{ticker}' is not a valid ticker symbol.")
+
+    routes = {}
+    rss = gn.search(query=ticker)
+    routes[gn.BASE_URL + "/search*"] = {
+        "file": save(fixture_dir, "google_news_rss.xml", rss.content),
+        "kind": "rss",
+        "content_type": "application/xml; charset=utf-8",
+    }
+    items = list(gn.iter_search_items(response=rss))[: args.articles]
+    dates = []
+    for i, item in enumerate(items):
+        dates.append(item["date"])
+        redirect = http.get(item["link_rss"], headers=gn._create_headers(), timeout=10)
+        routes[item["link_rss"]] = {
+            "file": save(fixture_dir, f"redirect_{i:03d}.html", redirect.content),
+            "kind": "redirect",
+        }
+        canonical_url = extract_canonical_url(parse_html(redirect.content))
+        if canonical_url is None or canonical_url in routes:
+            continue
+        article = http.get(canonical_url, headers=gn._create_headers(), timeout=10)
+        routes[canonical_url] = {
+            "file": save(fixture_dir, f"article_{i:03d}.html", article.content),
+            "kind": "article",
+        }
+
+    # Quote page for the company name and daily prices covering the news dates
+    routes[yfin.base_url + ticker] = {
+        "file": save(
+            fixture_dir,
+            f"quote_{ticker}.html",
+            http.get(yfin.base_url + ticker, timeout=10).content,
+        ),
+        "kind": "quote",
+    }
+    start = datetime.strptime(min(dates), "%Y-%m-%d") - timedelta(days=30)
+    prices = yfin.get_historical_data(ticker=ticker, start=start, end=datetime.now())
+    if prices is None:
+        raise Exception(f"Could not download the price history of '{ticker}'.")
+    prices_file = f"prices_{ticker}.csv"
+    prices.to_csv(os.path.join(fixture_dir, prices_file), index=False)
+
+    listing = http.get(
+        f"https://www.reddit.com/r/{args.subreddit}/rising.json",
+        headers=REDDIT_HEADERS,
+        timeout=10,
+    ).json()
+    comments = {}
+    for child in listing["data"]["children"][: args.comment_posts]:
+        post_id = child["data"]["id"]
+        thread = http.get(
+            f"https://www.reddit.com/comments/{post_id}.json",
+            headers=REDDIT_HEADERS,
+            timeout=10,
+        ).json()
+        comments[post_id] = [
+            c["data"]["body"]
+            for c in thread[1]["data"]["children"]
+            if c.get("kind") == "t1"
+        ]
+    save(fixture_dir, "reddit_rising.json", json.dumps(listing).encode("utf-8"))
+    save(fixture_dir, "reddit_comments.json", json.dumps(comments).encode("utf-8"))
+
+    manifest = {
+        "ticker": ticker,
+        "company": company,
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        "routes": routes,
+        "prices": {ticker: prices_file},
+        "reddit": {
+            "listing": "reddit_rising.json",
+            "comments": "reddit_comments.json",
+        },
+    }
+    with open(os.path.join(fixture_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=4)
+    print(f"Recorded {len(routes)} responses for '{ticker}' into '{fixture_dir}'.")
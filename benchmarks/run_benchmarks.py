@@ -0,0 +1,550 @@
+"""
+Offline benchmark suite for every stage of the Google News and Reddit pipelines.
+All network responses are replayed from benchmarks/fixtures, so the numbers only reflect local work and are
+comparable between versions. Results are written as JSON; pass an earlier result file with --compare to see which
+stages got slower or faster.
+
+    python -m benchmarks.run_benchmarks --repeat 5
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/benchmark_20221216_150000.json
+
+Stages that need a model or package that is not installed (sentence-transformers, spaCy, flair) are recorded as
+skipped instead of failing the whole run.
+"""
+
+from modules.dedup import dedup_news
+from modules.extraction import (
+    HEAD_END,
+    compile_query_pattern,
+    extract_canonical_url,
+    extract_paragraphs,
+    parse_html,
+    read_until,
+)
+from modules.googlenews import GoogleNews
+from modules.price_store import PriceStore
+from benchmarks.fixtures import (
+    FIXTURE_DIR,
+    ReplayHttpClient,
+    ReplayYahooFinance,
+    article_files,
+    load_manifest,
+    load_reddit_posts,
+)
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+# Modules that should only be imported once a model is actually needed
+HEAVY_MODULES = ["torch", "sentence_transformers", "transformers", "spacy", "flair"]
+DATA_PATH = "./assets/stock_sentiment_data.csv"
+
+
+class Skip(Exception):
+    pass
+
+
+def time_stage(
+    func: Callable[[], object],
+    items: int,
+    repeat: int,
+    setup: Optional[Callable] = None,
+) -> dict:
+    """
+    Runs func repeat times and reports the best and median wall time. setup runs before every repetition and is
+    not timed, e.g. to start from a cold cache.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+
+    return {
+        "items": items,
+        "repeat": repeat,
+        "best_s": best,
+        "median_s": statistics.median(timings),
+        "items_per_s": items / best if best > 0 else None,
+    }
+
+
+class BenchmarkSuite(object):
+    def __init__(
+        self,
+        fixture_dir: str = FIXTURE_DIR,
+        repeat: int = 3,
+        k: int = 100,
+        corpus_size: int = 20000,
+    ) -> None:
+        self.fixture_dir = fixture_dir
+        self.repeat = repeat
+        self.k = k
+        # Size of the random corpus used for the search stage when there is no embedding cache
+        self.corpus_size = corpus_size
+        self.manifest = load_manifest(fixture_dir)
+        self.ticker = self.manifest["ticker"]
+        self.company = self.manifest["company"]
+        self.results = {}
+        self._embed = None
+
+    def run_stage(self, name: str, stage: Callable[[], dict]) -> None:
+        try:
+            self.results[name] = stage()
+        except Skip as e:
+            self.results[name] = {"skipped": str(e)}
+        except ImportError as e:
+            self.results[name] = {"skipped": f"missing dependency: {e}"}
+        result = self.results[name]
+        if "skipped" in result:
+            print(f"{name:>36}: skipped ({result['skipped']})")
+        else:
+            print(
+                f"{name:>36}: {result['best_s'] * 1000:10.2f} ms best, "
+                f"{result['items_per_s']:10.1f} items/s ({result['items']} items)"
+            )
+
+    # Fixtures
+
+    def _google_news(self) -> GoogleNews:
+        return GoogleNews(http_client=ReplayHttpClient(self.fixture_dir))
+
+    def _rss_response(self):
+        gn = self._google_news()
+        return gn, gn.search(query=self.ticker)
+
+    def _news_df(self) -> pd.DataFrame:
+        gn, response = self._rss_response()
+        return gn.parse_search_response(
+            response=response, query_terms=[self.ticker, self.company]
+        )
+
+    def _articles(self) -> List[bytes]:
+        pages = []
+        for path in article_files(self.fixture_dir):
+            with open(path, "rb") as f:
+                pages.append(f.read())
+        return pages
+
+    def _embedder(self):
+        if self._embed is None:
+            from modules.sentiment import EmbeddedSentiment
+
+            try:
+                self._embed = EmbeddedSentiment()
+            except Exception as e:
+                raise Skip(f"could not load the embedding model: {e}")
+        return self._embed
+
+    def _corpus(self, embed) -> tuple:
+        # The cached labeled data embeddings if they exist, a random unit-norm corpus otherwise
+        from modules.embedding_cache import EmbeddingCache
+
+        cache = EmbeddingCache()
+        if os.path.exists(DATA_PATH) and cache.exists(
+            model_name=embed.model_name, filepath=DATA_PATH
+        ):
+            embeddings, labels = cache.load(
+                model_name=embed.model_name, filepath=DATA_PATH
+            )
+            return np.asarray(embeddings), np.asarray(labels), "embedding_cache"
+        rng = np.random.default_rng(0)
+        dim = embed.create_embeddings(["dimension probe"]).shape[1]
+        embeddings = rng.standard_normal((self.corpus_size, dim)).astype("float32")
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        labels = rng.integers(0, 2, size=self.corpus_size)
+        return embeddings, labels, "random"
+
+    # Stages
+
+    def bench_rss_parse(self) -> dict:
+        gn, response = self._rss_response()
+        items = list(gn.iter_search_items(response=response))
+        return time_stage(
+            lambda: list(gn.iter_search_items(response=response)),
+            items=len(items),
+            repeat=self.repeat,
+        )
+
+    def bench_parse_search_response(self) -> dict:
+        gn, response = self._rss_response()
+        n_items = len(list(gn.iter_search_items(response=response)))
+        return time_stage(
+            lambda: gn.parse_search_response(
+                response=response, query_terms=[self.ticker, self.company]
+            ),
+            items=n_items,
+            repeat=self.repeat,
+        )
+
+    def bench_canonical_extraction(self) -> dict:
+        pages = self._articles()
+        return time_stage(
+            lambda: [
+                extract_canonical_url(parse_html(read_until([p], HEAD_END)))
+                for p in pages
+            ],
+            items=len(pages),
+            repeat=self.repeat,
+        )
+
+    def bench_paragraph_extraction(self) -> dict:
+        pages = self._articles()
+        pattern = compile_query_pattern([self.ticker, self.company])
+        return time_stage(
+            lambda: [extract_paragraphs(parse_html(p), pattern) for p in pages],
+            items=len(pages),
+            repeat=self.repeat,
+        )
+
+    def bench_dedup(self) -> dict:
+        news_df = self._news_df()
+        return time_stage(
+            lambda: dedup_news(news_df), items=news_df.shape[0], repeat=self.repeat
+        )
+
+    def bench_rules(self) -> dict:
+        from modules.scoring import news_queries
+        from modules.sentiment import RuleBasedSentiment
+
+        queries, _ = news_queries(self._news_df())
+        scorers = []
+        return time_stage(
+            lambda: scorers[-1].score_many(queries=queries),
+            items=len(queries),
+            repeat=self.repeat,
+            # A new scorer every time so the memo starts empty
+            setup=lambda: scorers.append(RuleBasedSentiment()),
+        )
+
+    def bench_embed_encode(self) -> dict:
+        from modules.scoring import news_queries
+
+        embed = self._embedder()
+        queries, _ = news_queries(self._news_df())
+        return time_stage(
+            lambda: embed.create_embeddings(queries),
+            items=len(queries),
+            repeat=self.repeat,
+        )
+
+    def bench_embed_search(self) -> dict:
+        from modules.neighbors import ExactIndex
+        from modules.scoring import news_queries
+
+        embed = self._embedder()
+        queries, _ = news_queries(self._news_df())
+        query_embeddings = embed.create_embeddings(queries)
+        embeddings, labels, corpus = self._corpus(embed)
+        index = ExactIndex(embeddings)
+        result = time_stage(
+            lambda: index.search(query_embeddings, self.k),
+            items=len(queries),
+            repeat=self.repeat,
+        )
+        result.update({"corpus": corpus, "corpus_size": int(embeddings.shape[0])})
+        return result
+
+    def bench_calculate_return(self) -> dict:
+        news_df = self._news_df()
+        start = datetime.strptime(min(news_df["date"]), "%Y-%m-%d")
+        end = datetime.strptime(max(news_df["date"]), "%Y-%m-%d")
+        with tempfile.TemporaryDirectory() as tmp:
+            yfin = ReplayYahooFinance(self.fixture_dir)
+            # Cold: the price store is empty and the history is read from the recorded frame
+            result = time_stage(
+                lambda: yfin.calculate_return(ticker=self.ticker, start=start, end=end),
+                items=1,
+                repeat=self.repeat,
+                setup=lambda: setattr(
+                    yfin,
+                    "price_store",
+                    PriceStore(os.path.join(tmp, f"prices_{time.time_ns()}.sqlite")),
+                ),
+            )
+        return result
+
+    def bench_calculate_returns_windows(self) -> dict:
+        # Many (start, end) windows over the recorded price history in one vectorized call
+        prices = pd.read_csv(
+            os.path.join(self.fixture_dir, self.manifest["prices"][self.ticker])
+        )
+        first = datetime.strptime(prices["date"].min(), "%Y-%m-%d")
+        last = datetime.strptime(prices["date"].max(), "%Y-%m-%d")
+        rng = np.random.default_rng(0)
+        span = (last - first).days
+        windows = []
+        for offset, length in zip(
+            rng.integers(0, span - 30, 1000), rng.integers(5, 30, 1000)
+        ):
+            start = first + timedelta(days=int(offset))
+            windows.append((start, start + timedelta(days=int(length))))
+        with tempfile.TemporaryDirectory() as tmp:
+            yfin = ReplayYahooFinance(
+                self.fixture_dir, price_store=PriceStore(os.path.join(tmp, "p.sqlite"))
+            )
+            # Warm the store so only the return calculation is timed
+            yfin.calculate_returns(tickers=[self.ticker], windows=windows)
+            return time_stage(
+                lambda: yfin.calculate_returns(tickers=[self.ticker], windows=windows),
+                items=len(windows),
+                repeat=self.repeat,
+            )
+
+    def bench_stock_sentiment(self) -> dict:
+        posts = load_reddit_posts(self.fixture_dir)
+        sys.path.insert(
+            0,
+            os.path.join(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                "trending_stock_sentiment",
+            ),
+        )
+        try:
+            from stock_sentiment import StockSentiment, get_model, get_nlp
+
+            # Model loading is measured by the startup benchmark, not here
+            get_nlp()
+            get_model()
+        except (ImportError, OSError) as e:
+            raise Skip(f"could not load the spaCy/flair models: {e}")
+
+        return time_stage(
+            lambda: StockSentiment(posts.copy()).get_stock_sentiment(),
+            items=posts.shape[0],
+            repeat=self.repeat,
+        )
+
+    def bench_match_tickers(self) -> dict:
+        # The spaCy free alternative to the NER step of reddit.get_stock_sentiment
+        posts = load_reddit_posts(self.fixture_dir)["posts"].tolist()
+        sys.path.insert(
+            0,
+            os.path.join(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                "trending_stock_sentiment",
+            ),
+        )
+        from ticker_matcher import TickerMatcher
+
+        matcher = TickerMatcher.from_file()
+        return time_stage(
+            lambda: matcher.match_many(posts), items=len(posts), repeat=self.repeat
+        )
+
+    def bench_end_to_end(self) -> dict:
+        # fetch_news -> scoring -> summary -> return -> output store, the same steps as main_gnews.py
+        from main_gnews import fetch_news, build_summary
+        from modules.output_store import OutputStore, new_run_id
+        from modules.scoring import score_news
+        from modules.sentiment import RuleBasedSentiment
+
+        embed = self._embedder()
+        embeddings, labels, corpus = self._corpus(embed)
+
+        def pipeline() -> dict:
+            gn = self._google_news()
+            with tempfile.TemporaryDirectory() as tmp:
+                yfin = ReplayYahooFinance(
+                    self.fixture_dir,
+                    price_store=PriceStore(os.path.join(tmp, "p.sqlite")),
+                )
+                company = yfin.fetch_company_name(ticker=self.ticker)
+                news_df = fetch_news(gn=gn, ticker=self.ticker, company=company)
+                news_df = score_news(
+                    news_df=news_df,
+                    embed=embed,
+                    rules=RuleBasedSentiment(),
+                    stock_embeddings=embeddings,
+                    sentiment_labels=labels,
+                    k=self.k,
+                )
+                yearly_return = yfin.calculate_return(
+                    ticker=self.ticker,
+                    start=datetime.strptime(min(news_df["date"]), "%Y-%m-%d"),
+                    end=datetime.strptime(max(news_df["date"]), "%Y-%m-%d"),
+                )
+                summary = build_summary(
+                    ticker=self.ticker,
+                    company=company,
+                    news_df=news_df,
+                    yearly_return=yearly_return,
+                )
+                store = OutputStore(root=os.path.join(tmp, "dataset"))
+                run_id = new_run_id()
+                n_rows = store.write_articles(
+                    ticker=self.ticker, news_df=news_df, run_id=run_id
+                )
+                store.write_summary(summary, run_id=run_id, n_articles=n_rows)
+                return summary
+
+        result = time_stage(pipeline, items=1, repeat=self.repeat)
+        result.update({"corpus": corpus, "corpus_size": int(embeddings.shape[0])})
+        return result
+
+    # Startup, every run is a fresh interpreter
+
+    @staticmethod
+    def _python(args: List[str], cwd: str = REPO_DIR, check: bool = True) -> str:
+        process = subprocess.run(
+            [sys.executable] + args, cwd=cwd, capture_output=True, text=True
+        )
+        if check and process.returncode != 0:
+            error = (process.stderr.strip().splitlines() or ["unknown error"])[-1]
+            raise Skip(error)
+        return process.stdout
+
+    def bench_import_main_gnews(self) -> dict:
+        code = (
+            "import sys, json, main_gnews; "
+            f"print(json.dumps([m for m in {HEAVY_MODULES} if m in sys.modules]))"
+        )
+        heavy = json.loads(self._python(["-c", code]).strip().splitlines()[-1])
+        result = time_stage(
+            lambda: self._python(["-c", "import main_gnews"]),
+            items=1,
+            repeat=self.repeat,
+        )
+        result["heavy_modules_imported"] = heavy
+        return result
+
+    def bench_invalid_arguments(self) -> dict:
+        # Time until main_gnews.py rejects a bad k, before any model or network access
+        return time_stage(
+            lambda: self._python(["main_gnews.py", "AAPL", "1000", "k"], check=False),
+            items=1,
+            repeat=self.repeat,
+        )
+
+    def bench_import_stock_sentiment(self) -> dict:
+        return time_stage(
+            lambda: self._python(
+                ["-c", "import stock_sentiment"],
+                cwd=os.path.join(REPO_DIR, "trending_stock_sentiment"),
+            ),
+            items=1,
+            repeat=self.repeat,
+        )
+
+    def bench_embedding_model_load(self) -> dict:
+        code = (
+            "from modules.sentiment import EmbeddedSentiment; "
+            "EmbeddedSentiment().create_embeddings(['warm up'])"
+        )
+        return time_stage(
+            lambda: self._python(["-c", code]), items=1, repeat=self.repeat
+        )
+
+    def run(self, stages: Optional[List[str]] = None) -> Dict[str, dict]:
+        all_stages = {
+            "google_news.iter_search_items": self.bench_rss_parse,
+            "google_news.parse_search_response": self.bench_parse_search_response,
+            "extraction.canonical_url": self.bench_canonical_extraction,
+            "extraction.paragraphs": self.bench_paragraph_extraction,
+            "dedup.dedup_news": self.bench_dedup,
+            "rules.score_many": self.bench_rules,
+            "embed.encode": self.bench_embed_encode,
+            "embed.search": self.bench_embed_search,
+            "yahoo.calculate_return": self.bench_calculate_return,
+            "yahoo.calculate_returns_1000_windows": self.bench_calculate_returns_windows,
+            "reddit.get_stock_sentiment": self.bench_stock_sentiment,
+            "reddit.match_tickers": self.bench_match_tickers,
+            "end_to_end.google_news": self.bench_end_to_end,
+            "startup.import_main_gnews": self.bench_import_main_gnews,
+            "startup.invalid_arguments": self.bench_invalid_arguments,
+            "startup.import_stock_sentiment": self.bench_import_stock_sentiment,
+            "startup.embedding_model_load": self.bench_embedding_model_load,
+        }
+        for name, stage in all_stages.items():
+            if stages is None or any(name.startswith(s) for s in stages):
+                self.run_stage(name, stage)
+
+        return self.results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit or None,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(current: Dict[str, dict], baseline: Dict[str, dict]) -> None:
+    # Ratio of the best times, above 1 means the current run is slower
+    print(f"\n{'stage':>36}  {'baseline ms':>12}  {'current ms':>12}  {'ratio':>7}")
+    for name, result in current.items():
+        before = baseline.get(name, {})
+        if "best_s" not in result or "best_s" not in before:
+            continue
+        ratio = result["best_s"] / before["best_s"] if before["best_s"] > 0 else None
+        flag = " slower" if ratio and ratio > 1.1 else ""
+        print(
+            f"{name:>36}  {before['best_s'] * 1000:12.2f}  {result['best_s'] * 1000:12.2f}  {ratio:7.2f}{flag}"
+        )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmarks.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--corpus-size", type=int, default=20000)
+    parser.add_argument("--fixture-dir", default=FIXTURE_DIR)
+    parser.add_argument(
+        "--stages", nargs="*", default=None, help="Only run stages with these prefixes."
+    )
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None, help="Earlier result file.")
+    args = parser.parse_args()
+
+    suite = BenchmarkSuite(
+        fixture_dir=args.fixture_dir,
+        repeat=args.repeat,
+        k=args.k,
+        corpus_size=args.corpus_size,
+    )
+    results = suite.run(stages=args.stages)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    output_dir = os.path.dirname(output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(output, "w") as f:
+        json.dump({"environment": environment(), "stages": results}, f, indent=4)
+    print(f"\nResults written to '{output}'.")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(results, json.load(f)["stages"])
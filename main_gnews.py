@@ -1,48 +1,96 @@
-from modules.sentiment import EmbeddedSentiment, RuleBasedSentiment
+from modules.sentiment import EmbeddedSentiment, RuleBasedSentiment, INDEX_KINDS
 from modules.googlenews import GoogleNews
 from modules.yahoo_finance import YahooFinance
+from modules.scoring import score_news_incremental
+from modules.sharded import ShardedScorer
+from modules.state_store import ArticleStateStore
+from modules.dedup import dedup_news
 from modules.utils import logger as lg
+from modules.utils.metrics import get_registry
 
 import os
 import sys
 from datetime import datetime
 import numpy as np
-import json
 import pandas as pd
+from typing import Optional
 
 DATA_PATH = "./assets/stock_sentiment_data.csv"
 OUTPUT_FOLDER = "./output/"
+# The labeled data sample is drawn with a fixed seed, so stored scores are reused only for the same sample
+SAMPLE_SEED = 0
 
 stream_handler = lg.StreamLogging()
 logger = lg.CustomLogger(
     logger_name=os.path.basename(__file__), handlers=[stream_handler]
 ).get_logger()
+metrics = get_registry()
 
 
-def output_to_json(output: dict, output_path: str) -> None:
+def fetch_news(
+    gn: GoogleNews,
+    ticker: str,
+    company: str,
+    state_store: Optional[ArticleStateStore] = None,
+    dedup: bool = True,
+) -> pd.DataFrame:
 
-    output_dir = "/".join(output_path.split("/")[:-1])
-    if os.path.exists(output_dir):
-        with open(output_path, "w") as f:
-            json.dump(obj=output, fp=f, indent=4)
-    else:
-        os.makedirs(output_dir)
-        with open(output_path, "w") as f:
-            json.dump(obj=output, fp=f, indent=4)
+    logger.info(f"Searching Google News RSS feed for the ticker '{ticker}'...")
+    news_response = gn.search(query=ticker)
+    news_df = gn.parse_search_response(
+        response=news_response,
+        query_terms=[ticker, company],
+        state_store=state_store,
+    )
+    logger.info(f"Finished searching Google News RSS feed for the ticker '{ticker}'.")
+    if dedup:
+        # Syndicated copies of the same story are scored once and weighted by their cluster size
+        n_articles = news_df.shape[0]
+        with metrics.span("dedup"):
+            news_df = dedup_news(news_df)
+        metrics.inc("articles_deduplicated_total", n_articles - news_df.shape[0])
+        logger.info(
+            f"Collapsed {n_articles} articles into {news_df.shape[0]} clusters of near-duplicates."
+        )
+
+    return news_df
 
-    return None
 
+def scoring_key(
+    embed: EmbeddedSentiment, sample_size: Optional[int], k: int, index_kind: str
+) -> str:
+    # Stored article scores are only reused when they were computed with the same settings
+    return f"{embed.model_name};sample={sample_size};seed={SAMPLE_SEED};k={k};index={index_kind}"
 
-def output_to_csv(df: pd.DataFrame, output_path: str) -> None:
 
-    output_dir = "/".join(output_path.split("/")[:-1])
-    if os.path.exists(output_dir):
-        df.to_csv(path_or_buf=output_path, header=True)
-    else:
-        os.makedirs(output_dir)
-        df.to_csv(path_or_buf=output_path, header=True)
+def valid_mean(news_df: pd.DataFrame, column: str) -> float:
+    # Mean of a score column, leaving out the -999 placeholder for missing scores
+    valid = news_df[news_df[column] > -999]
+    if "cluster_size" in valid.columns and valid.shape[0] > 0:
+        # Each deduplicated article stands for cluster_size copies in the feed
+        return float(np.average(valid[column], weights=valid["cluster_size"]))
+    return float(valid[column].mean())
+
+
+def build_summary(
+    ticker: str, company: str, news_df: pd.DataFrame, yearly_return: float
+) -> dict:
+
+    output_dict = {
+        "ticker": ticker,
+        "company_name": company,
+        "earliest_news_date": min(news_df["date"]),
+        "latest_news_date": max(news_df["date"]),
+        "news_title_sentiment_KNN": valid_mean(news_df, "title_sentiment_embed"),
+        "news_title_sentiment_rules": valid_mean(news_df, "title_sentiment_rules"),
+        "article_sentiment_KNN": valid_mean(news_df, "article_sentiment_embed"),
+        "article_sentiment_rules": valid_mean(news_df, "article_sentiment_rules"),
+        "stock_market_return": float(yearly_return)
+        if yearly_return is not None
+        else None,
+    }
 
-    return None
+    return output_dict
 
 
 if __name__ == "__main__":
@@ -71,137 +119,133 @@ if __name__ == "__main__":
             "You did not enter a valid integer for k to be used in the k-NN sentiment analysis."
         )
 
-    if k > sample_size:
+    # Optional neighbour index type, 'exact' (default), 'ivf', 'sq8' or 'pq'. Every index but 'exact' covers the full labeled data.
+    try:
+        index_kind = str(sys.argv[4]).lower()
+    except IndexError:
+        index_kind = "exact"
+
+    if index_kind not in INDEX_KINDS:
+        raise Exception(
+            f"You entered '{index_kind}' for the neighbour index type. Please enter one of: {INDEX_KINDS}."
+        )
+
+    # Optional number of scoring processes, 1 (default) scores on the main process
+    try:
+        workers = int(sys.argv[5])
+    except IndexError:
+        workers = 1
+    except ValueError:
+        raise Exception(
+            "You did not enter a valid integer for the number of scoring processes."
+        )
+
+    if workers > 1 and index_kind != "exact":
+        workers = 1
+        logger.warning(
+            f"Scoring processes only support the 'exact' neighbour index, the '{index_kind}' index will be searched on the main process."
+        )
+
+    if index_kind != "exact":
+        sample_size = None
+        logger.info(
+            f"Using the '{index_kind}' neighbour index over the full labeled sentiment data, the sample size will be ignored."
+        )
+    elif k > sample_size:
         k = sample_size
         logger.warning(
             f"You entered a sample size of '{sample_size}' and a k of '{k}'. k cannot exceed sample size so sample size will be used as the value of k."
         )
 
     yfin = YahooFinance()
-    company = yfin.get_company_name(ticker=ticker)
+    with metrics.span("main.company_name"):
+        company = yfin.get_company_name(ticker=ticker)
 
-    if company.lower() == "ya":
+    if company is None:
         raise Exception(
             f"'{ticker}' is not a valid ticker symbol. Please enter a valid ticker symbol, e.g. 'AAPL'."
         )
 
     gn = GoogleNews()
     embed = EmbeddedSentiment()
+    if workers == 1:
+        # The embedding model loads in the background while the news is fetched
+        embed.warm()
     rules = RuleBasedSentiment()
+    # Articles fetched and scored on earlier runs are read from the local state store
+    state_store = ArticleStateStore()
 
-    logger.info(f"Searching Google News RSS feed for the ticker '{ticker}'...")
-    news_response = gn.search(query=ticker)
-    news_df = gn.parse_search_response(
-        response=news_response, query_terms=[ticker, company]
-    )
-    logger.info(f"Finished searching Google News RSS feed for the ticker '{ticker}'.")
-    logger.info(f"Retrieving stock data embeddings for sentiment analysis.")
-    stock_embed_df = embed.get_stock_data_embed(filepath=DATA_PATH, sample=1000)
-    # Vecotrize the Embeddings properly
-    stock_embeddings = np.asarray(stock_embed_df["Embeddings"].tolist())
-
-    # Compare news titles to the stock embeddings
-    news_titles = news_df["title"].tolist()
-    title_sentiment_embed = []
-    title_sentiment_rules = []
-    for title in news_titles:
-        title_embed = embed.create_embeddings(query=title)
-        similarity_scores = embed.calc_dot_product(
-            vector1=title_embed, vector2=stock_embeddings
-        )
-        closest_matches_idx = embed.get_closest_matches(
-            similarity_scores=similarity_scores, limit=100
+    with metrics.span("main.fetch_news"):
+        news_df = fetch_news(
+            gn=gn, ticker=ticker, company=company, state_store=state_store
         )
-        sentiment = embed.get_sentiment_scores(
-            indices=closest_matches_idx, sentiment_labels=stock_embed_df["Sentiment"]
+    logger.info(f"Retrieving stock data embeddings for sentiment analysis.")
+    # Embeddings are read from the on-disk cache and only computed on the first run
+    with metrics.span("main.load_corpus"):
+        stock_embeddings, sentiment_labels = embed.load_stock_data_embed(
+            filepath=DATA_PATH, sample=sample_size, seed=SAMPLE_SEED
         )
-        title_sentiment_embed.append(sentiment)
-        title_sentiment_rules.append(rules.get_compound_score(query=title))
-
-    # Add to news dataframe
-    news_df["title_sentiment_embed"] = title_sentiment_embed
-    news_df["title_sentiment_rules"] = title_sentiment_rules
-
-    # Now compare the article content, if it exists, to the stock embeddings.
-    article_content = news_df["article_content"]
-    article_content_sentiment_embed = []
-    article_content_sentiment_rules = []
-    for content in article_content:
-        # article_content is a list of lists so we need to go through the sub-list as well
-        content_sentiment_embed = []
-        content_sentiment_rules = []
-        for paragraph in content:
-            paragraph_embed = embed.create_embeddings(query=paragraph)
-            similarity_scores = embed.calc_dot_product(
-                vector1=paragraph_embed, vector2=stock_embeddings
-            )
-            closest_matches_idx = embed.get_closest_matches(
-                similarity_scores=similarity_scores, limit=100
-            )
-            sentiment_embed = embed.get_sentiment_scores(
-                indices=closest_matches_idx,
-                sentiment_labels=stock_embed_df["Sentiment"],
+        neighbor_index = None
+        if index_kind != "exact":
+            neighbor_index = embed.load_neighbor_index(
+                filepath=DATA_PATH, kind=index_kind
             )
-            content_sentiment_embed.append(sentiment_embed)
-            content_sentiment_rules.append(rules.get_compound_score(query=paragraph))
-        # Calculate average for the content (i.e. row in the news_df), if it exists
-        if len(content_sentiment_embed) > 0:
-            mean_content_sentiment_embed = sum(content_sentiment_embed) / len(
-                content_sentiment_embed
+        scorer = None
+        if workers > 1:
+            # The corpus goes into shared memory once and every worker process loads its own model
+            scorer = ShardedScorer(
+                corpus_embeddings=stock_embeddings,
+                sentiment_labels=sentiment_labels,
+                model_name=embed.model_name,
+                n_workers=workers,
             )
-        else:
-            # Pick an obvious score if it's empty
-            mean_content_sentiment_embed = -999
-        if len(content_sentiment_rules) > 0:
-            mean_content_sentiment_rules = sum(content_sentiment_rules) / len(
-                content_sentiment_rules
-            )
-        else:
-            # Pick an obvious score if it's empty
-            mean_content_sentiment_rules = -999
-
-        article_content_sentiment_embed.append(mean_content_sentiment_embed)
-        article_content_sentiment_rules.append(mean_content_sentiment_rules)
 
-    # Add to news dataframe
-    news_df["article_sentiment_embed"] = article_content_sentiment_embed
-    news_df["article_sentiment_rules"] = article_content_sentiment_rules
+    # The worker processes and the shared memory block are released even when scoring fails
+    try:
+        with metrics.span("main.score"):
+            news_df = score_news_incremental(
+                news_df=news_df,
+                embed=embed,
+                rules=rules,
+                stock_embeddings=stock_embeddings,
+                sentiment_labels=sentiment_labels,
+                k=k,
+                state_store=state_store,
+                scoring_key=scoring_key(
+                    embed=embed, sample_size=sample_size, k=k, index_kind=index_kind
+                ),
+                index=neighbor_index,
+                scorer=scorer,
+            )
+    finally:
+        if scorer is not None:
+            scorer.close()
+
+    with metrics.span("main.returns"):
+        yearly_return = yfin.calculate_return(
+            ticker=ticker,
+            start=datetime.strptime(min(news_df["date"]), "%Y-%m-%d"),
+            end=datetime.strptime(max(news_df["date"]), "%Y-%m-%d"),
+        )
 
-    yearly_return = yfin.calculate_return(
-        ticker=ticker,
-        start=datetime.strptime(min(news_df["date"]), "%Y-%m-%d"),
-        end=datetime.strptime(max(news_df["date"]), "%Y-%m-%d"),
+    output_dict = build_summary(
+        ticker=ticker, company=company, news_df=news_df, yearly_return=yearly_return
     )
 
-    output_dict = {
-        "ticker": ticker,
-        "company_name": company,
-        "earliest_news_date": min(news_df["date"]),
-        "latest_news_date": max(news_df["date"]),
-        "news_title_sentiment_KNN": float(
-            news_df[news_df["title_sentiment_embed"] > -999][
-                "title_sentiment_embed"
-            ].mean()
-        ),
-        "news_title_sentiment_rules": float(
-            news_df[news_df["title_sentiment_rules"] > -999][
-                "title_sentiment_rules"
-            ].mean()
-        ),
-        "article_sentiment_KNN": float(
-            news_df[news_df["article_sentiment_embed"] > -999][
-                "title_sentiment_embed"
-            ].mean()
-        ),
-        "article_sentiment_rules": float(
-            news_df[news_df["article_sentiment_rules"] > -999][
-                "title_sentiment_rules"
-            ].mean()
-        ),
-        "stock_market_return": float(yearly_return),
-    }
-
-    output_to_json(
-        output_dict, output_path=OUTPUT_FOLDER + f"{ticker}_google_news_summary.json"
-    )
-    output_to_csv(news_df, output_path=OUTPUT_FOLDER + f"{ticker}_google_news_data.csv")
+    # Appended to the partitioned Parquet dataset, query it with `python -m modules.output_store`. pyarrow is
+    # only imported here, after the arguments were validated
+    from modules.output_store import OutputStore, new_run_id
+
+    store = OutputStore(root=OUTPUT_FOLDER + "dataset")
+    run_id = new_run_id()
+    with metrics.span("main.write_output"):
+        n_rows = store.write_articles(ticker=ticker, news_df=news_df, run_id=run_id)
+        store.write_summary(output_dict, run_id=run_id, n_articles=n_rows)
+    logger.info(f"Saved {n_rows} articles of run '{run_id}' to '{store.root}'.")
+
+    # Per-run timings and counters, as JSON and in the Prometheus text format
+    metrics.write_json(OUTPUT_FOLDER + f"{ticker}_metrics.json")
+    metrics.write_prometheus(OUTPUT_FOLDER + f"{ticker}_metrics.prom")
+    for name, summary in metrics.to_dict()["spans"].items():
+        if name.startswith("main."):
+            logger.info(f"Stage '{name}' took {summary['total_s']:.2f} seconds.")
@@ -0,0 +1,253 @@
+"""
+Runs the Google News sentiment pipeline for a list of tickers in one process.
+The models, the labeled data embeddings and the HTTP clients are created once. The network phase of each ticker
+(company name, Google News, Yahoo Finance) runs on a thread pool while the main thread scores the tickers whose
+news has already arrived, so fetching one ticker overlaps with scoring another.
+"""
+
+from modules.sentiment import EmbeddedSentiment, RuleBasedSentiment, INDEX_KINDS
+from modules.googlenews import GoogleNews
+from modules.yahoo_finance import YahooFinance
+from modules.scoring import score_news, score_news_incremental
+from modules.state_store import ArticleStateStore
+from modules.utils import logger as lg
+from main_gnews import (
+    DATA_PATH,
+    OUTPUT_FOLDER,
+    SAMPLE_SEED,
+    fetch_news,
+    scoring_key,
+    build_summary,
+)
+
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import pandas as pd
+from typing import List, Optional
+
+stream_handler = lg.StreamLogging()
+logger = lg.CustomLogger(
+    logger_name=os.path.basename(__file__), handlers=[stream_handler]
+).get_logger()
+
+
+def read_tickers(inputs: List[str]) -> List[str]:
+    """
+    Each input is either a ticker symbol or a path to a file with one ticker per line.
+    Blank lines and lines starting with '#' are skipped and duplicates are dropped.
+    """
+    tickers = []
+    for item in inputs:
+        if os.path.isfile(item):
+            with open(item, "r") as f:
+                for line in f:
+                    line = line.split("#")[0].strip()
+                    if line:
+                        tickers.append(line.upper())
+        else:
+            tickers.append(item.upper())
+
+    return list(dict.fromkeys(tickers))
+
+
+def fetch_ticker(
+    ticker: str,
+    gn: GoogleNews,
+    yfin: YahooFinance,
+    state_store: Optional[ArticleStateStore] = None,
+) -> Optional[dict]:
+    # Network phase for one ticker. Returns None if the ticker could not be resolved.
+    company = yfin.get_company_name(ticker=ticker)
+    if company is None:
+        logger.warning(f"'{ticker}' is not a valid ticker symbol, skipping it.")
+        return None
+
+    news_df = fetch_news(gn=gn, ticker=ticker, company=company, state_store=state_store)
+    if news_df.shape[0] == 0:
+        logger.warning(
+            f"No Google News results for the ticker '{ticker}', skipping it."
+        )
+        return None
+
+    try:
+        yearly_return = yfin.calculate_return(
+            ticker=ticker,
+            start=datetime.strptime(min(news_df["date"]), "%Y-%m-%d"),
+            end=datetime.strptime(max(news_df["date"]), "%Y-%m-%d"),
+        )
+    except Exception as e:
+        logger.warning(
+            f"Received the exception '{e}' while calculating the return for ticker '{ticker}'."
+        )
+        yearly_return = None
+
+    return {
+        "ticker": ticker,
+        "company": company,
+        "news_df": news_df,
+        "yearly_return": yearly_return,
+    }
+
+
+def run_batch(
+    tickers: List[str],
+    sample_size: Optional[int],
+    k: int,
+    index_kind: str = "exact",
+    network_workers: int = 4,
+    output_folder: str = OUTPUT_FOLDER,
+    incremental: bool = True,
+) -> pd.DataFrame:
+
+    gn = GoogleNews()
+    yfin = YahooFinance()
+    embed = EmbeddedSentiment()
+    # The embedding model loads in the background while the first tickers are fetched
+    embed.warm()
+    rules = RuleBasedSentiment()
+    # Articles fetched and scored on earlier runs are read from the local state store
+    state_store = ArticleStateStore() if incremental else None
+    key = scoring_key(embed=embed, sample_size=sample_size, k=k, index_kind=index_kind)
+
+    logger.info("Retrieving stock data embeddings for sentiment analysis.")
+    stock_embeddings, sentiment_labels = embed.load_stock_data_embed(
+        filepath=DATA_PATH,
+        sample=None if index_kind != "exact" else sample_size,
+        seed=SAMPLE_SEED,
+    )
+    neighbor_index = None
+    if index_kind != "exact":
+        neighbor_index = embed.load_neighbor_index(filepath=DATA_PATH, kind=index_kind)
+
+    # Resolve every company name up front, only tickers missing from the symbol table go to Yahoo Finance
+    yfin.get_company_names(tickers=tickers)
+
+    from modules.output_store import OutputStore, new_run_id
+
+    # Every ticker of the batch is written to the output store under the same run
+    store = OutputStore(root=output_folder + "dataset")
+    run_id, run_at = new_run_id(), datetime.now()
+    summaries = []
+    with ThreadPoolExecutor(max_workers=network_workers) as executor:
+        futures = {
+            executor.submit(fetch_ticker, ticker, gn, yfin, state_store): ticker
+            for ticker in tickers
+        }
+        # Score each ticker on the main thread as soon as its network phase finishes
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                fetched = future.result()
+            except Exception as e:
+                logger.warning(
+                    f"Received the exception '{e}' while fetching news for ticker '{ticker}', skipping it."
+                )
+                continue
+            if fetched is None:
+                continue
+
+            logger.info(f"Scoring news for the ticker '{ticker}'...")
+            if state_store is not None:
+                news_df = score_news_incremental(
+                    news_df=fetched["news_df"],
+                    embed=embed,
+                    rules=rules,
+                    stock_embeddings=stock_embeddings,
+                    sentiment_labels=sentiment_labels,
+                    k=k,
+                    state_store=state_store,
+                    scoring_key=key,
+                    index=neighbor_index,
+                )
+            else:
+                news_df = score_news(
+                    news_df=fetched["news_df"],
+                    embed=embed,
+                    rules=rules,
+                    stock_embeddings=stock_embeddings,
+                    sentiment_labels=sentiment_labels,
+                    k=k,
+                    index=neighbor_index,
+                )
+            summary = build_summary(
+                ticker=ticker,
+                company=fetched["company"],
+                news_df=news_df,
+                yearly_return=fetched["yearly_return"],
+            )
+            n_rows = store.write_articles(
+                ticker=ticker, news_df=news_df, run_id=run_id, run_at=run_at
+            )
+            store.write_summary(
+                summary, run_id=run_id, run_at=run_at, n_articles=n_rows
+            )
+            summaries.append(summary)
+
+    # Keep the combined table in the order the tickers were given
+    summary_df = pd.DataFrame(summaries)
+    if summary_df.shape[0] > 0:
+        order = {ticker: i for i, ticker in enumerate(tickers)}
+        summary_df = summary_df.sort_values(
+            by="ticker", key=lambda x: x.map(order)
+        ).reset_index(drop=True)
+    logger.info(
+        f"Saved the articles and summaries of run '{run_id}' to '{store.root}'."
+    )
+
+    return summary_df
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Google News sentiment for a list of ticker symbols."
+    )
+    parser.add_argument(
+        "tickers",
+        nargs="+",
+        help="Ticker symbols and/or files with one ticker symbol per line.",
+    )
+    parser.add_argument("--sample-size", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--index", choices=INDEX_KINDS, default="exact")
+    parser.add_argument(
+        "--network-workers",
+        type=int,
+        default=4,
+        help="Number of tickers whose news is fetched concurrently.",
+    )
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="Fetch and score every article again instead of reusing earlier runs.",
+    )
+    args = parser.parse_args()
+
+    if args.sample_size > 111000:
+        raise Exception(
+            "The sample size you chose is larger than the number of data points in the labeled sentiment data."
+        )
+    k = args.k
+    if args.index == "exact" and k > args.sample_size:
+        k = args.sample_size
+        logger.warning(
+            f"You entered a sample size of '{args.sample_size}' and a k of '{args.k}'. k cannot exceed sample size so sample size will be used as the value of k."
+        )
+
+    tickers = read_tickers(args.tickers)
+    logger.info(
+        f"Running the Google News sentiment pipeline for {len(tickers)} ticker(s)."
+    )
+    summary_df = run_batch(
+        tickers=tickers,
+        sample_size=args.sample_size,
+        k=k,
+        index_kind=args.index,
+        network_workers=args.network_workers,
+        incremental=not args.full_refresh,
+    )
+    logger.info(
+        f"Finished {summary_df.shape[0]} of {len(tickers)} ticker(s). Query the summaries with 'python -m modules.output_store summaries'."
+    )
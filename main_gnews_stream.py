@@ -0,0 +1,72 @@
+"""
+Streaming variant of main_gnews.py. Each article is written to ./output/{ticker}_google_news_data.jsonl as soon as
+it has been fetched and scored instead of after the whole feed has been processed.
+"""
+
+from modules.sentiment import EmbeddedSentiment, RuleBasedSentiment, INDEX_KINDS
+from modules.googlenews import GoogleNews
+from modules.yahoo_finance import YahooFinance
+from modules.streaming import StreamingPipeline
+from modules.utils import logger as lg
+from main_gnews import DATA_PATH, OUTPUT_FOLDER
+
+import argparse
+import os
+import time
+
+stream_handler = lg.StreamLogging()
+logger = lg.CustomLogger(
+    logger_name=os.path.basename(__file__), handlers=[stream_handler]
+).get_logger()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Stream Google News sentiment for a ticker symbol as JSONL."
+    )
+    parser.add_argument("ticker")
+    parser.add_argument("--sample-size", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--index", choices=INDEX_KINDS, default="exact")
+    parser.add_argument("--fetch-workers", type=int, default=8)
+    args = parser.parse_args()
+    ticker = args.ticker.upper()
+
+    yfin = YahooFinance()
+    company = yfin.get_company_name(ticker=ticker)
+
+    if company is None:
+        raise Exception(
+            f"'{ticker}' is not a valid ticker symbol. Please enter a valid ticker symbol, e.g. 'AAPL'."
+        )
+
+    embed = EmbeddedSentiment()
+    embed.warm()
+    stock_embeddings, sentiment_labels = embed.load_stock_data_embed(
+        filepath=DATA_PATH, sample=None if args.index != "exact" else args.sample_size
+    )
+    neighbor_index = None
+    if args.index != "exact":
+        neighbor_index = embed.load_neighbor_index(filepath=DATA_PATH, kind=args.index)
+
+    pipeline = StreamingPipeline(
+        gn=GoogleNews(),
+        embed=embed,
+        rules=RuleBasedSentiment(),
+        corpus_embeddings=stock_embeddings,
+        sentiment_labels=sentiment_labels,
+        k=args.k,
+        index=neighbor_index,
+        fetch_workers=args.fetch_workers,
+    )
+
+    output_path = OUTPUT_FOLDER + f"{ticker}_google_news_data.jsonl"
+    logger.info(f"Streaming Google News sentiment for '{ticker}' to '{output_path}'...")
+    start = time.perf_counter()
+    written = pipeline.run(
+        query=ticker, query_terms=[ticker, company], output_path=output_path
+    )
+    logger.info(
+        f"Wrote {written} articles in {time.perf_counter() - start:.1f} seconds."
+    )
@@ -0,0 +1,143 @@
+"""
+Near-duplicate detection for news articles with MinHash and locality sensitive hashing.
+Syndicated wire stories show up in the Google News feed once per outlet with the same or almost the same title and
+paragraphs. Articles whose estimated Jaccard similarity is above a threshold are collapsed into one cluster, only
+the first article of each cluster is scored and the cluster size is kept as its weight.
+"""
+
+import hashlib
+import re
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+# Largest Mersenne prime below 2**64, the universal hash is (a * x + b) mod prime
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_TOKEN = re.compile(r"\w+")
+# Google News titles end with ' - <outlet>', which differs between copies of the same story
+_OUTLET_SUFFIX = re.compile(r"\s+-\s+[^-]+$")
+
+
+def shingles(text: str, size: int = 3) -> set:
+    # Word n-grams of the lowercased text, short texts fall back to their single words
+    tokens = _TOKEN.findall(text.lower())
+    if len(tokens) < size:
+        return set(tokens)
+    return set(" ".join(tokens[i : i + size]) for i in range(len(tokens) - size + 1))
+
+
+def _hash_shingle(shingle: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little"
+    )
+
+
+class MinHasher(object):
+    def __init__(self, num_perm: int = 64, seed: int = 0) -> None:
+        self.num_perm = num_perm
+        rng = np.random.default_rng(seed)
+        # a and b below 2**32 so a * x + b stays below 2**64 for 32 bit shingle hashes
+        self.a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signatures(self, documents: List[set]) -> np.ndarray:
+        # One row of num_perm minimum hash values per document, empty documents get all max values
+        signatures = np.full(
+            (len(documents), self.num_perm), np.iinfo(np.uint64).max, dtype=np.uint64
+        )
+        for i, document in enumerate(documents):
+            if len(document) == 0:
+                continue
+            hashes = np.fromiter(
+                (_hash_shingle(s) for s in document),
+                dtype=np.uint64,
+                count=len(document),
+            )
+            permuted = (hashes[:, None] * self.a + self.b) % _MERSENNE_PRIME
+            signatures[i] = permuted.min(axis=0)
+
+        return signatures
+
+
+def _find(parents: List[int], i: int) -> int:
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def cluster_near_duplicates(
+    documents: List[str],
+    threshold: float = 0.8,
+    num_perm: int = 64,
+    bands: int = 16,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Cluster id of every document, which is the position of the first document in its cluster.
+    Documents that share a band of their MinHash signature are candidates, and candidates whose estimated
+    Jaccard similarity is at least threshold are merged.
+    """
+    if num_perm % bands != 0:
+        raise Exception(
+            f"The number of permutations ({num_perm}) must be divisible by the number of bands ({bands})."
+        )
+    shingle_sets = [shingles(document) for document in documents]
+    signatures = MinHasher(num_perm=num_perm, seed=seed).signatures(shingle_sets)
+    rows = num_perm // bands
+
+    parents = list(range(len(documents)))
+    for band in range(bands):
+        buckets = {}
+        for i in range(len(documents)):
+            if len(shingle_sets[i]) == 0:
+                continue
+            buckets.setdefault(
+                signatures[i, band * rows : (band + 1) * rows].tobytes(), []
+            ).append(i)
+        for candidates in buckets.values():
+            first = candidates[0]
+            for other in candidates[1:]:
+                root_first, root_other = _find(parents, first), _find(parents, other)
+                if root_first == root_other:
+                    continue
+                similarity = np.mean(signatures[first] == signatures[other])
+                if similarity >= threshold:
+                    # The earlier document stays the representative
+                    parents[max(root_first, root_other)] = min(root_first, root_other)
+
+    return np.asarray([_find(parents, i) for i in range(len(documents))])
+
+
+def article_text(title: str, paragraphs: List[str]) -> str:
+    return " ".join([_OUTLET_SUFFIX.sub("", title or "")] + list(paragraphs))
+
+
+def dedup_news(news_df: pd.DataFrame, threshold: float = 0.8) -> pd.DataFrame:
+    """
+    Keeps one representative row per cluster of near-duplicate articles, compared on title and paragraphs.
+    The cluster_size column holds the number of articles each representative stands for.
+    """
+    news_df = news_df.reset_index(drop=True)
+    if news_df.shape[0] == 0:
+        news_df["cluster_size"] = pd.Series(dtype="int64")
+        return news_df
+
+    clusters = cluster_near_duplicates(
+        [
+            article_text(title, content)
+            for title, content in zip(news_df["title"], news_df["article_content"])
+        ],
+        threshold=threshold,
+    )
+    sizes = np.bincount(clusters, minlength=news_df.shape[0])
+    representatives = np.flatnonzero(clusters == np.arange(news_df.shape[0]))
+    news_df = news_df.iloc[representatives].reset_index(drop=True)
+    news_df["cluster_size"] = sizes[representatives]
+
+    return news_df
+
+
+if __name__ == "__main__":
+    pass
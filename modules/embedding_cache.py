@@ -0,0 +1,194 @@
+"""
+Persistent cache for the embeddings of the labeled stock sentiment corpus.
+The corpus is encoded once per (model, corpus file) pair and stored as float32 .npy files that are opened
+with np.memmap on later runs, so no sentences need to be re-encoded before news can be scored.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+DEFAULT_CACHE_DIR = "./assets/embedding_cache/"
+
+
+class EmbeddingCache(object):
+    def __init__(
+        self, cache_dir: str = DEFAULT_CACHE_DIR, chunk_size: int = 4096
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def file_hash(filepath: str) -> str:
+        sha = hashlib.sha256()
+        with open(filepath, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+
+        return sha.hexdigest()
+
+    def cache_key(self, model_name: str, filepath: str) -> str:
+        # Model names can contain slashes, e.g. 'sentence-transformers/all-mpnet-base-v2'
+        model_slug = model_name.replace("/", "__")
+        return f"{model_slug}_{self.file_hash(filepath)[:16]}"
+
+    def _paths(self, key: str) -> dict:
+        base = os.path.join(self.cache_dir, key)
+        return {
+            "embeddings": base + "_embeddings.npy",
+            "labels": base + "_labels.npy",
+            "meta": base + "_meta.json",
+        }
+
+    def index_path(self, model_name: str, filepath: str, name: str) -> str:
+        # Neighbour indexes built over a cached corpus are stored next to its embeddings
+        key = self.cache_key(model_name=model_name, filepath=filepath)
+        return os.path.join(self.cache_dir, f"{key}_{name}.npz")
+
+    def exists(self, model_name: str, filepath: str) -> bool:
+        paths = self._paths(self.cache_key(model_name=model_name, filepath=filepath))
+        return all(os.path.exists(p) for p in paths.values())
+
+    def build(self, embed, filepath: str) -> str:
+        """
+        Encodes the full corpus with the model held by `embed` (an EmbeddedSentiment) and writes the
+        embeddings chunk by chunk into a memory-mapped .npy file. Returns the cache key.
+        """
+        key = self.cache_key(model_name=embed.model_name, filepath=filepath)
+        paths = self._paths(key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        stock_df = pd.read_csv(filepath_or_buffer=filepath, header=0, index_col=0)
+        sentences = stock_df["Sentence"].astype(str).to_numpy()
+        labels = pd.to_numeric(stock_df["Sentiment"]).to_numpy()
+
+        # Encode the first chunk to find the embedding dimension of the model
+        first = embed.create_embeddings(
+            list(sentences[: self.chunk_size]), progress_bar=True
+        )
+        # Write to temporary files first so an interrupted build never leaves a half written cache behind
+        tmp_embeddings = paths["embeddings"] + ".tmp"
+        out = np.lib.format.open_memmap(
+            tmp_embeddings,
+            mode="w+",
+            dtype="float32",
+            shape=(len(sentences), first.shape[1]),
+        )
+        out[: len(first)] = first
+        for start in range(self.chunk_size, len(sentences), self.chunk_size):
+            stop = start + self.chunk_size
+            out[start:stop] = embed.create_embeddings(
+                list(sentences[start:stop]), progress_bar=True
+            )
+        out.flush()
+        del out
+
+        tmp_labels = paths["labels"] + ".tmp.npy"
+        np.save(tmp_labels, labels)
+        os.replace(tmp_embeddings, paths["embeddings"])
+        os.replace(tmp_labels, paths["labels"])
+
+        meta = {
+            "model_name": embed.model_name,
+            "corpus_file": os.path.abspath(filepath),
+            "rows": int(len(sentences)),
+            "dimension": int(first.shape[1]),
+        }
+        with open(paths["meta"], "w") as f:
+            json.dump(obj=meta, fp=f, indent=4)
+
+        return key
+
+    def load(
+        self, model_name: str, filepath: str
+    ) -> Tuple[np.memmap, npt.NDArray[np.int_]]:
+        paths = self._paths(self.cache_key(model_name=model_name, filepath=filepath))
+        # mmap_mode returns an np.memmap so the embeddings are paged in from disk on demand
+        embeddings = np.load(paths["embeddings"], mmap_mode="r")
+        labels = np.load(paths["labels"])
+
+        return embeddings, labels
+
+    def get(
+        self,
+        embed,
+        filepath: str,
+        sample: Optional[int] = None,
+        seed: Optional[int] = None,
+    ) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.int_]]:
+        """
+        Returns the corpus embeddings and sentiment labels, building the cache first if needed.
+        If `sample` is given, a random subset of rows is selected from the memmap by index.
+        """
+        if not self.exists(model_name=embed.model_name, filepath=filepath):
+            self.build(embed=embed, filepath=filepath)
+        embeddings, labels = self.load(model_name=embed.model_name, filepath=filepath)
+
+        if sample is None or sample >= embeddings.shape[0]:
+            return embeddings, labels
+
+        rng = np.random.default_rng(seed)
+        # Sorted indices keep the reads from the memmap sequential
+        indices = np.sort(rng.choice(embeddings.shape[0], size=sample, replace=False))
+
+        return np.asarray(embeddings[indices]), labels[indices]
+
+    def invalidate(
+        self, model_name: Optional[str] = None, filepath: Optional[str] = None
+    ) -> int:
+        """
+        Deletes cached embeddings. With a model name and corpus file only that entry is removed, otherwise
+        every entry in the cache directory is removed. Returns the number of files deleted.
+        """
+        if not os.path.exists(self.cache_dir):
+            return 0
+        if model_name is not None and filepath is not None:
+            key = self.cache_key(model_name=model_name, filepath=filepath)
+            # Neighbour indexes built over this entry are removed along with it
+            targets = list(self._paths(key).values()) + [
+                os.path.join(self.cache_dir, f)
+                for f in os.listdir(self.cache_dir)
+                if f.startswith(key) and f.endswith(".npz")
+            ]
+        else:
+            targets = [
+                os.path.join(self.cache_dir, f)
+                for f in os.listdir(self.cache_dir)
+                if f.endswith((".npy", ".npz", ".json", ".tmp"))
+            ]
+        removed = 0
+        for target in targets:
+            if os.path.exists(target):
+                os.remove(target)
+                removed += 1
+
+        return removed
+
+
+if __name__ == "__main__":
+    # e.g. python -m modules.embedding_cache rebuild --filepath ./assets/stock_sentiment_data.csv
+    parser = argparse.ArgumentParser(description="Manage the corpus embedding cache.")
+    parser.add_argument("command", choices=["rebuild", "invalidate"])
+    parser.add_argument("--filepath", default="./assets/stock_sentiment_data.csv")
+    parser.add_argument("--model-name", default="all-mpnet-base-v2")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(cache_dir=args.cache_dir)
+    if args.command == "invalidate":
+        removed = cache.invalidate(model_name=args.model_name, filepath=args.filepath)
+        print(f"Removed {removed} cached file(s).")
+    else:
+        from modules.sentiment import EmbeddedSentiment
+
+        cache.invalidate(model_name=args.model_name, filepath=args.filepath)
+        key = cache.build(
+            embed=EmbeddedSentiment(model_name=args.model_name), filepath=args.filepath
+        )
+        print(f"Rebuilt embedding cache '{key}'.")
@@ -0,0 +1,108 @@
+"""
+HTML extraction for news pages with lxml.
+Every document is parsed once, straight from the response bytes. The canonical URL only needs the <head> of a page,
+so that response body is read up to </head> and the rest is never downloaded. Article paragraphs are matched
+against the query terms with one precompiled pattern and kept as clean text.
+"""
+
+import re
+from typing import Iterable, List, Optional, Pattern
+
+from lxml import etree
+
+HEAD_END = b"</head>"
+
+_WHITESPACE = re.compile(r"\s+")
+_CHARSET = re.compile(r"charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+
+
+def read_until(
+    chunks: Iterable[bytes], marker: bytes = HEAD_END, max_bytes: int = 2 * 1024 * 1024
+) -> bytes:
+    """
+    Reads chunks until the marker appears (case insensitive) and returns the bytes up to and including it.
+    Returns everything read if the marker never appears or max_bytes is reached first.
+    """
+    marker = marker.lower()
+    buffer = bytearray()
+    for chunk in chunks:
+        # The marker can be split across two chunks
+        search_from = max(0, len(buffer) - len(marker) + 1)
+        buffer.extend(chunk)
+        loc = bytes(buffer[search_from:]).lower().find(marker)
+        if loc >= 0:
+            return bytes(buffer[: search_from + loc + len(marker)])
+        if len(buffer) >= max_bytes:
+            break
+
+    return bytes(buffer)
+
+
+def header_encoding(content_type: Optional[str]) -> Optional[str]:
+    # Only an explicit charset counts, otherwise lxml detects the encoding from the document itself
+    if not content_type:
+        return None
+    match = _CHARSET.search(content_type)
+    return match.group(1) if match else None
+
+
+def parse_html(body: bytes, encoding: Optional[str] = None) -> Optional[etree._Element]:
+    if not body:
+        return None
+    try:
+        parser = etree.HTMLParser(encoding=encoding, remove_comments=True)
+    except LookupError:
+        # Unknown charset in the response headers
+        parser = etree.HTMLParser(remove_comments=True)
+
+    return etree.HTML(body, parser=parser)
+
+
+def extract_canonical_url(dom: Optional[etree._Element]) -> Optional[str]:
+    """
+    href of <link rel='canonical'> in the <head>. Relative canonical links fall back to <link rel='alternate'>.
+    """
+    if dom is None:
+        return None
+    canonical = dom.xpath("//head//link[@rel='canonical']/@href")
+    if len(canonical) == 0:
+        return None
+    canonical_url = canonical[0]
+
+    if "http" not in canonical_url:
+        alternate = dom.xpath("//head//link[@rel='alternate']/@href")
+        if len(alternate) > 0:
+            canonical_url = alternate[0]
+
+    return canonical_url
+
+
+def compile_query_pattern(query_terms: List[str]) -> Optional[Pattern]:
+    # One alternation over every term, longest first, so each paragraph is scanned once
+    terms = sorted(set(q for q in query_terms if q), key=len, reverse=True)
+    if len(terms) == 0:
+        return None
+    return re.compile("|".join(re.escape(q) for q in terms))
+
+
+def clean_text(element: etree._Element) -> str:
+    return _WHITESPACE.sub(" ", "".join(element.itertext())).strip()
+
+
+def extract_paragraphs(
+    dom: Optional[etree._Element], pattern: Optional[Pattern]
+) -> List[str]:
+    # Clean text of every <p> that mentions at least one query term
+    if dom is None or pattern is None:
+        return []
+    paragraphs = []
+    for element in dom.iter("p"):
+        text = clean_text(element)
+        if text and pattern.search(text):
+            paragraphs.append(text)
+
+    return paragraphs
+
+
+if __name__ == "__main__":
+    pass
@@ -5,23 +5,58 @@ The PyPI package from the link above was not used since it had older dependencie
 
 from bs4 import BeautifulSoup
 from urllib.parse import quote_plus
-from dateparser import parse as parse_date
-from lxml import etree
 from fake_useragent import UserAgent
 import pandas as pd
 import requests
-from requests.adapters import HTTPAdapter
-import urllib3
 from urllib3.exceptions import ReadTimeoutError, ResponseError, MaxRetryError
-from typing import List
+from typing import Iterator, List, Optional, Tuple
+
+from modules.extraction import (
+    HEAD_END,
+    compile_query_pattern,
+    extract_canonical_url,
+    extract_paragraphs,
+    header_encoding,
+    parse_html,
+)
+from modules.http_client import HttpClient, get_shared_client
+from modules.state_store import ArticleStateStore
+from modules.utils.metrics import MetricsRegistry, get_registry
+from modules.utils.concurrency import HostLimiter, ordered_map
+
+
+def parse_date(text: str):
+    # dateparser compiles its timezone patterns on import (~0.4s), so it is only imported once a date is parsed
+    from dateparser import parse
+
+    return parse(text)
 
 
 class GoogleNews(object):
-    def __init__(self, lang="en", country="US", timeout=3):
+    def __init__(
+        self,
+        lang="en",
+        country="US",
+        timeout=3,
+        max_workers=16,
+        max_per_host=4,
+        http_client: HttpClient = None,
+        metrics: MetricsRegistry = None,
+    ):
         self.lang = lang.lower()
         self.country = country.upper()
         self.BASE_URL = "https://news.google.com/rss"
         self.timeout = timeout
+        # Global number of concurrent article fetches and the cap per host (the RSS links all point to news.google.com)
+        self.max_workers = max_workers
+        self.host_limiter = HostLimiter(max_per_host=max_per_host)
+        # Pooled session shared with the other modules unless a client is passed in
+        self.http_client = (
+            http_client if http_client is not None else get_shared_client()
+        )
+        self.metrics = metrics if metrics is not None else get_registry()
+        # Building a UserAgent parses its whole browser database, so it is done once and only .random is per request
+        self.user_agent = UserAgent()
 
     def _ceid(self):
         """Compile correct country-lang parameters for Google News RSS URL"""
@@ -37,28 +72,9 @@ class GoogleNews(object):
             raise Exception("Could not parse your date")
 
     def _create_headers(self):
-        headers = {"User-Agent": UserAgent().random}
+        headers = {"User-Agent": self.user_agent.random}
         return headers
 
-    def _http_adapter(self) -> HTTPAdapter:
-        retry_params = urllib3.Retry(
-            total=3,
-            read=3,
-            connect=3,
-            backoff_factor=0.5,
-            status_forcelist=(400, 404, 500, 502, 504),
-            allowed_methods=frozenset(
-                ["POST", "HEAD", "TRACE", "GET", "PUT", "OPTIONS", "DELETE"]
-            ),
-            raise_on_status=False,
-        )
-        adapter = HTTPAdapter(max_retries=retry_params)
-        http = requests.Session()
-        http.mount("https://", adapter)
-        http.mount("http://", adapter)
-
-        return http
-
     def search(self, query: str, helper=True, when=None, from_date=None, to_date=None):
 
         if when:
@@ -78,24 +94,32 @@ class GoogleNews(object):
         search_ceid = self._ceid()
         search_ceid = search_ceid.replace("?", "&")
 
-        http = self._http_adapter()
-        response = http.get(
-            self.BASE_URL + "/search?q={}".format(query) + search_ceid,
-            headers=self._create_headers(),
-            timeout=self.timeout,
-        )
+        http = self.http_client
+        with self.metrics.span("google_news.search"):
+            response = http.get(
+                self.BASE_URL + "/search?q={}".format(query) + search_ceid,
+                source="rss",
+                headers=self._create_headers(),
+                timeout=self.timeout,
+            )
 
         return response
 
     def get_canonical_url(self, rss_url: str) -> str:
         canonical_url = None
-        http = self._http_adapter()
+        http = self.http_client
         try:
-            response = http.get(
-                rss_url,
-                headers=self._create_headers(),
-                timeout=self.timeout,
-            )
+            with self.host_limiter.slot(rss_url), self.metrics.span(
+                "google_news.canonical_url"
+            ):
+                # Only the <head> is needed, the rest of the page is never downloaded
+                response = http.get(
+                    rss_url,
+                    source="canonical",
+                    stop_at=HEAD_END,
+                    headers=self._create_headers(),
+                    timeout=self.timeout,
+                )
         except (
             ReadTimeoutError,
             ResponseError,
@@ -103,40 +127,46 @@ class GoogleNews(object):
             requests.exceptions.ConnectionError,
             requests.exceptions.ConnectTimeout,
         ):
+            self.metrics.inc("articles_total", stage="canonical", result="error")
             return canonical_url
-        soup = BeautifulSoup(response.text, "lxml")
-        dom = etree.HTML(str(soup))
-        try:
-            element = dom.xpath("//head//link[@rel='canonical']")
-        except AttributeError:
-            return canonical_url
-        try:
-            canonical_url = element[0].get("href")
-        except IndexError:
-            return canonical_url
-
-        if "http" not in canonical_url:
-            try:
-                element = dom.xpath("//head//link[@rel='alternate']")
-                canonical_url = element[0].get("href")
-            except IndexError:
-                return canonical_url
+        dom = parse_html(
+            response.content,
+            encoding=header_encoding(response.headers.get("Content-Type")),
+        )
+        canonical_url = extract_canonical_url(dom)
+        self.metrics.inc(
+            "articles_total",
+            stage="canonical",
+            result="ok" if canonical_url is not None else "missing",
+        )
 
         return canonical_url
 
     def get_article_conents(self, canonical_url: str, query_terms: List[str]) -> list:
+        return self._fetch_article_contents(
+            canonical_url=canonical_url, query_terms=query_terms
+        )[0]
+
+    def _fetch_article_contents(
+        self, canonical_url: str, query_terms: List[str]
+    ) -> Tuple[list, bool]:
+        # (paragraphs, whether the page was fetched), failed requests should be retried instead of stored
         content = []
         if canonical_url is None:
-            return content
+            return content, False
         if type(query_terms) == str:
             query_terms = [query_terms]
-        http = self._http_adapter()
+        http = self.http_client
         try:
-            response = http.get(
-                canonical_url,
-                headers=self._create_headers(),
-                timeout=self.timeout,
-            )
+            with self.host_limiter.slot(canonical_url), self.metrics.span(
+                "google_news.article"
+            ):
+                response = http.get(
+                    canonical_url,
+                    source="article",
+                    headers=self._create_headers(),
+                    timeout=self.timeout,
+                )
         except (
             ReadTimeoutError,
             ResponseError,
@@ -144,39 +174,92 @@ class GoogleNews(object):
             requests.exceptions.ConnectionError,
             requests.exceptions.ConnectTimeout,
         ):
-            return content
-        soup = BeautifulSoup(response.text, "lxml")
-        # Get all p tags
-        all_ps = soup.find_all("p")
+            self.metrics.inc("articles_total", stage="article", result="error")
+            return content, False
+        if response.status_code == 429 or response.status_code >= 500:
+            # Rate limited or a server error, the page may well be there on the next run
+            self.metrics.inc("articles_total", stage="article", result="error")
+            return content, False
+        dom = parse_html(
+            response.content,
+            encoding=header_encoding(response.headers.get("Content-Type")),
+        )
+        # Only need one of the query terms to match
+        content = extract_paragraphs(dom, compile_query_pattern(query_terms))
+        self.metrics.inc("articles_total", stage="article", result="ok")
+        self.metrics.observe(
+            "article_paragraphs", len(content), buckets=(0, 1, 2, 5, 10, 20, 50)
+        )
 
-        for x in all_ps:
-            for q in query_terms:
-                if q in str(x):
-                    content.append(str(x))
-                    # Only need one of the query terms to match
-                    break
+        return content, True
 
-        return content
+    def fetch_article(
+        self,
+        rss_url: str,
+        query_terms: List[str],
+        state_store: Optional[ArticleStateStore] = None,
+    ) -> Tuple[str, list]:
+        """
+        Resolves the canonical URL of an RSS item and then fetches the article contents.
+        With a state store, articles seen on earlier runs (by RSS link or by canonical URL) are not fetched again.
+        """
+        if state_store is not None:
+            known = state_store.get_fetched(rss_url)
+            if known is not None:
+                self.metrics.inc("articles_total", stage="fetch", result="stored")
+                return known["links_canonical"], known["article_content"]
+
+        canonical_url = self.get_canonical_url(rss_url)
+        content = None
+        if state_store is not None:
+            content = state_store.get_fetched_by_canonical(canonical_url)
+        fetched = content is not None
+        if content is None:
+            content, fetched = self._fetch_article_contents(
+                canonical_url=canonical_url, query_terms=query_terms
+            )
+        # Articles whose canonical URL could not be resolved or whose page could not be fetched are retried on
+        # the next run
+        if state_store is not None and fetched:
+            state_store.save_fetched(
+                link_rss=rss_url, canonical_url=canonical_url, paragraphs=content
+            )
+
+        return canonical_url, content
+
+    def iter_search_items(self, response: requests.models.Response) -> Iterator[dict]:
+        # Yields the date, title and RSS link of each item in the feed, in feed order
+        soup = BeautifulSoup(response.text, "xml")
+        for x in soup.find_all("item"):
+            yield {
+                "date": parse_date(x.find("pubDate").text).strftime("%Y-%m-%d"),
+                "title": x.find("title").text,
+                "link_rss": x.find("link").text,
+            }
 
     def parse_search_response(
-        self, response: requests.models.Response, query_terms: List[str]
+        self,
+        response: requests.models.Response,
+        query_terms: List[str],
+        state_store: Optional[ArticleStateStore] = None,
     ) -> pd.DataFrame:
 
-        soup = BeautifulSoup(response.text, "xml")
+        items = list(self.iter_search_items(response=response))
+        self.metrics.inc("rss_items_total", len(items))
+        dates = [x["date"] for x in items]
+        titles = [x["title"] for x in items]
+        links_rss = [x["link_rss"] for x in items]
 
-        items = [x for x in soup.find_all("item")]
-        dates = [x.find("pubDate").text for x in items]
-        dates = [parse_date(x).strftime("%Y-%m-%d") for x in dates]
-        titles = [x.find("title").text for x in items]
-        links_rss = [x.find("link").text for x in items]
-        links_canon = [self.get_canonical_url(x) for x in links_rss]
-
-        contents = []
-        for url in links_canon:
-            content = self.get_article_conents(
-                canonical_url=url, query_terms=query_terms
-            )
-            contents.append(content)
+        # Each article is resolved and fetched on the thread pool, results come back in RSS item order
+        fetched = ordered_map(
+            lambda rss_url: self.fetch_article(
+                rss_url=rss_url, query_terms=query_terms, state_store=state_store
+            ),
+            links_rss,
+            max_workers=self.max_workers,
+        )
+        links_canon = [x[0] for x in fetched]
+        contents = [x[1] for x in fetched]
 
         output = pd.DataFrame(
             list(zip(dates, titles, links_rss, links_canon, contents)),
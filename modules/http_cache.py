@@ -0,0 +1,192 @@
+"""
+Disk-backed HTTP response cache used by HttpClient.
+Responses are stored in SQLite with a per-source TTL. Stale entries that carry an ETag or Last-Modified header are
+revalidated with a conditional request, and the least recently used entries are evicted once the cache grows past
+its size cap.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_CACHE_PATH = "./cache/http_cache.sqlite"
+
+# Default time to live in seconds for each source. RSS feeds change quickly, article bodies and the
+# redirect pages used to resolve canonical URLs almost never do.
+DEFAULT_TTLS = {
+    "rss": 15 * 60,
+    "canonical": 30 * 24 * 60 * 60,
+    "article": 30 * 24 * 60 * 60,
+    "quote": 24 * 60 * 60,
+}
+
+# The cached body is already decoded so these headers no longer describe it
+_DROPPED_HEADERS = ["content-encoding", "content-length", "transfer-encoding"]
+
+
+class ResponseCache(object):
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_bytes: int = 512 * 1024 * 1024,
+        ttls: Optional[Dict[str, int]] = None,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "revalidated": 0,
+            "stored": 0,
+            "evicted": 0,
+        }
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                status INTEGER,
+                headers TEXT,
+                body BLOB,
+                etag TEXT,
+                last_modified TEXT,
+                expires_at REAL,
+                last_access REAL,
+                size INTEGER
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+        )
+        self.conn.commit()
+
+    def record(self, stat: str) -> None:
+        with self._lock:
+            self.stats[stat] += 1
+
+    def ttl(self, source: str) -> int:
+        return self.ttls.get(source, 0)
+
+    def lookup(self, url: str) -> Optional[dict]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT status, headers, body, etag, last_modified, expires_at FROM responses WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE responses SET last_access = ? WHERE url = ?", (time.time(), url)
+            )
+            self.conn.commit()
+
+        return {
+            "status": row[0],
+            "headers": json.loads(row[1]),
+            "body": row[2],
+            "etag": row[3],
+            "last_modified": row[4],
+            "fresh": row[5] > time.time(),
+        }
+
+    def store(self, url: str, response: requests.models.Response, source: str) -> None:
+        headers = {
+            k: v
+            for k, v in response.headers.items()
+            if k.lower() not in _DROPPED_HEADERS
+        }
+        body = response.content
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    response.status_code,
+                    json.dumps(headers),
+                    body,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    now + self.ttl(source),
+                    now,
+                    len(body),
+                ),
+            )
+            self.conn.commit()
+        self.record("stored")
+        self._evict()
+
+    def refresh(self, url: str, source: str) -> None:
+        # Called after a 304 Not Modified, the cached body is valid for another TTL
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "UPDATE responses SET expires_at = ?, last_access = ? WHERE url = ?",
+                (now + self.ttl(source), now, url),
+            )
+            self.conn.commit()
+
+    def _evict(self) -> None:
+        with self._lock:
+            total = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self.conn.execute(
+                "SELECT url, size FROM responses ORDER BY last_access ASC"
+            ).fetchall()
+            evicted = []
+            for url, size in rows:
+                if total <= self.max_bytes:
+                    break
+                evicted.append((url,))
+                total -= size
+            self.conn.executemany("DELETE FROM responses WHERE url = ?", evicted)
+            self.conn.commit()
+            self.stats["evicted"] += len(evicted)
+
+    @staticmethod
+    def to_response(url: str, entry: dict) -> requests.models.Response:
+        response = requests.models.Response()
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = entry["body"]
+        response.url = url
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+
+        return response
+
+    def clear(self) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.stats)
+            row = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        stats["entries"] = row[0]
+        stats["bytes"] = row[1]
+
+        return stats
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,231 @@
+"""
+Shared HTTP client used by GoogleNews, YahooFinance and Reddit.
+One requests.Session with keep-alive connection pools is reused for every request so TCP/TLS connections are
+reused across articles instead of paying a new handshake each time.
+"""
+
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from modules.extraction import read_until
+from modules.http_cache import ResponseCache
+from modules.utils.metrics import MetricsRegistry, get_registry
+
+
+class ConnectionStats(object):
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+        self.requests_sent = 0
+
+    def record_connection(self) -> None:
+        with self._lock:
+            self.connections_opened += 1
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.requests_sent += 1
+
+    def to_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests_sent,
+                "connections_opened": self.connections_opened,
+                # Every request that did not need a new connection went over a pooled keep-alive connection
+                "connections_reused": max(
+                    0, self.requests_sent - self.connections_opened
+                ),
+            }
+
+
+def _counting_pool(base_class, stats: ConnectionStats):
+    # urllib3 pool subclass that reports socket connects and requests to the shared stats.
+    # Counting in connect() also catches pooled connections that were dropped by the server and reconnected.
+    class CountingConnection(base_class.ConnectionCls):
+        def connect(self):
+            stats.record_connection()
+            return super().connect()
+
+    class CountingPool(base_class):
+        ConnectionCls = CountingConnection
+
+        def _make_request(self, *args, **kwargs):
+            stats.record_request()
+            return super()._make_request(*args, **kwargs)
+
+    return CountingPool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    def __init__(self, stats: ConnectionStats, **kwargs) -> None:
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self.stats),
+            "https": _counting_pool(HTTPSConnectionPool, self.stats),
+        }
+
+
+def default_retry() -> urllib3.Retry:
+    return urllib3.Retry(
+        total=3,
+        read=3,
+        connect=3,
+        backoff_factor=0.5,
+        status_forcelist=(400, 404, 500, 502, 504),
+        allowed_methods=frozenset(
+            ["POST", "HEAD", "TRACE", "GET", "PUT", "OPTIONS", "DELETE"]
+        ),
+        raise_on_status=False,
+    )
+
+
+class HttpClient(object):
+    def __init__(
+        self,
+        pool_connections: int = 32,
+        pool_maxsize: int = 16,
+        retry: Optional[urllib3.Retry] = None,
+        cache: Optional[ResponseCache] = None,
+        metrics: Optional[MetricsRegistry] = None,
+    ) -> None:
+        """
+        pool_connections is the number of hosts whose pools are kept alive and pool_maxsize is the number of
+        keep-alive connections kept per host. GET requests that name a source are served from `cache` if one is given.
+        """
+        self.cache = cache
+        self.metrics = metrics if metrics is not None else get_registry()
+        self.stats = ConnectionStats()
+        adapter = PooledHTTPAdapter(
+            stats=self.stats,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry if retry is not None else default_retry(),
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _send(
+        self,
+        url: str,
+        stop_at: Optional[bytes] = None,
+        source: Optional[str] = None,
+        **kwargs,
+    ) -> requests.models.Response:
+        start = time.perf_counter()
+        if stop_at is None:
+            response = self.session.get(url, **kwargs)
+        else:
+            response = self.session.get(url, stream=True, **kwargs)
+            try:
+                response._content = read_until(
+                    response.iter_content(chunk_size=16384), marker=stop_at
+                )
+            finally:
+                # The rest of the body is never read so the connection cannot go back to the pool
+                response.close()
+        self._record(response, source=source, seconds=time.perf_counter() - start)
+
+        return response
+
+    def _record(
+        self, response: requests.models.Response, source: Optional[str], seconds: float
+    ) -> None:
+        source = source or "other"
+        self.metrics.inc(
+            "http_requests_total", source=source, status=response.status_code
+        )
+        self.metrics.observe("http_request_duration_seconds", seconds, source=source)
+        # urllib3 keeps the attempts that were retried before this response in its Retry history
+        retries = getattr(getattr(response.raw, "retries", None), "history", None)
+        if retries:
+            self.metrics.inc("http_retries_total", len(retries), source=source)
+
+    def get(
+        self,
+        url: str,
+        source: Optional[str] = None,
+        stop_at: Optional[bytes] = None,
+        **kwargs,
+    ) -> requests.models.Response:
+        """
+        source names the kind of resource, e.g. 'rss' or 'article', and selects its TTL in the response cache.
+        Requests without a source, or with a source that has no TTL, always go to the network.
+        With stop_at, e.g. b'</head>', the body is only read up to that marker and the connection is closed,
+        so response.content (and the cached body) hold the truncated document.
+        """
+        if self.cache is None or source is None or self.cache.ttl(source) <= 0:
+            return self._send(url, stop_at=stop_at, source=source, **kwargs)
+
+        key = requests.Request("GET", url, params=kwargs.get("params")).prepare().url
+        if stop_at is not None:
+            # Truncated bodies are cached apart from the full document
+            key += "#stop_at=" + stop_at.decode("latin-1")
+        entry = self.cache.lookup(key)
+        if entry is not None and entry["fresh"]:
+            self.cache.record("hits")
+            self.metrics.inc("http_cache_total", source=source, result="hit")
+            return self.cache.to_response(url=key, entry=entry)
+
+        # Revalidate stale entries with a conditional request
+        headers = dict(kwargs.pop("headers", None) or {})
+        if entry is not None and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        response = self._send(
+            url, stop_at=stop_at, source=source, headers=headers, **kwargs
+        )
+
+        if entry is not None and response.status_code == 304:
+            self.cache.record("revalidated")
+            self.metrics.inc("http_cache_total", source=source, result="revalidated")
+            self.cache.refresh(url=key, source=source)
+            return self.cache.to_response(url=key, entry=entry)
+
+        self.cache.record("misses")
+        self.metrics.inc("http_cache_total", source=source, result="miss")
+        if response.status_code == 200:
+            self.cache.store(url=key, response=response, source=source)
+
+        return response
+
+    def post(self, url: str, **kwargs) -> requests.models.Response:
+        return self.session.post(url, **kwargs)
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = self.stats.to_dict()
+        if self.cache is not None:
+            stats.update({f"cache_{k}": v for k, v in self.cache.get_stats().items()})
+
+        return stats
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_client() -> HttpClient:
+    # Process wide client so every module shares the same connection pools
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = HttpClient(cache=ResponseCache())
+        return _shared_client
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,94 @@
+"""
+Process wide registry of the heavy NLP models.
+Models are only imported and loaded on first use and are then shared by every caller in the process, so invalid
+arguments or tickers fail fast without paying for torch and the model weights. warm() starts loading a model on a
+background thread, e.g. while the news is being fetched, and get() waits for that load instead of starting another.
+"""
+
+import threading
+from typing import Callable, Optional
+
+from modules.utils.metrics import get_registry
+
+
+class ModelRegistry(object):
+    def __init__(self) -> None:
+        self._models = {}
+        self._loaders = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, key: str, loader: Callable[[], object]) -> None:
+        # loader is called without arguments the first time the model is needed
+        with self._lock:
+            self._loaders.setdefault(key, loader)
+            self._locks.setdefault(key, threading.Lock())
+
+    def _loader(self, key: str) -> Callable[[], object]:
+        with self._lock:
+            if key not in self._loaders:
+                raise Exception(
+                    f"No model is registered under '{key}'. Registered models: {list(self._loaders.keys())}."
+                )
+            return self._loaders[key]
+
+    def get(self, key: str) -> object:
+        if key in self._models:
+            return self._models[key]
+        loader = self._loader(key)
+        # One lock per model so a slow load does not hold up other models
+        with self._locks[key]:
+            if key not in self._models:
+                with get_registry().span("models.load", model=key):
+                    self._models[key] = loader()
+        return self._models[key]
+
+    def warm(self, key: str) -> threading.Thread:
+        """
+        Loads the model on a daemon thread. Errors are not raised there, the next get() retries the load and
+        raises them on the calling thread.
+        """
+        self._loader(key)
+
+        def load() -> None:
+            try:
+                self.get(key)
+            except Exception:
+                pass
+
+        thread = threading.Thread(target=load, name=f"warm-{key}", daemon=True)
+        thread.start()
+        return thread
+
+    def is_loaded(self, key: str) -> bool:
+        return key in self._models
+
+    def unload(self, key: Optional[str] = None) -> None:
+        # Drops one or all loaded models, they are loaded again on the next get()
+        with self._lock:
+            if key is None:
+                self._models.clear()
+            else:
+                self._models.pop(key, None)
+
+
+_registry = ModelRegistry()
+
+
+def get_model_registry() -> ModelRegistry:
+    return _registry
+
+
+def sentence_transformer_key(model_name: str) -> str:
+    return f"sentence-transformers:{model_name}"
+
+
+def load_sentence_transformer(model_name: str) -> object:
+    # torch and sentence_transformers are only imported here
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name)
+
+
+if __name__ == "__main__":
+    pass
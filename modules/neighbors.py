@@ -0,0 +1,298 @@
+"""
+Nearest neighbour indexes over the labeled corpus embeddings.
+ExactIndex is the brute-force dot product search. IVFIndex is an inverted file index: a k-means coarse quantizer
+splits the corpus into lists and a query is only compared against the vectors in its `nprobe` closest lists.
+All embeddings are expected to be L2 normalized so the dot product is the cosine similarity.
+"""
+
+import argparse
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+
+def top_k(similarity_matrix: npt.NDArray[np.float_], k: int) -> npt.NDArray[np.int_]:
+    # Row-wise indices of the k highest similarity scores (unordered within the row)
+    if similarity_matrix.shape[1] < k:
+        k = similarity_matrix.shape[1]
+    return np.argpartition(similarity_matrix, -k, axis=1)[:, -k:]
+
+
+DEFAULT_NPROBE = 16
+
+
+class NeighborIndex(ABC):
+    @abstractmethod
+    def search(
+        self, queries: npt.NDArray[np.float32], k: int
+    ) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.int_]]:
+        """Returns (scores, indices), both of shape (Q, k), for each query row."""
+
+
+class ExactIndex(NeighborIndex):
+    def __init__(
+        self, embeddings: npt.NDArray[np.float32], chunk_size: int = 1024
+    ) -> None:
+        self.embeddings = embeddings
+        self.chunk_size = chunk_size
+
+    def search(
+        self, queries: npt.NDArray[np.float32], k: int
+    ) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.int_]]:
+        queries = np.atleast_2d(np.asarray(queries, dtype="float32"))
+        k = min(k, self.embeddings.shape[0])
+        scores = np.empty((queries.shape[0], k), dtype="float32")
+        indices = np.empty((queries.shape[0], k), dtype="int64")
+        # Chunk the queries so the (Q x N) similarity matrix stays bounded in memory
+        for start in range(0, queries.shape[0], self.chunk_size):
+            stop = start + self.chunk_size
+            similarity_matrix = np.dot(queries[start:stop], self.embeddings.T)
+            idx = top_k(similarity_matrix=similarity_matrix, k=k)
+            indices[start:stop] = idx
+            scores[start:stop] = np.take_along_axis(similarity_matrix, idx, axis=1)
+
+        return scores, indices
+
+
+class IVFIndex(NeighborIndex):
+    def __init__(
+        self,
+        nlist: Optional[int] = None,
+        nprobe: int = DEFAULT_NPROBE,
+        n_iter: int = 10,
+        max_train_points: int = 256,
+        seed: Optional[int] = 0,
+    ) -> None:
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        # Number of training points per list used for k-means
+        self.max_train_points = max_train_points
+        self.seed = seed
+        self.embeddings = None
+        self.centroids = None
+        self.list_ids = None
+        self.list_offsets = None
+        self.list_vectors = None
+
+    @staticmethod
+    def _assign(
+        vectors: npt.NDArray[np.float32],
+        centroids: npt.NDArray[np.float32],
+        chunk_size: int = 8192,
+    ) -> npt.NDArray[np.int_]:
+        assignments = np.empty(vectors.shape[0], dtype="int64")
+        for start in range(0, vectors.shape[0], chunk_size):
+            stop = start + chunk_size
+            assignments[start:stop] = np.argmax(
+                np.dot(vectors[start:stop], centroids.T), axis=1
+            )
+        return assignments
+
+    def _kmeans(self, vectors: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+        # Spherical k-means, the centroids are re-normalized so assignment is by cosine similarity
+        rng = np.random.default_rng(self.seed)
+        centroids = vectors[
+            rng.choice(vectors.shape[0], size=self.nlist, replace=False)
+        ]
+        for _ in range(self.n_iter):
+            assignments = self._assign(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            counts = np.bincount(assignments, minlength=self.nlist)
+            # Re-seed empty lists with random points
+            empty = np.where(counts == 0)[0]
+            if len(empty) > 0:
+                sums[empty] = vectors[rng.choice(vectors.shape[0], size=len(empty))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            centroids = (sums / norms).astype("float32")
+
+        return centroids
+
+    def build(self, embeddings: npt.NDArray[np.float32]) -> "IVFIndex":
+        self.embeddings = embeddings
+        n = embeddings.shape[0]
+        if self.nlist is None:
+            self.nlist = max(1, int(4 * np.sqrt(n)))
+        self.nlist = min(self.nlist, n)
+
+        rng = np.random.default_rng(self.seed)
+        n_train = min(n, self.nlist * self.max_train_points)
+        train_idx = np.sort(rng.choice(n, size=n_train, replace=False))
+        self.centroids = self._kmeans(
+            np.asarray(embeddings[train_idx], dtype="float32")
+        )
+
+        # Inverted lists are stored CSR style: the corpus ids sorted by list plus the offset of each list
+        assignments = self._assign(embeddings, self.centroids)
+        self.list_ids = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=self.nlist)
+        self.list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype("int64")
+        # The vectors are only written in list order by save(), until then they are gathered per list. The stable
+        # sort keeps the ids of a list in corpus order, so the gather reads the embeddings front to back
+        self.list_vectors = None
+
+        return self
+
+    @staticmethod
+    def _vectors_path(path: str) -> str:
+        # The list ordered vectors are saved next to the index as a .npy file that can be memory-mapped
+        if path.endswith(".npz"):
+            path = path[: -len(".npz")]
+        return path + "_vectors.npy"
+
+    def _list_vectors(self, s: slice) -> npt.NDArray[np.float32]:
+        if self.list_vectors is not None:
+            return self.list_vectors[s]
+        return np.asarray(self.embeddings[self.list_ids[s]], dtype="float32")
+
+    def search(
+        self, queries: npt.NDArray[np.float32], k: int
+    ) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.int_]]:
+        if self.centroids is None:
+            raise Exception("The IVF index has to be built or loaded before searching.")
+        queries = np.atleast_2d(np.asarray(queries, dtype="float32"))
+        k = min(k, self.embeddings.shape[0])
+        scores = np.empty((queries.shape[0], k), dtype="float32")
+        indices = np.empty((queries.shape[0], k), dtype="int64")
+        sizes = np.diff(self.list_offsets)
+
+        probe_order = np.argsort(-np.dot(queries, self.centroids.T), axis=1)
+        for i in range(queries.shape[0]):
+            # Probe at least nprobe lists, and more if they don't hold k candidates between them
+            n_probe = min(self.nprobe, self.nlist)
+            covered = np.cumsum(sizes[probe_order[i]])
+            n_probe = max(n_probe, int(np.searchsorted(covered, k)) + 1)
+            lists = probe_order[i, :n_probe]
+            slices = [
+                slice(self.list_offsets[l], self.list_offsets[l + 1]) for l in lists
+            ]
+            candidates = np.concatenate([self.list_ids[s] for s in slices])
+            candidate_scores = np.dot(
+                np.concatenate([self._list_vectors(s) for s in slices]), queries[i]
+            )
+            best = np.argpartition(candidate_scores, -k)[-k:]
+            indices[i] = candidates[best]
+            scores[i] = candidate_scores[best]
+
+        return scores, indices
+
+    def save(self, path: str, chunk_size: int = 8192) -> None:
+        # The embeddings are re-attached from the embedding cache on load, only their list ordered copy is saved
+        np.savez(
+            path,
+            centroids=self.centroids,
+            list_ids=self.list_ids,
+            list_offsets=self.list_offsets,
+            params=np.asarray([self.nlist, self.nprobe, self.n_iter]),
+        )
+        # Copied chunk by chunk into a memory-mapped file so the corpus is never held in RAM twice
+        vectors_path = self._vectors_path(path)
+        tmp_vectors = vectors_path + ".tmp"
+        out = np.lib.format.open_memmap(
+            tmp_vectors,
+            mode="w+",
+            dtype="float32",
+            shape=(len(self.list_ids), self.embeddings.shape[1]),
+        )
+        for start in range(0, len(self.list_ids), chunk_size):
+            stop = start + chunk_size
+            out[start:stop] = self.embeddings[self.list_ids[start:stop]]
+        out.flush()
+        del out
+        os.replace(tmp_vectors, vectors_path)
+        self.list_vectors = np.load(vectors_path, mmap_mode="r")
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        embeddings: npt.NDArray[np.float32],
+        nprobe: Optional[int] = None,
+    ) -> "IVFIndex":
+        data = np.load(path)
+        nlist, saved_nprobe, n_iter = [int(x) for x in data["params"]]
+        index = cls(
+            nlist=nlist,
+            nprobe=nprobe if nprobe is not None else saved_nprobe,
+            n_iter=n_iter,
+        )
+        index.centroids = data["centroids"]
+        index.list_ids = data["list_ids"]
+        index.list_offsets = data["list_offsets"]
+        if index.list_offsets[-1] != embeddings.shape[0]:
+            raise Exception(
+                f"The IVF index at '{path}' was built for {index.list_offsets[-1]} vectors but {embeddings.shape[0]} were given."
+            )
+        index.embeddings = embeddings
+        vectors_path = cls._vectors_path(path)
+        if os.path.exists(vectors_path):
+            index.list_vectors = np.load(vectors_path, mmap_mode="r")
+
+        return index
+
+
+def recall_at_k(
+    approx: NeighborIndex,
+    exact: NeighborIndex,
+    queries: npt.NDArray[np.float32],
+    k: int,
+) -> float:
+    """Mean fraction of the exact k nearest neighbours that the approximate index also returns."""
+    _, approx_idx = approx.search(queries, k)
+    _, exact_idx = exact.search(queries, k)
+    hits = [
+        len(np.intersect1d(approx_idx[i], exact_idx[i])) / exact_idx.shape[1]
+        for i in range(exact_idx.shape[0])
+    ]
+
+    return float(np.mean(hits))
+
+
+if __name__ == "__main__":
+    # e.g. python -m modules.neighbors --nprobe 16
+    from modules.embedding_cache import DEFAULT_CACHE_DIR
+    from modules.sentiment import EmbeddedSentiment
+
+    parser = argparse.ArgumentParser(
+        description="Build the IVF index over the cached corpus embeddings and report recall."
+    )
+    parser.add_argument("--filepath", default="./assets/stock_sentiment_data.csv")
+    parser.add_argument("--model-name", default="all-mpnet-base-v2")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    embed = EmbeddedSentiment(model_name=args.model_name)
+    index = embed.load_neighbor_index(
+        filepath=args.filepath,
+        kind="ivf",
+        cache_dir=args.cache_dir,
+        nlist=args.nlist,
+        nprobe=args.nprobe,
+        rebuild=True,
+    )
+    exact = ExactIndex(index.embeddings)
+    # Perturbed corpus rows stand in for unseen queries
+    rng = np.random.default_rng(1)
+    queries = np.asarray(
+        index.embeddings[rng.choice(index.embeddings.shape[0], size=args.queries)]
+    )
+    queries = queries + rng.normal(scale=0.05, size=queries.shape).astype("float32")
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    start = time.perf_counter()
+    index.search(queries, args.k)
+    elapsed = (time.perf_counter() - start) / args.queries
+    print(
+        f"IVF nlist={index.nlist} nprobe={index.nprobe}: {elapsed * 1000:.3f} ms/query"
+    )
+    print(f"recall@{args.k}: {recall_at_k(index, exact, queries, args.k):.4f}")
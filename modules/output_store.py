@@ -0,0 +1,256 @@
+"""
+Columnar output store for the Google News sentiment runs.
+Every run appends its scored articles to a Parquet dataset partitioned by ticker and news date, with the article
+paragraphs kept as a native list column, and its summary to a small table partitioned by ticker. The reader functions
+push ticker and date filters down to the partition paths and the Parquet row group statistics, so only the files
+for the requested tickers and dates are read.
+
+    python -m modules.output_store articles --ticker AAPL --start 2022-10-01 --end 2022-12-31
+    python -m modules.output_store summaries --ticker AAPL MSFT
+"""
+
+from modules.state_store import SCORE_COLUMNS
+
+import argparse
+import os
+import uuid
+from datetime import datetime
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+DEFAULT_ROOT = "./output/dataset"
+
+ARTICLES_SCHEMA = pa.schema(
+    [
+        ("run_id", pa.string()),
+        ("run_at", pa.timestamp("s")),
+        ("title", pa.string()),
+        ("link_rss", pa.string()),
+        ("links_canonical", pa.string()),
+        ("article_content", pa.list_(pa.string())),
+        ("cluster_size", pa.int64()),
+    ]
+    + [(column, pa.float64()) for column in SCORE_COLUMNS]
+    + [("ticker", pa.string()), ("date", pa.string())]
+)
+SUMMARIES_SCHEMA = pa.schema(
+    [
+        ("run_id", pa.string()),
+        ("run_at", pa.timestamp("s")),
+        ("company_name", pa.string()),
+        ("earliest_news_date", pa.string()),
+        ("latest_news_date", pa.string()),
+        ("n_articles", pa.int64()),
+        ("news_title_sentiment_KNN", pa.float64()),
+        ("news_title_sentiment_rules", pa.float64()),
+        ("article_sentiment_KNN", pa.float64()),
+        ("article_sentiment_rules", pa.float64()),
+        ("stock_market_return", pa.float64()),
+        ("ticker", pa.string()),
+    ]
+)
+# Hive style directories, e.g. articles/ticker=AAPL/date=2022-12-01/part-<run>-0.parquet
+ARTICLES_PARTITIONING = ds.partitioning(
+    pa.schema([("ticker", pa.string()), ("date", pa.string())]), flavor="hive"
+)
+SUMMARIES_PARTITIONING = ds.partitioning(
+    pa.schema([("ticker", pa.string())]), flavor="hive"
+)
+
+
+def new_run_id() -> str:
+    # Time prefixed with microseconds, so sorting by run_id orders runs even within the same second
+    return datetime.now().strftime("%Y%m%dT%H%M%S%f") + "-" + uuid.uuid4().hex[:8]
+
+
+def _date_filter(
+    tickers: Optional[List[str]],
+    start: Optional[str],
+    end: Optional[str],
+    date_column: Optional[str],
+) -> Optional[ds.Expression]:
+    # ISO dates compare correctly as strings, so the date bounds also prune the date partitions
+    conditions = []
+    if tickers is not None:
+        conditions.append(ds.field("ticker").isin([t.upper() for t in tickers]))
+    if date_column is not None and start is not None:
+        conditions.append(ds.field(date_column) >= str(start))
+    if date_column is not None and end is not None:
+        conditions.append(ds.field(date_column) <= str(end))
+    if len(conditions) == 0:
+        return None
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+
+class OutputStore(object):
+    def __init__(self, root: str = DEFAULT_ROOT) -> None:
+        self.root = root
+        self.articles_path = os.path.join(root, "articles")
+        self.summaries_path = os.path.join(root, "summaries")
+
+    @staticmethod
+    def _write(
+        table: pa.Table, path: str, partitioning: ds.Partitioning, run_id: str
+    ) -> None:
+        # A file name unique to the run appends to the partitions instead of replacing earlier runs
+        ds.write_dataset(
+            table,
+            path,
+            format="parquet",
+            partitioning=partitioning,
+            basename_template=f"part-{run_id}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+
+    def write_articles(
+        self,
+        ticker: str,
+        news_df: pd.DataFrame,
+        run_id: str,
+        run_at: Optional[datetime] = None,
+    ) -> int:
+        """
+        Appends the scored articles of one run. Returns the number of rows written.
+        """
+        if news_df.shape[0] == 0:
+            return 0
+        run_at = run_at or datetime.now()
+        n_rows = news_df.shape[0]
+        columns = {
+            "run_id": [run_id] * n_rows,
+            "run_at": [run_at.replace(microsecond=0)] * n_rows,
+            "ticker": [ticker.upper()] * n_rows,
+            "article_content": [
+                list(content) if content is not None else []
+                for content in news_df["article_content"]
+            ],
+        }
+        for field in ARTICLES_SCHEMA:
+            if field.name in columns:
+                continue
+            if field.name in news_df.columns:
+                columns[field.name] = news_df[field.name].tolist()
+            else:
+                # e.g. cluster_size when the articles were not deduplicated
+                columns[field.name] = [None] * n_rows
+        table = pa.Table.from_pydict(columns, schema=ARTICLES_SCHEMA)
+        self._write(table, self.articles_path, ARTICLES_PARTITIONING, run_id)
+
+        return n_rows
+
+    def write_summary(
+        self,
+        summary: dict,
+        run_id: str,
+        run_at: Optional[datetime] = None,
+        n_articles: Optional[int] = None,
+    ) -> None:
+        run_at = run_at or datetime.now()
+        row = {
+            **summary,
+            "run_id": run_id,
+            "run_at": run_at.replace(microsecond=0),
+            "n_articles": n_articles,
+        }
+        table = pa.Table.from_pylist(
+            [{field.name: row.get(field.name) for field in SUMMARIES_SCHEMA}],
+            schema=SUMMARIES_SCHEMA,
+        )
+        self._write(table, self.summaries_path, SUMMARIES_PARTITIONING, run_id)
+
+    def _read(
+        self,
+        path: str,
+        schema: pa.Schema,
+        partitioning: ds.Partitioning,
+        expression: Optional[ds.Expression],
+        columns: Optional[List[str]],
+    ) -> pd.DataFrame:
+        if not os.path.exists(path):
+            return schema.empty_table().to_pandas()
+        dataset = ds.dataset(
+            path, format="parquet", schema=schema, partitioning=partitioning
+        )
+        return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+    def read_articles(
+        self,
+        tickers: Optional[List[str]] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        columns: Optional[List[str]] = None,
+        latest: bool = True,
+    ) -> pd.DataFrame:
+        """
+        Articles of the given tickers whose news date is between start and end (inclusive, 'YYYY-MM-DD').
+        Later runs see most of the same articles again, with latest=True only the copy from the newest run is kept.
+        """
+        if latest and columns is not None:
+            columns = list(dict.fromkeys(columns + ["ticker", "link_rss", "run_id"]))
+        articles = self._read(
+            self.articles_path,
+            ARTICLES_SCHEMA,
+            ARTICLES_PARTITIONING,
+            _date_filter(tickers, start, end, "date"),
+            columns,
+        )
+        if latest and articles.shape[0] > 0:
+            # run_id starts with the run time, the stable sort keeps the order of equal ids
+            articles = articles.sort_values("run_id", kind="mergesort").drop_duplicates(
+                subset=["ticker", "link_rss"], keep="last"
+            )
+
+        return articles.reset_index(drop=True)
+
+    def read_summaries(
+        self,
+        tickers: Optional[List[str]] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+    ) -> pd.DataFrame:
+        # Run summaries whose latest news date is between start and end, oldest run first
+        summaries = self._read(
+            self.summaries_path,
+            SUMMARIES_SCHEMA,
+            SUMMARIES_PARTITIONING,
+            _date_filter(tickers, start, end, "latest_news_date"),
+            None,
+        )
+
+        return summaries.sort_values("run_id", kind="mergesort").reset_index(drop=True)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Query the Google News output store.")
+    parser.add_argument("table", choices=["articles", "summaries"])
+    parser.add_argument("--root", default=DEFAULT_ROOT)
+    parser.add_argument("--ticker", nargs="*", default=None)
+    parser.add_argument("--start", default=None, help="YYYY-MM-DD")
+    parser.add_argument("--end", default=None, help="YYYY-MM-DD")
+    parser.add_argument("--all-runs", action="store_true")
+    parser.add_argument("--output", default=None, help="Optional CSV path.")
+    args = parser.parse_args()
+
+    store = OutputStore(root=args.root)
+    if args.table == "articles":
+        result = store.read_articles(
+            tickers=args.ticker,
+            start=args.start,
+            end=args.end,
+            latest=not args.all_runs,
+        )
+    else:
+        result = store.read_summaries(
+            tickers=args.ticker, start=args.start, end=args.end
+        )
+    if args.output:
+        result.to_csv(args.output, index=False)
+    else:
+        print(result.to_string(max_colwidth=60))
@@ -0,0 +1,222 @@
+"""
+Local SQLite store of daily price history and dividends per ticker.
+The store remembers which date ranges have already been downloaded for each ticker, so only the missing ranges
+are fetched from Yahoo Finance.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+from typing import Callable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_PRICE_PATH = "./cache/prices.sqlite"
+
+PRICE_COLUMNS = ["open", "high", "low", "close", "adjclose", "volume", "dividends"]
+
+DateLike = Union[date, datetime, str]
+
+
+def _to_date(value: DateLike) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+
+class PriceStore(object):
+    def __init__(self, path: str = DEFAULT_PRICE_PATH) -> None:
+        self.path = path
+        store_dir = os.path.dirname(path)
+        if store_dir and not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS prices (
+                ticker TEXT,
+                date TEXT,
+                {', '.join(f'{c} REAL' for c in PRICE_COLUMNS)},
+                PRIMARY KEY (ticker, date)
+            ) WITHOUT ROWID
+            """
+        )
+        # Date ranges [start, end) that have been downloaded, including days without trading
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS coverage (ticker TEXT, start TEXT, end TEXT)"
+        )
+        self.conn.commit()
+
+    def _coverage(self, ticker: str) -> List[Tuple[date, date]]:
+        rows = self.conn.execute(
+            "SELECT start, end FROM coverage WHERE ticker = ? ORDER BY start",
+            (ticker,),
+        ).fetchall()
+        return [(_to_date(s), _to_date(e)) for s, e in rows]
+
+    def missing_ranges(
+        self, ticker: str, start: DateLike, end: DateLike
+    ) -> List[Tuple[date, date]]:
+        start, end = _to_date(start), _to_date(end)
+        with self._lock:
+            covered = self._coverage(ticker)
+        gaps = []
+        cursor = start
+        for s, e in covered:
+            if e <= cursor:
+                continue
+            if s >= end:
+                break
+            if s > cursor:
+                gaps.append((cursor, min(s, end)))
+            cursor = max(cursor, e)
+        if cursor < end:
+            gaps.append((cursor, end))
+
+        return gaps
+
+    def _add_coverage(self, ticker: str, start: date, end: date) -> None:
+        # Merge the new range with any overlapping or adjacent ranges
+        intervals = self._coverage(ticker) + [(start, end)]
+        intervals.sort()
+        merged = [intervals[0]]
+        for s, e in intervals[1:]:
+            if s <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+            else:
+                merged.append((s, e))
+        self.conn.execute("DELETE FROM coverage WHERE ticker = ?", (ticker,))
+        self.conn.executemany(
+            "INSERT INTO coverage VALUES (?, ?, ?)",
+            [(ticker, s.isoformat(), e.isoformat()) for s, e in merged],
+        )
+
+    def save(self, ticker: str, data: pd.DataFrame, start: date, end: date) -> None:
+        rows = []
+        if data is not None and data.shape[0] > 0:
+            dates = data["date"].astype(str).str[:10]
+            values = [
+                data[c] if c in data.columns else pd.Series(0.0, index=data.index)
+                for c in PRICE_COLUMNS
+            ]
+            rows = [
+                (ticker, d, *[float(v) if pd.notna(v) else None for v in row])
+                for d, row in zip(dates, zip(*values))
+            ]
+        # Today's bar is still changing so it is never marked as downloaded
+        covered_end = min(end, date.today())
+        with self._lock:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO prices VALUES ({', '.join(['?'] * (len(PRICE_COLUMNS) + 2))})",
+                rows,
+            )
+            if covered_end > start:
+                self._add_coverage(ticker, start, covered_end)
+            self.conn.commit()
+
+    def load(self, ticker: str, start: DateLike, end: DateLike) -> pd.DataFrame:
+        # Rows with start <= date < end, the same convention as yahooquery's history
+        start, end = _to_date(start), _to_date(end)
+        with self._lock:
+            data = pd.read_sql_query(
+                f"SELECT date, {', '.join(PRICE_COLUMNS)} FROM prices WHERE ticker = ? AND date >= ? AND date < ? ORDER BY date",
+                self.conn,
+                params=(ticker, start.isoformat(), end.isoformat()),
+            )
+        data["dividends"] = data["dividends"].fillna(0.0)
+
+        return data
+
+    def get_history(
+        self,
+        ticker: str,
+        start: DateLike,
+        end: DateLike,
+        fetch: Callable[[str, datetime, datetime], Optional[pd.DataFrame]],
+    ) -> pd.DataFrame:
+        """
+        Returns the stored daily rows for [start, end), downloading only the date ranges that are missing.
+        fetch(ticker, start, end) should return a DataFrame with a 'date' column and the price columns, empty when
+        the range has no trading days, or None when the download failed. Failed ranges are not marked as downloaded,
+        so they are fetched again next time.
+        """
+        ticker = ticker.upper()
+        for gap_start, gap_end in self.missing_ranges(ticker, start, end):
+            data = fetch(
+                ticker,
+                datetime.combine(gap_start, datetime.min.time()),
+                datetime.combine(gap_end, datetime.min.time()),
+            )
+            if data is None:
+                continue
+            self.save(ticker=ticker, data=data, start=gap_start, end=gap_end)
+
+        return self.load(ticker, start, end)
+
+
+def yearly_returns(
+    dates: np.ndarray,
+    opens: np.ndarray,
+    closes: np.ndarray,
+    dividends: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+) -> np.ndarray:
+    """
+    Time weighted yearly return for many (start, end) windows over one ticker's daily rows, without Python loops.
+    Shares are bought at the open on the first row of the window and sold at the close on its last row.
+    A dividend is reinvested at the next row's open and held from that date until the end of the window, a dividend
+    on the last row of the window is added to the sale price. Windows without any rows return NaN.
+
+    dates, starts and ends are datetime64[D] arrays and rows are sorted by date.
+    """
+    dates = dates.astype("datetime64[D]")
+    starts = np.asarray(starts).astype("datetime64[D]")
+    ends = np.asarray(ends).astype("datetime64[D]")
+    n = len(dates)
+    returns = np.full(len(starts), np.nan)
+    if n == 0:
+        return returns
+
+    # Shares bought by reinvesting the dividend of row j at the open of row j + 1, and the date they were bought
+    reinvest_shares = np.zeros(n)
+    reinvest_days = np.zeros(n)
+    if n > 1:
+        reinvest_shares[:-1] = np.where(
+            dividends[:-1] > 0, dividends[:-1] / opens[1:], 0.0
+        )
+        reinvest_days[:-1] = dates[1:].astype("int64")
+    # Prefix sums so the totals over rows [i0, i1) of any window are a subtraction
+    cum_shares = np.concatenate([[0.0], np.cumsum(reinvest_shares)])
+    cum_share_days = np.concatenate([[0.0], np.cumsum(reinvest_shares * reinvest_days)])
+
+    first = np.searchsorted(dates, starts, side="left")
+    last = np.searchsorted(dates, ends, side="left") - 1
+    valid = last >= first
+    i0, i1 = first[valid], last[valid]
+    end_days = ends[valid].astype("int64")
+
+    buy_price = opens[i0]
+    # A dividend paid on the last row cannot be reinvested so it is added to the sale price
+    sell_price = closes[i1] + np.where(dividends[i1] > 0, dividends[i1], 0.0)
+    div_shares = cum_shares[i1] - cum_shares[i0]
+    shares = 1 + div_shares
+    proceeds = shares * sell_price
+
+    total_days = (ends[valid] - starts[valid]).astype("int64")
+    share_days = total_days + (
+        end_days * div_shares - (cum_share_days[i1] - cum_share_days[i0])
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns[valid] = (proceeds / buy_price) ** (1 / (share_days / 365.0)) - 1
+
+    return returns
+
+
+if __name__ == "__main__":
+    pass
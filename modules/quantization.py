@@ -0,0 +1,367 @@
+"""
+Compressed corpus embeddings for the k-NN sentiment search.
+ScalarQuantizer stores every dimension as one byte (4x smaller than float32) and ProductQuantizer stores every
+group of dimensions as the id of its closest sub-centroid (one byte per group, 32x smaller with 8 dimensions per
+group). QuantizedIndex scores the whole corpus on the compressed codes and then re-ranks the best candidates with
+the float32 embeddings, which stay on disk in the memory-mapped embedding cache and are only read for candidates.
+"""
+
+import argparse
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+from modules.neighbors import NeighborIndex, ExactIndex, recall_at_k
+
+
+class ScalarQuantizer(object):
+    kind = "sq8"
+
+    def __init__(self) -> None:
+        self.vmin = None
+        self.scale = None
+
+    def train(self, vectors: npt.NDArray[np.float32]) -> "ScalarQuantizer":
+        # Per dimension range, values outside the training range are clipped on encode
+        self.vmin = vectors.min(axis=0).astype("float32")
+        vmax = vectors.max(axis=0).astype("float32")
+        self.scale = np.maximum(vmax - self.vmin, 1e-12) / 255.0
+        return self
+
+    def encode(self, vectors: npt.NDArray[np.float32]) -> npt.NDArray[np.uint8]:
+        codes = np.rint((vectors - self.vmin) / self.scale)
+        return np.clip(codes, 0, 255).astype("uint8")
+
+    def decode(self, codes: npt.NDArray[np.uint8]) -> npt.NDArray[np.float32]:
+        return (codes.astype("float32") * self.scale + self.vmin).astype("float32")
+
+    def prepare(
+        self, queries: npt.NDArray[np.float32]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # q . (vmin + scale * code) = (q * scale) . code + q . vmin
+        return (queries * self.scale).astype("float32"), np.dot(queries, self.vmin)
+
+    def scores(self, prepared: tuple, codes: npt.NDArray[np.uint8]) -> np.ndarray:
+        weighted, offset = prepared
+        return np.dot(weighted, codes.astype("float32").T) + offset[:, None]
+
+    def to_arrays(self) -> dict:
+        return {"vmin": self.vmin, "scale": self.scale}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "ScalarQuantizer":
+        quantizer = cls()
+        quantizer.vmin = arrays["vmin"]
+        quantizer.scale = arrays["scale"]
+        return quantizer
+
+
+class ProductQuantizer(object):
+    kind = "pq"
+
+    def __init__(
+        self,
+        m: int = 96,
+        n_iter: int = 10,
+        max_train_points: int = 8192,
+        seed: Optional[int] = 0,
+    ) -> None:
+        # m sub-vectors per embedding, each encoded with one of 256 sub-centroids
+        self.m = m
+        self.n_iter = n_iter
+        # 256 sub-centroids are well trained on a few thousand points per sub-space
+        self.max_train_points = max_train_points
+        self.seed = seed
+        self.codebooks = None
+
+    def _split(self, vectors: npt.NDArray[np.float32]) -> np.ndarray:
+        # (N, d) -> (m, N, d / m)
+        n, d = vectors.shape
+        if d % self.m != 0:
+            raise Exception(
+                f"The embedding dimension ({d}) must be divisible by the number of sub-vectors ({self.m})."
+            )
+        return vectors.reshape(n, self.m, d // self.m).transpose(1, 0, 2)
+
+    @staticmethod
+    def _assign(
+        vectors: npt.NDArray[np.float32], centroids: npt.NDArray[np.float32]
+    ) -> np.ndarray:
+        # argmin ||x - c||^2 = argmax (x . c - ||c||^2 / 2)
+        return np.argmax(
+            np.dot(vectors, centroids.T) - 0.5 * (centroids**2).sum(axis=1), axis=1
+        )
+
+    def train(self, vectors: npt.NDArray[np.float32]) -> "ProductQuantizer":
+        rng = np.random.default_rng(self.seed)
+        if vectors.shape[0] > self.max_train_points:
+            vectors = vectors[
+                rng.choice(vectors.shape[0], size=self.max_train_points, replace=False)
+            ]
+        subvectors = self._split(np.asarray(vectors, dtype="float32"))
+        n_centroids = min(256, vectors.shape[0])
+        codebooks = []
+        for sub in subvectors:
+            # Plain (Euclidean) k-means on each sub-space
+            centroids = sub[rng.choice(sub.shape[0], size=n_centroids, replace=False)]
+            for _ in range(self.n_iter):
+                assignments = self._assign(sub, centroids)
+                counts = np.bincount(assignments, minlength=n_centroids)
+                sums = np.stack(
+                    [
+                        np.bincount(
+                            assignments, weights=sub[:, d], minlength=n_centroids
+                        )
+                        for d in range(sub.shape[1])
+                    ],
+                    axis=1,
+                )
+                empty = counts == 0
+                centroids = np.where(
+                    empty[:, None],
+                    sub[rng.choice(sub.shape[0], size=n_centroids)],
+                    sums / np.maximum(counts, 1)[:, None],
+                ).astype("float32")
+            codebooks.append(centroids)
+        self.codebooks = np.stack(codebooks)
+
+        return self
+
+    def encode(self, vectors: npt.NDArray[np.float32]) -> npt.NDArray[np.uint8]:
+        subvectors = self._split(np.asarray(vectors, dtype="float32"))
+        return np.stack(
+            [self._assign(sub, self.codebooks[j]) for j, sub in enumerate(subvectors)],
+            axis=1,
+        ).astype("uint8")
+
+    def decode(self, codes: npt.NDArray[np.uint8]) -> npt.NDArray[np.float32]:
+        parts = [self.codebooks[j][codes[:, j]] for j in range(self.m)]
+        return np.concatenate(parts, axis=1)
+
+    def prepare(self, queries: npt.NDArray[np.float32]) -> np.ndarray:
+        return queries
+
+    def scores(self, prepared: np.ndarray, codes: npt.NDArray[np.uint8]) -> np.ndarray:
+        # The inner product is linear, so scoring the decoded chunk gives the same result as summing per
+        # sub-vector lookup tables, while every query in the block shares one decode and one matrix product
+        return np.dot(prepared, self.decode(codes).T)
+
+    def to_arrays(self) -> dict:
+        return {"codebooks": self.codebooks, "pq_params": np.asarray([self.m])}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> "ProductQuantizer":
+        quantizer = cls(m=int(arrays["pq_params"][0]))
+        quantizer.codebooks = arrays["codebooks"]
+        return quantizer
+
+
+# Number of candidates per result that are re-ranked with the float32 embeddings
+DEFAULT_RERANK = 4
+
+QUANTIZERS = {
+    ScalarQuantizer.kind: ScalarQuantizer,
+    ProductQuantizer.kind: ProductQuantizer,
+}
+
+
+class QuantizedIndex(NeighborIndex):
+    def __init__(
+        self,
+        quantizer,
+        rerank: int = DEFAULT_RERANK,
+        max_train_points: int = 65536,
+        query_chunk_size: int = 256,
+        code_chunk_size: int = 16384,
+        seed: Optional[int] = 0,
+    ) -> None:
+        self.quantizer = quantizer
+        # rerank * k candidates from the compressed search are re-scored in float32
+        self.rerank = rerank
+        self.max_train_points = max_train_points
+        self.query_chunk_size = query_chunk_size
+        self.code_chunk_size = code_chunk_size
+        self.seed = seed
+        self.embeddings = None
+        self.codes = None
+
+    def build(self, embeddings: npt.NDArray[np.float32]) -> "QuantizedIndex":
+        self.embeddings = embeddings
+        n = embeddings.shape[0]
+        rng = np.random.default_rng(self.seed)
+        train_idx = np.sort(
+            rng.choice(n, size=min(n, self.max_train_points), replace=False)
+        )
+        self.quantizer.train(np.asarray(embeddings[train_idx], dtype="float32"))
+        self.codes = np.concatenate(
+            [
+                self.quantizer.encode(
+                    np.asarray(embeddings[s : s + self.code_chunk_size], "float32")
+                )
+                for s in range(0, n, self.code_chunk_size)
+            ]
+        )
+
+        return self
+
+    def memory_bytes(self) -> int:
+        # Resident size of the index: the codes plus the quantizer parameters
+        return int(
+            self.codes.nbytes
+            + sum(a.nbytes for a in self.quantizer.to_arrays().values())
+        )
+
+    def _candidates(self, queries: npt.NDArray[np.float32], n_candidates: int):
+        prepared = self.quantizer.prepare(queries)
+        best_ids, best_scores = [], []
+        for start in range(0, self.codes.shape[0], self.code_chunk_size):
+            scores = self.quantizer.scores(
+                prepared, self.codes[start : start + self.code_chunk_size]
+            )
+            r = min(n_candidates, scores.shape[1])
+            idx = np.argpartition(scores, -r, axis=1)[:, -r:]
+            best_ids.append(idx + start)
+            best_scores.append(np.take_along_axis(scores, idx, axis=1))
+        ids = np.concatenate(best_ids, axis=1)
+        scores = np.concatenate(best_scores, axis=1)
+        idx = np.argpartition(scores, -n_candidates, axis=1)[:, -n_candidates:]
+
+        return np.take_along_axis(ids, idx, axis=1)
+
+    def search(
+        self, queries: npt.NDArray[np.float32], k: int
+    ) -> Tuple[npt.NDArray[np.float32], npt.NDArray[np.int_]]:
+        if self.codes is None:
+            raise Exception(
+                "The quantized index has to be built or loaded before searching."
+            )
+        queries = np.atleast_2d(np.asarray(queries, dtype="float32"))
+        k = min(k, self.codes.shape[0])
+        n_candidates = min(self.codes.shape[0], max(k, self.rerank * k))
+        scores = np.empty((queries.shape[0], k), dtype="float32")
+        indices = np.empty((queries.shape[0], k), dtype="int64")
+        for start in range(0, queries.shape[0], self.query_chunk_size):
+            stop = start + self.query_chunk_size
+            block = queries[start:stop]
+            candidates = self._candidates(block, n_candidates)
+            # Re-rank one query at a time so only its (n_candidates x d) float32 rows are ever in memory,
+            # read in sorted order from the memory map
+            for i in range(block.shape[0]):
+                ids = np.sort(candidates[i])
+                exact = np.asarray(self.embeddings[ids], dtype="float32") @ block[i]
+                best = np.argpartition(exact, -k)[-k:]
+                indices[start + i] = ids[best]
+                scores[start + i] = exact[best]
+
+        return scores, indices
+
+    def save(self, path: str) -> None:
+        # Like the IVF index, the float32 embeddings are re-attached from the embedding cache on load
+        np.savez(
+            path,
+            kind=np.asarray(self.quantizer.kind),
+            codes=self.codes,
+            rerank=np.asarray([self.rerank]),
+            **self.quantizer.to_arrays(),
+        )
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        embeddings: npt.NDArray[np.float32],
+        rerank: Optional[int] = None,
+    ) -> "QuantizedIndex":
+        data = np.load(path)
+        quantizer = QUANTIZERS[str(data["kind"])].from_arrays(data)
+        index = cls(
+            quantizer=quantizer,
+            rerank=rerank if rerank is not None else int(data["rerank"][0]),
+        )
+        index.codes = data["codes"]
+        if index.codes.shape[0] != embeddings.shape[0]:
+            raise Exception(
+                f"The quantized index at '{path}' was built for {index.codes.shape[0]} vectors but {embeddings.shape[0]} were given."
+            )
+        index.embeddings = embeddings
+
+        return index
+
+
+def sentiment_agreement(
+    approx: NeighborIndex,
+    exact: NeighborIndex,
+    queries: npt.NDArray[np.float32],
+    labels: npt.NDArray,
+    k: int,
+) -> Tuple[float, float]:
+    """
+    Mean absolute difference between the approximate and the exact k-NN sentiment scores, and the fraction of
+    queries whose sentiment lands on the same side of 0.5.
+    """
+    _, approx_idx = approx.search(queries, k)
+    _, exact_idx = exact.search(queries, k)
+    approx_scores = labels[approx_idx].mean(axis=1)
+    exact_scores = labels[exact_idx].mean(axis=1)
+
+    return (
+        float(np.abs(approx_scores - exact_scores).mean()),
+        float(np.mean((approx_scores >= 0.5) == (exact_scores >= 0.5))),
+    )
+
+
+if __name__ == "__main__":
+    # e.g. python -m modules.quantization --kind pq --rerank 4
+    from modules.embedding_cache import EmbeddingCache, DEFAULT_CACHE_DIR
+    from modules.sentiment import EmbeddedSentiment
+
+    parser = argparse.ArgumentParser(
+        description="Build a quantized index over the cached corpus embeddings and compare it with the exact search."
+    )
+    parser.add_argument("--kind", choices=list(QUANTIZERS.keys()), default="sq8")
+    parser.add_argument("--filepath", default="./assets/stock_sentiment_data.csv")
+    parser.add_argument("--model-name", default="all-mpnet-base-v2")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--rerank", type=int, default=DEFAULT_RERANK)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    embed = EmbeddedSentiment(model_name=args.model_name)
+    index = embed.load_neighbor_index(
+        filepath=args.filepath,
+        kind=args.kind,
+        cache_dir=args.cache_dir,
+        rerank=args.rerank,
+        rebuild=True,
+    )
+    _, labels = EmbeddingCache(cache_dir=args.cache_dir).get(
+        embed=embed, filepath=args.filepath
+    )
+    labels = np.asarray(labels, dtype="float32")
+    exact = ExactIndex(index.embeddings)
+    # Perturbed corpus rows stand in for unseen queries
+    rng = np.random.default_rng(1)
+    queries = np.asarray(
+        index.embeddings[rng.choice(index.embeddings.shape[0], size=args.queries)]
+    )
+    queries = queries + rng.normal(scale=0.05, size=queries.shape).astype("float32")
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    for name, searcher in [("exact", exact), (args.kind, index)]:
+        start = time.perf_counter()
+        searcher.search(queries, args.k)
+        qps = args.queries / (time.perf_counter() - start)
+        print(f"{name:>5}: {qps:.1f} queries/s")
+    float_bytes = index.embeddings.shape[0] * index.embeddings.shape[1] * 4
+    print(
+        f"memory: float32 {float_bytes / 2**20:.1f} MiB, {args.kind} {index.memory_bytes() / 2**20:.1f} MiB "
+        f"({float_bytes / index.memory_bytes():.1f}x smaller)"
+    )
+    print(f"recall@{args.k}: {recall_at_k(index, exact, queries, args.k):.4f}")
+    mean_diff, same_side = sentiment_agreement(index, exact, queries, labels, args.k)
+    print(
+        f"sentiment: mean absolute difference {mean_diff:.4f}, same side of 0.5 for {same_side:.1%} of queries"
+    )
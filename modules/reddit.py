@@ -1,12 +1,104 @@
 import requests
 import os
+import threading
 from requests.auth import HTTPBasicAuth
 import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, Optional
+
+from modules.http_client import HttpClient, get_shared_client
+
+# Reddit returns at most 100 items per listing page
+MAX_PAGE_SIZE = 100
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    # Retry-After is either a number of seconds or an HTTP date, None when it is missing or can't be parsed
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return (retry_at - datetime.now(timezone.utc)).total_seconds()
+
+
+class RateLimiter(object):
+    """
+    Paces requests from Reddit's X-Ratelimit-Remaining and X-Ratelimit-Reset headers: the requests that are left in
+    the current window are spread evenly over the time until it resets, so the limit is never hit instead of
+    waiting on 429 responses. Thread safe, one limiter is shared by every request made with the same OAuth client.
+    """
+
+    def __init__(self, min_interval: float = 0.0) -> None:
+        self.min_interval = min_interval
+        self.remaining = None
+        self.reset_at = None
+        self.next_request = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, headers: dict) -> None:
+        try:
+            remaining = float(headers["X-Ratelimit-Remaining"])
+            reset = float(headers["X-Ratelimit-Reset"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        with self._lock:
+            self.remaining = remaining
+            self.reset_at = time.monotonic() + reset
+
+        return None
+
+    def block_until_reset(self, retry_after: Optional[float] = None) -> None:
+        # After a 429 nothing is sent until the Retry-After delay is over, or without one until the window resets
+        with self._lock:
+            now = time.monotonic()
+            if retry_after is not None:
+                resume = now + max(retry_after, 0.0)
+                if self.remaining is not None and self.remaining < 1:
+                    # The server's delay also ends a window that the headers reported as exhausted
+                    self.reset_at = min(self.reset_at, resume)
+            else:
+                resume = self.reset_at if self.reset_at is not None else now + 1.0
+                self.remaining = 0
+            self.next_request = max(self.next_request, resume)
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self.next_request)
+            interval = self.min_interval
+            if self.remaining is not None and self.reset_at is not None:
+                if self.remaining < 1:
+                    # Out of requests for this window, the first slot is when it resets. The headers of that
+                    # response set the pace for the new window.
+                    start = max(start, self.reset_at)
+                else:
+                    window = max(self.reset_at - start, 0.0)
+                    interval = max(interval, window / self.remaining)
+                    self.remaining -= 1
+            self.next_request = start + interval
+        if start > now:
+            time.sleep(start - now)
 
 
 class Reddit(object):
     def __init__(
-        self, client_id: str, secret_token: str, username: str, password: str
+        self,
+        client_id: str,
+        secret_token: str,
+        username: str,
+        password: str,
+        http_client: HttpClient = None,
+        refresh_margin: int = 60 * 5,
     ) -> None:
         self.client_id = client_id
         self.secret_token = secret_token
@@ -15,6 +107,15 @@ class Reddit(object):
         self.headers = {}
         self.auth_token_expires = 0
         self.base_url = "https://oauth.reddit.com"
+        self.http_client = (
+            http_client if http_client is not None else get_shared_client()
+        )
+        # Tokens are refreshed in the background once they are less than refresh_margin seconds from expiring
+        self.refresh_margin = refresh_margin
+        self.rate_limiter = RateLimiter()
+        self._refresh_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._refresh_thread = None
 
     def _update_auth_token(self, auth_response: dict) -> None:
         auth_token = auth_response.get("access_token")
@@ -31,39 +132,135 @@ class Reddit(object):
 
         return None
 
+    def _refresh_token(self) -> None:
+        auth = HTTPBasicAuth(username=self.client_id, password=self.secret_token)
+        payload = {
+            "grant_type": "password",
+            "username": self.username,
+            "password": self.password,
+        }
+        headers = {"User-Agent": "CS410_Project/0.0.1"}
+        auth_response = self.http_client.post(
+            "https://www.reddit.com/api/v1/access_token",
+            auth=auth,
+            data=payload,
+            headers=headers,
+        )
+        auth_json = auth_response.json()
+        auth_token = auth_json.get("access_token")
+        # The headers are swapped in one assignment so requests in flight keep a consistent copy
+        self.headers = {**headers, **{"Authorization": f"bearer {auth_token}"}}
+        self._update_auth_token(auth_response=auth_json)
+
+        return None
+
+    def _background_refresh(self) -> None:
+        try:
+            with self._refresh_lock:
+                if self.auth_token_expires <= int(time.time()) + self.refresh_margin:
+                    self._refresh_token()
+        finally:
+            with self._thread_lock:
+                self._refresh_thread = None
+
     def _update_oauth_headers(self) -> dict:
+        now = int(time.time())
+        # Without a valid token the request has to wait for the refresh
+        if self.auth_token_expires <= now + 10:
+            with self._refresh_lock:
+                if self.auth_token_expires <= int(time.time()) + 10:
+                    self._refresh_token()
+        # A token that is close to expiring is still used while a new one is requested in the background
+        elif self.auth_token_expires <= now + self.refresh_margin:
+            with self._thread_lock:
+                if self._refresh_thread is None:
+                    self._refresh_thread = threading.Thread(
+                        target=self._background_refresh, daemon=True
+                    )
+                    self._refresh_thread.start()
 
-        # Update headers if auth token is less than 5 minutes from expiring (for some wiggle room)
-        if self.auth_token_expires <= int(time.time()) + 60 * 5:
-            auth = HTTPBasicAuth(username=self.client_id, password=self.secret_token)
-            payload = {
-                "grant_type": "password",
-                "username": self.username,
-                "password": self.password,
-            }
-            headers = {"User-Agent": "CS410_Project/0.0.1"}
-            auth_response = requests.post(
-                "https://www.reddit.com/api/v1/access_token",
-                auth=auth,
-                data=payload,
-                headers=headers,
+        return self.headers
+
+    def _request(
+        self, endpoint: str, params: Optional[dict] = None, max_attempts: int = 5
+    ) -> requests.models.Response:
+        # Paced GET against the OAuth API, 429 responses are retried once the rate limit window resets
+        for _ in range(max_attempts):
+            headers = self._update_oauth_headers()
+            self.rate_limiter.wait()
+            response = self.http_client.get(
+                self.base_url + str(endpoint), headers=headers, params=params
+            )
+            self.rate_limiter.update(response.headers)
+            if response.status_code != 429:
+                return response
+            self.rate_limiter.block_until_reset(
+                retry_after=parse_retry_after(response.headers.get("Retry-After"))
             )
-            self._update_auth_token(auth_response=auth_response.json())
-            auth_token = auth_response.json().get("access_token")
-            headers = {**headers, **{"Authorization": f"bearer {auth_token}"}}
-            self.headers = headers
 
-    def search_subreddit(self, endpoint: str, search_term: str) -> dict:
-        # Always make sure the auth token is up to date
-        self._update_oauth_headers()
+        raise Exception(
+            f"Reddit kept rate limiting requests to '{endpoint}' after {max_attempts} attempts."
+        )
 
+    def search_subreddit(self, endpoint: str, search_term: str) -> dict:
         params = {"q": search_term}
-        response = requests.get(
-            self.base_url + str(endpoint), headers=self.headers, params=params
-        )
+        response = self._request(endpoint, params=params)
 
         return response
 
+    def iter_listing(
+        self,
+        endpoint: str,
+        params: Optional[Dict[str, str]] = None,
+        limit: Optional[int] = None,
+        page_size: int = MAX_PAGE_SIZE,
+    ) -> Iterator[dict]:
+        """
+        Lazily pages through a listing endpoint, e.g. '/r/stocks/new' or '/r/stocks/search', by following the
+        'after' cursor and yields the data dict of every item. Stops after `limit` items or when the listing ends.
+        Reddit serves at most about 1000 items of a single listing, narrow the query (e.g. by time) for more.
+        """
+        params = dict(params or {})
+        params["limit"] = min(page_size, MAX_PAGE_SIZE)
+        count = 0
+        while True:
+            response = self._request(endpoint, params=params)
+            if response.status_code != 200:
+                raise Exception(
+                    f"Received status code {response.status_code} for the Reddit listing '{endpoint}'."
+                )
+            listing = response.json().get("data", {})
+            for child in listing.get("children", []):
+                yield child["data"]
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+            after = listing.get("after")
+            if after is None:
+                return
+            params["after"] = after
+            params["count"] = count
+
+    def iter_search(
+        self,
+        subreddit: str,
+        search_term: str,
+        sort: str = "new",
+        limit: Optional[int] = None,
+    ) -> Iterator[dict]:
+        # Search results of one subreddit, newest first by default
+        return self.iter_listing(
+            f"/r/{subreddit}/search",
+            params={"q": search_term, "restrict_sr": "1", "sort": sort},
+            limit=limit,
+        )
+
+    def iter_posts(
+        self, subreddit: str, listing: str = "new", limit: Optional[int] = None
+    ) -> Iterator[dict]:
+        # Posts of a subreddit listing such as 'new', 'hot', 'top' or 'rising'
+        return self.iter_listing(f"/r/{subreddit}/{listing}", limit=limit)
+
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,152 @@
+"""
+Scoring helpers shared by the Google News entry points.
+News titles and article paragraphs are flattened into one list of queries, scored in a single batch and then
+grouped back into title and per article columns.
+"""
+
+from modules.sentiment import EmbeddedSentiment, RuleBasedSentiment
+from modules.neighbors import NeighborIndex
+from modules.sharded import ShardedScorer
+from modules.state_store import ArticleStateStore, SCORE_COLUMNS, content_hash
+
+import numpy as np
+import pandas as pd
+from typing import List, Optional, Tuple
+
+
+def mean_per_article(scores: np.ndarray, counts: List[int]) -> List[float]:
+    """
+    Groups a flat vector of paragraph scores back per article and averages them.
+    Articles without any paragraphs get the obvious placeholder score of -999.
+    """
+    means = []
+    offsets = np.cumsum([0] + list(counts))
+    for i in range(len(counts)):
+        if counts[i] > 0:
+            means.append(float(scores[offsets[i] : offsets[i + 1]].mean()))
+        else:
+            means.append(-999)
+
+    return means
+
+
+def news_queries(news_df: pd.DataFrame) -> Tuple[List[str], List[int]]:
+    """
+    Flattens the titles and the paragraphs of every article into one list of queries.
+    Returns the queries (all titles first, then all paragraphs) and the number of paragraphs per article.
+    """
+    news_titles = news_df["title"].tolist()
+    # article_content is a list of lists so flatten it and remember how many paragraphs each article has
+    article_content = news_df["article_content"].tolist()
+    paragraph_counts = [len(content) for content in article_content]
+    paragraphs = [paragraph for content in article_content for paragraph in content]
+
+    return news_titles + paragraphs, paragraph_counts
+
+
+def attach_scores(
+    news_df: pd.DataFrame,
+    embed_scores: np.ndarray,
+    rules_scores: np.ndarray,
+    paragraph_counts: List[int],
+) -> pd.DataFrame:
+    # Splits the flat query scores from news_queries back into title and per article columns
+    n_titles = news_df.shape[0]
+    news_df["title_sentiment_embed"] = np.asarray(embed_scores[:n_titles]).tolist()
+    news_df["title_sentiment_rules"] = np.asarray(rules_scores[:n_titles]).tolist()
+    news_df["article_sentiment_embed"] = mean_per_article(
+        scores=embed_scores[n_titles:], counts=paragraph_counts
+    )
+    news_df["article_sentiment_rules"] = mean_per_article(
+        scores=rules_scores[n_titles:], counts=paragraph_counts
+    )
+
+    return news_df
+
+
+def score_news(
+    news_df: pd.DataFrame,
+    embed: EmbeddedSentiment,
+    rules: RuleBasedSentiment,
+    stock_embeddings: np.ndarray,
+    sentiment_labels: np.ndarray,
+    k: int,
+    index: Optional[NeighborIndex] = None,
+    scorer: Optional[ShardedScorer] = None,
+) -> pd.DataFrame:
+
+    # Titles and paragraphs are scored against the stock embeddings in a single batch
+    queries, paragraph_counts = news_queries(news_df)
+    if scorer is not None:
+        # Worker processes score shards of the queries against the shared corpus in the scorer
+        embed_scores, rules_scores = scorer.score(queries=queries, k=k)
+    else:
+        embed_scores = embed.score_batch(
+            queries=queries,
+            corpus_embeddings=stock_embeddings,
+            sentiment_labels=sentiment_labels,
+            limit=k,
+            index=index,
+        )
+        rules_scores = rules.score_many(queries=queries)["compound"].to_numpy()
+
+    return attach_scores(
+        news_df=news_df,
+        embed_scores=embed_scores,
+        rules_scores=rules_scores,
+        paragraph_counts=paragraph_counts,
+    )
+
+
+def score_news_incremental(
+    news_df: pd.DataFrame,
+    embed: EmbeddedSentiment,
+    rules: RuleBasedSentiment,
+    stock_embeddings: np.ndarray,
+    sentiment_labels: np.ndarray,
+    k: int,
+    state_store: ArticleStateStore,
+    scoring_key: str,
+    index: Optional[NeighborIndex] = None,
+    scorer: Optional[ShardedScorer] = None,
+) -> pd.DataFrame:
+    """
+    Same output as score_news, but only scores articles whose title and paragraphs have not been scored before
+    with the same scoring_key. Stored scores are merged back in and the new scores are saved to the state store.
+    """
+    news_df = news_df.reset_index(drop=True)
+    hashes = [
+        content_hash(title=title, paragraphs=content)
+        for title, content in zip(news_df["title"], news_df["article_content"])
+    ]
+    news_df["content_hash"] = hashes
+    stored = state_store.get_scores(hashes=hashes, scoring_key=scoring_key)
+    new_rows = news_df[~news_df["content_hash"].isin(stored.keys())]
+
+    if new_rows.shape[0] > 0:
+        scored = score_news(
+            news_df=new_rows.copy(),
+            embed=embed,
+            rules=rules,
+            stock_embeddings=stock_embeddings,
+            sentiment_labels=sentiment_labels,
+            k=k,
+            index=index,
+            scorer=scorer,
+        )
+        state_store.save_scores(
+            records=scored.to_dict(orient="records"), scoring_key=scoring_key
+        )
+        for record in scored[["content_hash"] + SCORE_COLUMNS].to_dict(
+            orient="records"
+        ):
+            stored[record.pop("content_hash")] = record
+
+    for column in SCORE_COLUMNS:
+        news_df[column] = [stored[h][column] for h in hashes]
+
+    return news_df.drop(columns=["content_hash"])
+
+
+if __name__ == "__main__":
+    pass
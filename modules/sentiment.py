@@ -1,47 +1,126 @@
-from typing import Dict, Union, List
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Union, List, Optional, Tuple
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 from statistics import harmonic_mean
-from sentence_transformers import SentenceTransformer
 import numpy as np
 import numpy.typing as npt
 import pandas as pd
 
+from modules.embedding_cache import EmbeddingCache, DEFAULT_CACHE_DIR
+from modules.models import (
+    ModelRegistry,
+    get_model_registry,
+    load_sentence_transformer,
+    sentence_transformer_key,
+)
+from modules.neighbors import (
+    NeighborIndex,
+    ExactIndex,
+    IVFIndex,
+    DEFAULT_NPROBE,
+    top_k,
+)
+from modules.quantization import QuantizedIndex, QUANTIZERS, DEFAULT_RERANK
+from modules.utils.metrics import MetricsRegistry, get_registry
+
+
+VADER_FIELDS = ["neg", "neu", "pos", "compound"]
+# Neighbour index types, every type but 'exact' searches the full labeled data
+INDEX_KINDS = ["exact", "ivf"] + list(QUANTIZERS.keys())
+
+# Each pool worker process builds its own analyzer once
+_worker_analyzer = None
+
+
+def _init_vader_worker() -> None:
+    global _worker_analyzer
+    _worker_analyzer = SentimentIntensityAnalyzer()
+
+
+def _vader_chunk(queries: List[str]) -> List[Tuple[float, float, float, float]]:
+    results = []
+    for query in queries:
+        response = _worker_analyzer.polarity_scores(query)
+        results.append(tuple(response[field] for field in VADER_FIELDS))
+
+    return results
+
 
 class RuleBasedSentiment(object):
-    def __init__(self) -> None:
+    def __init__(
+        self, memo_size: int = 100000, metrics: Optional[MetricsRegistry] = None
+    ) -> None:
         self.analyzer = SentimentIntensityAnalyzer()
+        self.metrics = metrics if metrics is not None else get_registry()
+        # LRU memo of VADER outputs keyed by a hash of the text, syndicated headlines repeat a lot
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+
+    @staticmethod
+    def _text_key(query: str) -> bytes:
+        return hashlib.blake2b(query.encode("utf-8"), digest_size=16).digest()
+
+    def _memo_get(self, key: bytes) -> Optional[Tuple[float, float, float, float]]:
+        with self._memo_lock:
+            value = self._memo.get(key)
+            if value is not None:
+                self._memo.move_to_end(key)
+            return value
+
+    def _memo_put(self, key: bytes, value: Tuple[float, float, float, float]) -> None:
+        with self._memo_lock:
+            self._memo[key] = value
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def _polarity(self, query: str) -> Tuple[float, float, float, float]:
+        key = self._text_key(query)
+        value = self._memo_get(key)
+        if value is None:
+            response = self.analyzer.polarity_scores(query)
+            value = tuple(response[field] for field in VADER_FIELDS)
+            self._memo_put(key, value)
+
+        return value
 
     def get_valence_dict(self, query: str) -> Dict[str, float]:
-        response = self.analyzer.polarity_scores(query)
+        response = dict(zip(VADER_FIELDS, self._polarity(query)))
 
         return response
 
     def get_compound_score(self, query: str) -> float:
-        response = self.analyzer.polarity_scores(query)
+        response = self.get_valence_dict(query)
         score = response.get("compound")
 
         return score
 
     def get_positive_score(self, query: str) -> float:
-        response = self.analyzer.polarity_scores(query)
+        response = self.get_valence_dict(query)
         score = response.get("pos")
 
         return score
 
     def get_negative_score(self, query: str) -> float:
-        response = self.analyzer.polarity_scores(query)
+        response = self.get_valence_dict(query)
         score = response.get("neg")
 
         return score
 
     def get_neutral_score(self, query: str) -> float:
-        response = self.analyzer.polarity_scores(query)
-        score = response.get("pos")
+        response = self.get_valence_dict(query)
+        score = response.get("neu")
 
         return score
 
     def get_hmean_score(self, query: str) -> float:
-        response = self.analyzer.polarity_scores(query)
+        response = self.get_valence_dict(query)
         scores = []
         for k in response.keys():
             if (
@@ -53,17 +132,103 @@ class RuleBasedSentiment(object):
 
         return harmonic_mean(scores)
 
+    def score_many(
+        self, queries: List[str], n_jobs: int = 1, chunk_size: int = 512
+    ) -> pd.DataFrame:
+        """
+        Computes every VADER output for each query in a single pass and returns a DataFrame with the columns
+        neg, neu, pos, compound and hmean, one row per query in the same order.
+        Texts missing from the memo are analyzed on a pool of n_jobs processes when there are more than chunk_size of them.
+        """
+        keys = [self._text_key(query) for query in queries]
+        values = [self._memo_get(key) for key in keys]
+
+        # Only analyze each distinct text that is not in the memo yet
+        missing = {}
+        for i, value in enumerate(values):
+            if value is None and keys[i] not in missing:
+                missing[keys[i]] = queries[i]
+        missing_keys = list(missing.keys())
+        missing_queries = list(missing.values())
+        self.metrics.inc("texts_scored_total", len(queries), scorer="rules")
+        self.metrics.inc("rules_analyzed_total", len(missing_queries))
+
+        with self.metrics.span("rules.analyze"):
+            if n_jobs > 1 and len(missing_queries) > chunk_size:
+                chunks = [
+                    missing_queries[i : i + chunk_size]
+                    for i in range(0, len(missing_queries), chunk_size)
+                ]
+                with ProcessPoolExecutor(
+                    max_workers=n_jobs, initializer=_init_vader_worker
+                ) as executor:
+                    results = [
+                        r for chunk in executor.map(_vader_chunk, chunks) for r in chunk
+                    ]
+            else:
+                results = []
+                for query in missing_queries:
+                    response = self.analyzer.polarity_scores(query)
+                    results.append(tuple(response[field] for field in VADER_FIELDS))
+
+        computed = dict(zip(missing_keys, results))
+        for key, value in computed.items():
+            self._memo_put(key, value)
+        values = [
+            value if value is not None else computed[keys[i]]
+            for i, value in enumerate(values)
+        ]
+
+        scores = pd.DataFrame(
+            np.asarray(values, dtype="float64").reshape(-1, len(VADER_FIELDS)),
+            columns=VADER_FIELDS,
+        )
+        # Harmonic mean of the non-zero neg/neu/pos scores, matching get_hmean_score
+        components = scores[["neg", "neu", "pos"]].to_numpy()
+        positive = components > 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores["hmean"] = positive.sum(axis=1) / np.where(
+                positive, 1 / np.where(positive, components, 1), 0
+            ).sum(axis=1)
+
+        return scores
+
 
 class EmbeddedSentiment(object):
-    def __init__(self, model_name="all-mpnet-base-v2") -> None:
+    def __init__(
+        self,
+        model_name="all-mpnet-base-v2",
+        metrics: Optional[MetricsRegistry] = None,
+        models: Optional[ModelRegistry] = None,
+    ) -> None:
         self.model_name = model_name
-        self.model = SentenceTransformer(self.model_name)
+        self.metrics = metrics if metrics is not None else get_registry()
+        # The SentenceTransformer is loaded on first use and shared with other instances of the same model
+        self.models = models if models is not None else get_model_registry()
+        self.model_key = sentence_transformer_key(model_name)
+        self.models.register(
+            self.model_key, functools.partial(load_sentence_transformer, model_name)
+        )
+
+    @property
+    def model(self):
+        return self.models.get(self.model_key)
+
+    def warm(self) -> None:
+        # Starts loading the model in the background, e.g. while the news is fetched
+        self.models.warm(self.model_key)
 
     def create_embeddings(
         self, query: str, normalize: bool = True, progress_bar: bool = False
     ) -> npt.NDArray[np.float_]:
-        embeddings = self.model.encode(
-            query, normalize_embeddings=normalize, show_progress_bar=progress_bar
+        with self.metrics.span("embed.encode"):
+            embeddings = self.model.encode(
+                query, normalize_embeddings=normalize, show_progress_bar=progress_bar
+            )
+        self.metrics.inc(
+            "texts_embedded_total",
+            1 if isinstance(query, str) else len(query),
+            model=self.model_name,
         )
 
         # Ensure vector elements are float32 type.
@@ -125,6 +290,56 @@ class EmbeddedSentiment(object):
 
         return mean
 
+    @staticmethod
+    def get_closest_matches_batch(
+        similarity_matrix: npt.NDArray[np.float_], limit: int
+    ) -> npt.NDArray[np.int_]:
+        # Row-wise version of get_closest_matches. Returns a (Q, limit) array with the indices of the
+        # highest similarity scores for each query row.
+        indices = top_k(similarity_matrix=similarity_matrix, k=limit)
+
+        return indices
+
+    @staticmethod
+    def get_sentiment_scores_batch(
+        indices: npt.NDArray[np.int_],
+        sentiment_labels: Union[npt.NDArray[np.int_], List[int]],
+    ) -> npt.NDArray[np.float_]:
+        # Mean sentiment label of the neighbours for each query row.
+        sentiment_labels = np.asarray(sentiment_labels, dtype="float32")
+        means = sentiment_labels[indices].mean(axis=1)
+
+        return means
+
+    def score_batch(
+        self,
+        queries: List[str],
+        corpus_embeddings: npt.NDArray[np.float_],
+        sentiment_labels: Union[npt.NDArray[np.int_], List[int]],
+        limit: int = 100,
+        index: Optional[NeighborIndex] = None,
+    ) -> npt.NDArray[np.float_]:
+        """
+        Scores every query against the labeled corpus in one pass: a single encode call for all of the
+        queries, then a row-wise top-k search through the neighbour index. Without an index the exact
+        brute-force search over `corpus_embeddings` is used.
+        Returns one k-NN sentiment score per query, in the same order as the queries.
+        """
+        if len(queries) == 0 or corpus_embeddings.size == 0:
+            return np.asarray([], dtype="float32")
+
+        if index is None:
+            index = ExactIndex(embeddings=corpus_embeddings)
+        query_embeddings = self.create_embeddings(list(queries))
+        with self.metrics.span("embed.search", index=type(index).__name__):
+            _, indices = index.search(queries=query_embeddings, k=limit)
+        self.metrics.inc("texts_scored_total", len(queries), scorer="embed")
+        scores = self.get_sentiment_scores_batch(
+            indices=indices, sentiment_labels=sentiment_labels
+        )
+
+        return scores
+
     def get_stock_data_embed(self, filepath: str, sample: int = 1000) -> pd.DataFrame:
 
         stock_df = pd.read_csv(filepath_or_buffer=filepath, header=0, index_col=0)
@@ -136,6 +351,80 @@ class EmbeddedSentiment(object):
 
         return stock_df
 
+    def load_stock_data_embed(
+        self,
+        filepath: str,
+        sample: Optional[int] = None,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        seed: Optional[int] = None,
+    ) -> Tuple[npt.NDArray[np.float_], npt.NDArray[np.int_]]:
+        """
+        Returns (embeddings, sentiment labels) for the labeled corpus from the on-disk embedding cache.
+        The corpus is only encoded on the first run for a given model and corpus file. With a seed, the same
+        sample is drawn on every run.
+        """
+        cache = EmbeddingCache(cache_dir=cache_dir)
+        with self.metrics.span("embed.load_corpus"):
+            embeddings, labels = cache.get(
+                embed=self, filepath=filepath, sample=sample, seed=seed
+            )
+
+        return embeddings, labels
+
+    def load_neighbor_index(
+        self,
+        filepath: str,
+        kind: str = "exact",
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        nlist: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        rerank: Optional[int] = None,
+        rebuild: bool = False,
+    ) -> NeighborIndex:
+        """
+        Returns a neighbour index over the full cached corpus. 'exact' is the brute-force search, 'ivf' is the
+        inverted file index and 'sq8'/'pq' search int8 or product quantized codes and re-rank in float32.
+        Approximate indexes are saved next to the embedding cache and loaded on later runs. A loaded IVF index
+        keeps the nprobe it was saved with unless nprobe is given, and a loaded 'sq8'/'pq' index its rerank.
+        """
+        index_kinds = INDEX_KINDS
+        cache = EmbeddingCache(cache_dir=cache_dir)
+        embeddings, _ = cache.get(embed=self, filepath=filepath)
+
+        if kind == "exact":
+            return ExactIndex(embeddings=embeddings)
+        elif kind == "ivf":
+            index_path = cache.index_path(
+                model_name=self.model_name, filepath=filepath, name="ivf"
+            )
+            if os.path.exists(index_path) and not rebuild:
+                return IVFIndex.load(
+                    path=index_path, embeddings=embeddings, nprobe=nprobe
+                )
+            index = IVFIndex(
+                nlist=nlist, nprobe=nprobe if nprobe is not None else DEFAULT_NPROBE
+            ).build(embeddings=embeddings)
+            index.save(path=index_path)
+            return index
+        elif kind in QUANTIZERS:
+            index_path = cache.index_path(
+                model_name=self.model_name, filepath=filepath, name=kind
+            )
+            if os.path.exists(index_path) and not rebuild:
+                return QuantizedIndex.load(
+                    path=index_path, embeddings=embeddings, rerank=rerank
+                )
+            index = QuantizedIndex(
+                quantizer=QUANTIZERS[kind](),
+                rerank=rerank if rerank is not None else DEFAULT_RERANK,
+            ).build(embeddings=embeddings)
+            index.save(path=index_path)
+            return index
+        else:
+            raise Exception(
+                f"You entered '{kind}' for the neighbour index type. Please enter one of: {index_kinds}."
+            )
+
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,165 @@
+"""
+Multi-core scoring on a pool of worker processes.
+The corpus embeddings and sentiment labels are copied into multiprocessing.shared_memory once, and every worker maps
+them as numpy arrays instead of receiving a pickled copy. Each worker holds its own embedding model and VADER
+analyzer, the queries are split into shards and only the query texts and the scores cross process boundaries.
+"""
+
+from modules.neighbors import ExactIndex
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+
+# State of a worker process, set once by _init_worker
+_worker = {}
+
+
+def _attach(
+    name: str, shape: Tuple[int, ...], dtype: str
+) -> Tuple[SharedMemory, np.ndarray]:
+    # Workers share the parent's resource tracker, so the block is only unlinked by ShardedScorer.close()
+    shm = SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _limit_threads(threads: int) -> None:
+    # One BLAS/torch thread per worker, the parallelism comes from the processes
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    try:
+        from threadpoolctl import threadpool_limits
+
+        _worker["threadpool_limits"] = threadpool_limits(limits=threads)
+    except ImportError:
+        pass
+
+
+def _init_worker(
+    embeddings_name: str,
+    embeddings_shape: Tuple[int, int],
+    labels_name: str,
+    labels_shape: Tuple[int],
+    model_name: str,
+    threads: int,
+) -> None:
+    from modules.sentiment import EmbeddedSentiment, RuleBasedSentiment
+
+    _limit_threads(threads)
+    embeddings_shm, embeddings = _attach(embeddings_name, embeddings_shape, "float32")
+    labels_shm, labels = _attach(labels_name, labels_shape, "float32")
+    embed = EmbeddedSentiment(model_name=model_name)
+    # Load the model now so the first shard does not pay for it
+    embed.model
+    _worker.update(
+        {
+            "shm": [embeddings_shm, labels_shm],
+            "index": ExactIndex(embeddings=embeddings),
+            "labels": labels,
+            "embed": embed,
+            "rules": RuleBasedSentiment(),
+        }
+    )
+
+
+def _score_shard(queries: List[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # k-NN sentiment and VADER compound score of every query in the shard
+    embed = _worker["embed"]
+    _, indices = _worker["index"].search(
+        queries=embed.create_embeddings(list(queries)), k=k
+    )
+    embed_scores = _worker["labels"][indices].mean(axis=1)
+    rules_scores = _worker["rules"].score_many(queries=queries)["compound"].to_numpy()
+
+    return embed_scores, rules_scores
+
+
+class ShardedScorer(object):
+    def __init__(
+        self,
+        corpus_embeddings: npt.NDArray[np.float32],
+        sentiment_labels: npt.NDArray[np.int_],
+        model_name: str = "all-mpnet-base-v2",
+        n_workers: Optional[int] = None,
+        shard_size: int = 64,
+        threads_per_worker: int = 1,
+        start_method: str = "spawn",
+    ) -> None:
+        """
+        n_workers defaults to the number of cores. Workers are started with `start_method`, 'spawn' by default
+        because forking a process that already runs torch threads can deadlock.
+        """
+        self.model_name = model_name
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self._shm = []
+
+        embeddings_shm, embeddings = self._share(
+            np.asarray(corpus_embeddings, dtype="float32")
+        )
+        labels_shm, labels = self._share(np.asarray(sentiment_labels, dtype="float32"))
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.n_workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_worker,
+            initargs=(
+                embeddings_shm.name,
+                embeddings.shape,
+                labels_shm.name,
+                labels.shape,
+                model_name,
+                threads_per_worker,
+            ),
+        )
+
+    def _share(self, array: np.ndarray) -> Tuple[SharedMemory, np.ndarray]:
+        # Copies the array into a new shared memory block, the only copy of the corpus that is ever made
+        shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        shared[:] = array
+        self._shm.append(shm)
+        return shm, shared
+
+    def score(self, queries: List[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the k-NN sentiment scores and the VADER compound scores of the queries, in query order.
+        """
+        if len(queries) == 0:
+            return np.asarray([], dtype="float32"), np.asarray([], dtype="float64")
+        # Small shards, and at least one per worker, so no worker sits idle while another finishes a long shard
+        shard_size = max(1, min(self.shard_size, -(-len(queries) // self.n_workers)))
+        shards = [
+            queries[i : i + shard_size] for i in range(0, len(queries), shard_size)
+        ]
+        results = list(self.executor.map(_score_shard, shards, [k] * len(shards)))
+
+        return (
+            np.concatenate([r[0] for r in results]),
+            np.concatenate([r[1] for r in results]),
+        )
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+        self._shm = []
+
+    def __enter__(self) -> "ShardedScorer":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,155 @@
+"""
+Local SQLite store of every article that has already been fetched and scored.
+Articles are keyed by their RSS link and canonical URL so repeat runs can skip fetching them, and by a hash of
+their title and paragraphs so stored scores are reused whenever the same content is scored again with the same
+scoring settings.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+DEFAULT_STATE_PATH = "./cache/article_state.sqlite"
+
+SCORE_COLUMNS = [
+    "title_sentiment_embed",
+    "title_sentiment_rules",
+    "article_sentiment_embed",
+    "article_sentiment_rules",
+]
+
+
+def content_hash(title: str, paragraphs: List[str]) -> str:
+    sha = hashlib.sha256()
+    sha.update((title or "").encode("utf-8"))
+    for paragraph in paragraphs:
+        sha.update(b"\x00")
+        sha.update(paragraph.encode("utf-8"))
+
+    return sha.hexdigest()
+
+
+class ArticleStateStore(object):
+    def __init__(self, path: str = DEFAULT_STATE_PATH) -> None:
+        self.path = path
+        state_dir = os.path.dirname(path)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS articles (
+                link_rss TEXT PRIMARY KEY,
+                canonical_url TEXT,
+                article_content TEXT,
+                content_hash TEXT,
+                scoring_key TEXT,
+                title_sentiment_embed REAL,
+                title_sentiment_rules REAL,
+                article_sentiment_embed REAL,
+                article_sentiment_rules REAL,
+                updated_at REAL
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS articles_canonical ON articles (canonical_url)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS articles_content ON articles (content_hash, scoring_key)"
+        )
+        self.conn.commit()
+
+    def get_fetched(self, link_rss: str) -> Optional[dict]:
+        # Canonical URL and paragraphs of an article that was already fetched through this RSS link
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT canonical_url, article_content FROM articles WHERE link_rss = ?",
+                (link_rss,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        return {"links_canonical": row[0], "article_content": json.loads(row[1])}
+
+    def get_fetched_by_canonical(self, canonical_url: str) -> Optional[List[str]]:
+        # Paragraphs of an article that was already fetched through another RSS link
+        if canonical_url is None:
+            return None
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT article_content FROM articles WHERE canonical_url = ? LIMIT 1",
+                (canonical_url,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        return json.loads(row[0])
+
+    def save_fetched(
+        self, link_rss: str, canonical_url: Optional[str], paragraphs: List[str]
+    ) -> None:
+        with self._lock:
+            self.conn.execute(
+                """
+                INSERT INTO articles (link_rss, canonical_url, article_content, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(link_rss) DO UPDATE SET
+                    canonical_url = excluded.canonical_url,
+                    article_content = excluded.article_content,
+                    updated_at = excluded.updated_at
+                """,
+                (link_rss, canonical_url, json.dumps(paragraphs), time.time()),
+            )
+            self.conn.commit()
+
+    def get_scores(self, hashes: List[str], scoring_key: str) -> Dict[str, dict]:
+        # Stored scores for each content hash that was scored with the same settings
+        found = {}
+        with self._lock:
+            for h in set(hashes):
+                row = self.conn.execute(
+                    f"SELECT {', '.join(SCORE_COLUMNS)} FROM articles WHERE content_hash = ? AND scoring_key = ? LIMIT 1",
+                    (h, scoring_key),
+                ).fetchone()
+                if row is not None:
+                    found[h] = dict(zip(SCORE_COLUMNS, row))
+
+        return found
+
+    def save_scores(self, records: List[dict], scoring_key: str) -> None:
+        """
+        records need link_rss, links_canonical, article_content, content_hash and the score columns.
+        """
+        now = time.time()
+        rows = [
+            (
+                r["link_rss"],
+                r.get("links_canonical"),
+                json.dumps(list(r["article_content"])),
+                r["content_hash"],
+                scoring_key,
+                *[float(r[column]) for column in SCORE_COLUMNS],
+                now,
+            )
+            for r in records
+        ]
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,210 @@
+"""
+Streaming version of the Google News pipeline.
+RSS parsing, article fetching, scoring and output run as chained stages on their own threads with bounded queues
+between them, so each scored article is written as a JSONL record as soon as it is ready and memory stays flat
+no matter how large the feed is.
+"""
+
+from modules.googlenews import GoogleNews
+from modules.neighbors import NeighborIndex
+from modules.scoring import score_news
+from modules.sentiment import EmbeddedSentiment, RuleBasedSentiment
+from modules.utils import logger as lg
+
+import json
+import os
+import queue
+import threading
+from typing import Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+stream_handler = lg.StreamLogging()
+logger = lg.CustomLogger(
+    logger_name=os.path.basename(__file__), handlers=[stream_handler]
+).get_logger()
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+class StreamingPipeline(object):
+    def __init__(
+        self,
+        gn: GoogleNews,
+        embed: EmbeddedSentiment,
+        rules: RuleBasedSentiment,
+        corpus_embeddings: np.ndarray,
+        sentiment_labels: np.ndarray,
+        k: int = 100,
+        index: Optional[NeighborIndex] = None,
+        fetch_workers: int = 8,
+        queue_size: int = 32,
+        score_batch_size: int = 8,
+        score_wait: float = 0.2,
+    ) -> None:
+        self.gn = gn
+        self.embed = embed
+        self.rules = rules
+        self.corpus_embeddings = corpus_embeddings
+        self.sentiment_labels = sentiment_labels
+        self.k = k
+        self.index = index
+        self.fetch_workers = fetch_workers
+        self.queue_size = queue_size
+        # Fetched articles are scored in small batches: up to score_batch_size articles, or whatever
+        # arrived within score_wait seconds, so the first results are not held back by slow downloads
+        self.score_batch_size = score_batch_size
+        self.score_wait = score_wait
+
+    def _parse_stage(
+        self, query: str, items: queue.Queue, errors: List[Exception]
+    ) -> None:
+        try:
+            response = self.gn.search(query=query)
+            for item in self.gn.iter_search_items(response=response):
+                items.put(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # One end marker for every fetch worker
+            for _ in range(self.fetch_workers):
+                items.put(_DONE)
+
+    def _fetch_stage(
+        self,
+        query_terms: List[str],
+        items: queue.Queue,
+        fetched: queue.Queue,
+    ) -> None:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                fetched.put(_DONE)
+                return
+            try:
+                canonical_url, content = self.gn.fetch_article(
+                    rss_url=item["link_rss"], query_terms=query_terms
+                )
+            except Exception as e:
+                # A failed article only loses its contents, the title is still scored
+                logger.warning(
+                    f"Received the exception '{e}' while fetching '{item['link_rss']}'."
+                )
+                canonical_url, content = None, []
+            fetched.put(
+                {
+                    **item,
+                    "links_canonical": canonical_url,
+                    "article_content": content,
+                }
+            )
+
+    def _score(self, batch: List[dict]) -> List[dict]:
+        news_df = score_news(
+            news_df=pd.DataFrame(batch),
+            embed=self.embed,
+            rules=self.rules,
+            stock_embeddings=self.corpus_embeddings,
+            sentiment_labels=self.sentiment_labels,
+            k=self.k,
+            index=self.index,
+        )
+        return news_df.to_dict(orient="records")
+
+    def _score_stage(
+        self, fetched: queue.Queue, scored: queue.Queue, errors: List[Exception]
+    ) -> None:
+        finished_workers = 0
+        try:
+            while finished_workers < self.fetch_workers:
+                batch = []
+                item = fetched.get()
+                while True:
+                    if item is _DONE:
+                        finished_workers += 1
+                    else:
+                        batch.append(item)
+                    if (
+                        len(batch) >= self.score_batch_size
+                        or finished_workers == self.fetch_workers
+                    ):
+                        break
+                    try:
+                        item = fetched.get(timeout=self.score_wait)
+                    except queue.Empty:
+                        break
+                if len(batch) > 0:
+                    for record in self._score(batch):
+                        scored.put(record)
+        except Exception as e:
+            errors.append(e)
+            # Keep draining so the fetch workers are not left blocked on a full queue
+            while finished_workers < self.fetch_workers:
+                if fetched.get() is _DONE:
+                    finished_workers += 1
+        finally:
+            scored.put(_DONE)
+
+    def stream(self, query: str, query_terms: List[str]) -> Iterator[dict]:
+        """
+        Yields one scored record per article, in the order the articles finish.
+        The record fields are the same as the columns of the news DataFrame in main_gnews.py.
+        """
+        items = queue.Queue(maxsize=self.queue_size)
+        fetched = queue.Queue(maxsize=self.queue_size)
+        scored = queue.Queue(maxsize=self.queue_size)
+        errors = []
+
+        threads = [
+            threading.Thread(
+                target=self._parse_stage, args=(query, items, errors), daemon=True
+            ),
+            threading.Thread(
+                target=self._score_stage, args=(fetched, scored, errors), daemon=True
+            ),
+        ] + [
+            threading.Thread(
+                target=self._fetch_stage,
+                args=(query_terms, items, fetched),
+                daemon=True,
+            )
+            for _ in range(self.fetch_workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        while True:
+            record = scored.get()
+            if record is _DONE:
+                break
+            yield record
+
+        for thread in threads:
+            thread.join()
+        # Parse and scoring errors mean the stream is incomplete
+        if len(errors) > 0:
+            raise errors[0]
+
+    def run(self, query: str, query_terms: List[str], output_path: str) -> int:
+        """
+        Writes one JSONL record per scored article to output_path and flushes after each record.
+        Returns the number of records written.
+        """
+        output_dir = os.path.dirname(output_path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        written = 0
+        with open(output_path, "w") as f:
+            for record in self.stream(query=query, query_terms=query_terms):
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                written += 1
+
+        return written
+
+
+if __name__ == "__main__":
+    pass
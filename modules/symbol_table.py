@@ -0,0 +1,199 @@
+"""
+Local symbol table of ticker symbols, company names and aliases.
+The table is a compact SQLite index that can be bulk loaded from a listing file (e.g. the NASDAQ/NYSE symbol
+directories), so company names are looked up locally and only unknown tickers go to the network.
+Aliases are other symbols for the same security, e.g. 'BRK.B' or 'BRK/B' for 'BRK-B'.
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+DEFAULT_SYMBOL_PATH = "./cache/symbols.sqlite"
+
+# Column names that listing files commonly use for the symbol and the company name
+TICKER_COLUMNS = ["ticker", "symbol", "act symbol", "nasdaq symbol"]
+NAME_COLUMNS = ["name", "company", "company name", "security name"]
+ALIAS_COLUMNS = ["aliases", "alias"]
+
+# SQLite limits the number of parameters in one statement
+_CHUNK_SIZE = 500
+
+
+def normalize_symbol(symbol: str) -> str:
+    return symbol.strip().upper()
+
+
+class SymbolTable(object):
+    def __init__(self, path: str = DEFAULT_SYMBOL_PATH) -> None:
+        self.path = path
+        table_dir = os.path.dirname(path)
+        if table_dir and not os.path.exists(table_dir):
+            os.makedirs(table_dir)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS symbols (
+                ticker TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                source TEXT
+            ) WITHOUT ROWID
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS aliases (
+                alias TEXT PRIMARY KEY,
+                ticker TEXT NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        self.conn.commit()
+
+    def add(
+        self,
+        records: Iterable[Tuple[str, str]],
+        aliases: Optional[Iterable[Tuple[str, str]]] = None,
+        source: str = "file",
+    ) -> int:
+        """
+        records are (ticker, company name) pairs and aliases are (alias, ticker) pairs.
+        Returns the number of symbols written.
+        """
+        rows = [
+            (normalize_symbol(ticker), name.strip(), source)
+            for ticker, name in records
+            if ticker and name
+        ]
+        alias_rows = [
+            (normalize_symbol(alias), normalize_symbol(ticker))
+            for alias, ticker in (aliases or [])
+            if alias and ticker and normalize_symbol(alias) != normalize_symbol(ticker)
+        ]
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO symbols VALUES (?, ?, ?)", rows
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO aliases VALUES (?, ?)", alias_rows
+            )
+            self.conn.commit()
+
+        return len(rows)
+
+    def load_file(
+        self, filepath: str, sep: Optional[str] = None, alias_sep: str = "|"
+    ) -> int:
+        """
+        Bulk loads a CSV, TSV or pipe delimited listing file with a ticker/symbol column and a name column.
+        An optional 'aliases' column holds other symbols for the same ticker, separated by alias_sep.
+        Symbols with '.' or '/' also get the '-' form that Yahoo Finance uses as an alias.
+        """
+        if sep is None:
+            # Use whichever delimiter appears most often in the header line
+            with open(filepath, "r") as f:
+                header = f.readline()
+            sep = max(["|", "\t", ","], key=header.count)
+        # Footer lines such as the creation time in the NASDAQ directories are skipped
+        data = pd.read_csv(
+            filepath, sep=sep, dtype=str, keep_default_na=False, on_bad_lines="skip"
+        )
+        columns = {c.strip().lower(): c for c in data.columns}
+        ticker_col = next((columns[c] for c in TICKER_COLUMNS if c in columns), None)
+        name_col = next((columns[c] for c in NAME_COLUMNS if c in columns), None)
+        if ticker_col is None or name_col is None:
+            raise Exception(
+                f"Could not find a ticker column ({TICKER_COLUMNS}) and a name column ({NAME_COLUMNS}) in '{filepath}'."
+            )
+        alias_col = next((columns[c] for c in ALIAS_COLUMNS if c in columns), None)
+
+        records = list(zip(data[ticker_col], data[name_col]))
+        aliases = []
+        # Dotted/slashed symbols and the Yahoo Finance form, which is preferred as the canonical ticker
+        yahoo_form = {}
+        for i, (ticker, _) in enumerate(records):
+            ticker = normalize_symbol(ticker)
+            for sep_char in [".", "/"]:
+                if sep_char in ticker:
+                    yahoo_form[ticker] = ticker.replace(sep_char, "-")
+                    aliases.append((ticker, yahoo_form[ticker]))
+            if alias_col is not None:
+                for alias in data[alias_col].iloc[i].split(alias_sep):
+                    if normalize_symbol(alias):
+                        aliases.append((normalize_symbol(alias), ticker))
+
+        # The symbols and the aliases pointing at them both use the canonical ticker, so an alias resolves in one
+        # lookup
+        records = [
+            (yahoo_form.get(normalize_symbol(ticker), ticker), name)
+            for ticker, name in records
+        ]
+        aliases = [(alias, yahoo_form.get(ticker, ticker)) for alias, ticker in aliases]
+        return self.add(records=records, aliases=aliases, source="file")
+
+    def resolve(self, symbols: List[str]) -> Dict[str, str]:
+        # Maps each symbol to its canonical ticker, symbols without an alias map to themselves
+        symbols = [normalize_symbol(s) for s in symbols]
+        resolved = {s: s for s in symbols}
+        unique = list(dict.fromkeys(symbols))
+        with self._lock:
+            for i in range(0, len(unique), _CHUNK_SIZE):
+                chunk = unique[i : i + _CHUNK_SIZE]
+                rows = self.conn.execute(
+                    f"SELECT alias, ticker FROM aliases WHERE alias IN ({', '.join(['?'] * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                resolved.update(dict(rows))
+
+        return resolved
+
+    def lookup_many(self, symbols: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Company name for each symbol (ticker or alias), None for symbols that are not in the table.
+        The keys are the symbols as given.
+        """
+        resolved = self.resolve(symbols)
+        tickers = list(dict.fromkeys(resolved.values()))
+        names = {}
+        with self._lock:
+            for i in range(0, len(tickers), _CHUNK_SIZE):
+                chunk = tickers[i : i + _CHUNK_SIZE]
+                rows = self.conn.execute(
+                    f"SELECT ticker, name FROM symbols WHERE ticker IN ({', '.join(['?'] * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                names.update(dict(rows))
+
+        return {s: names.get(resolved[normalize_symbol(s)]) for s in symbols}
+
+    def lookup(self, symbol: str) -> Optional[str]:
+        return self.lookup_many([symbol])[symbol]
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM symbols").fetchone()[0]
+
+
+if __name__ == "__main__":
+    # e.g. python -m modules.symbol_table load ./assets/nasdaqlisted.txt
+    parser = argparse.ArgumentParser(description="Manage the local symbol table.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    load_parser = subparsers.add_parser("load")
+    load_parser.add_argument("filepath")
+    lookup_parser = subparsers.add_parser("lookup")
+    lookup_parser.add_argument("symbols", nargs="+")
+    parser.add_argument("--path", default=DEFAULT_SYMBOL_PATH)
+    args = parser.parse_args()
+
+    table = SymbolTable(path=args.path)
+    if args.command == "load":
+        loaded = table.load_file(args.filepath)
+        print(f"Loaded {loaded} symbol(s), the table has {table.count()} symbol(s).")
+    else:
+        for symbol, name in table.lookup_many(args.symbols).items():
+            print(f"{symbol}\t{name}")
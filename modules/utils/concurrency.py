@@ -0,0 +1,49 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, List, TypeVar
+from urllib.parse import urlparse
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class HostLimiter(object):
+    """
+    Caps the number of requests in flight to any single host, independent of the global thread pool size.
+    """
+
+    def __init__(self, max_per_host: int = 2) -> None:
+        self.max_per_host = max_per_host
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, host: str) -> threading.Semaphore:
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._semaphores[host]
+
+    @contextmanager
+    def slot(self, url: str):
+        semaphore = self._semaphore(urlparse(url).netloc.lower())
+        with semaphore:
+            yield
+
+
+def ordered_map(
+    func: Callable[[T], R], items: Iterable[T], max_workers: int = 8
+) -> List[R]:
+    """
+    Runs func over items on a thread pool and returns the results in the same order as the items.
+    With max_workers <= 1 the items are processed sequentially on the calling thread.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(x) for x in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,257 @@
+"""
+Lightweight run metrics next to the logger: timing spans, counters and histograms.
+The pipeline classes record into the process wide registry returned by get_registry() unless they are given
+their own. A run can be written out as JSON (per-run summary) or in the Prometheus text exposition format, e.g.
+for the node_exporter textfile collector.
+
+    metrics = get_registry()
+    with metrics.span("google_news.search"):
+        ...
+    metrics.inc("texts_embedded_total", 32, model="all-mpnet-base-v2")
+    metrics.write_json("./output/AAPL_metrics.json")
+"""
+
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Prometheus client defaults, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SPAN_METRIC = "span_duration_seconds"
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra is not None else [])
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram(object):
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        # Per-bucket counts, the last slot is the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        # (upper bound, observations <= bound) pairs as Prometheus expects them
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count > 0 else None,
+            "min": self.min,
+            "max": self.max,
+            "buckets": {_format_value(b): c for b, c in self.cumulative()},
+        }
+
+
+class MetricsRegistry(object):
+    def __init__(self, prefix: str = "cs410") -> None:
+        # Prefix of every exported Prometheus metric name
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started_at = time.time()
+            self.counters = {}
+            self.histograms = {}
+            self.spans = {}
+
+    # Recording
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+        **labels,
+    ) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets=buckets)
+            self.histograms[key].observe(value)
+
+    def _stack(self) -> List[str]:
+        # Open spans of the current thread, used to attribute nested spans to their parent
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """
+        Times the enclosed block. The duration goes into the span_duration_seconds histogram and the per-run
+        span summary, also when the block raises.
+        """
+        stack = self._stack()
+        parent = stack[-1] if len(stack) > 0 else None
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            self.observe(SPAN_METRIC, seconds, span=name, **labels)
+            with self._lock:
+                summary = self.spans.setdefault(
+                    name, {"parent": parent, "count": 0, "total_s": 0.0, "max_s": 0.0}
+                )
+                summary["count"] += 1
+                summary["total_s"] += seconds
+                summary["max_s"] = max(summary["max_s"], seconds)
+
+    def timed(self, name: Optional[str] = None, **labels) -> Callable:
+        # Decorator form of span, named after the function unless a name is given
+        def decorator(func: Callable) -> Callable:
+            span_name = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, **labels):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    # Export
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            counters = {}
+            for (name, key), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append(
+                    {"labels": dict(key), "value": value}
+                )
+            histograms = {}
+            for (name, key), histogram in sorted(
+                self.histograms.items(), key=lambda x: x[0]
+            ):
+                if name == SPAN_METRIC:
+                    continue
+                histograms.setdefault(name, []).append(
+                    {"labels": dict(key), **histogram.to_dict()}
+                )
+            spans = {name: dict(summary) for name, summary in self.spans.items()}
+
+        return {
+            "started_at": self.started_at,
+            "elapsed_s": time.time() - self.started_at,
+            "spans": spans,
+            "counters": counters,
+            "histograms": histograms,
+        }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda x: x[0])
+        typed = set()
+        for (name, key), value in counters:
+            metric = f"{self.prefix}_{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_format_labels(key)} {_format_value(value)}")
+        for (name, key), histogram in histograms:
+            metric = f"{self.prefix}_{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            for bound, count in histogram.cumulative():
+                labels = _format_labels(key, ("le", _format_value(bound)))
+                lines.append(f"{metric}_bucket{labels} {count}")
+            lines.append(
+                f"{metric}_sum{_format_labels(key)} {_format_value(histogram.sum)}"
+            )
+            lines.append(f"{metric}_count{_format_labels(key)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _write(path: str, text: str) -> None:
+        output_dir = os.path.dirname(path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        # Write then rename so a scraper never reads a half written file
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def write_json(self, path: str) -> None:
+        self._write(path, json.dumps(self.to_dict(), indent=4))
+
+    def write_prometheus(self, path: str) -> None:
+        self._write(path, self.to_prometheus())
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    # Process wide registry shared by the pipeline classes
+    return _registry
+
+
+def span(name: str, **labels):
+    return _registry.span(name, **labels)
+
+
+def timed(name: Optional[str] = None, **labels) -> Callable:
+    return _registry.timed(name, **labels)
+
+
+if __name__ == "__main__":
+    pass
@@ -4,15 +4,32 @@ import requests
 import numpy as np
 from yahooquery import Ticker
 from datetime import datetime
-from bs4 import BeautifulSoup
 from lxml import etree
-from requests.adapters import HTTPAdapter
-import urllib3
+from typing import Dict, List, Optional, Tuple
+
+from modules.http_client import HttpClient, get_shared_client
+from modules.price_store import PriceStore, yearly_returns
+from modules.symbol_table import SymbolTable
+from modules.utils.concurrency import ordered_map
+from modules.utils.metrics import MetricsRegistry, get_registry
 
 
 class YahooFinance(object):
-    def __init__(self, base_url="https://finance.yahoo.com/quote/"):
+    def __init__(
+        self,
+        base_url="https://finance.yahoo.com/quote/",
+        http_client: HttpClient = None,
+        price_store: PriceStore = None,
+        symbol_table: SymbolTable = None,
+        metrics: MetricsRegistry = None,
+    ):
         self.base_url = base_url
+        self.price_store = price_store
+        self.symbol_table = symbol_table
+        self.http_client = (
+            http_client if http_client is not None else get_shared_client()
+        )
+        self.metrics = metrics if metrics is not None else get_registry()
 
     @staticmethod
     def get_historical_data(
@@ -21,7 +38,11 @@ class YahooFinance(object):
         end: datetime,
         interval: str = "1d",
         type: str = "equity",
-    ) -> pd.DataFrame:
+    ) -> Optional[pd.DataFrame]:
+        """
+        Returns None when yahooquery hands back an error message instead of a DataFrame, e.g. when the request
+        failed or was rate limited, and an empty DataFrame when the ticker is valid but has no rows in the range.
+        """
 
         data_types = ["equity", "options"]
         ticker_data = Ticker(ticker)
@@ -35,6 +56,15 @@ class YahooFinance(object):
             logging.warning(
                 f"You entered {type} for the historical data type. Please enter one of: {data_types}."
             )
+        # yahooquery returns {symbol: chart} without timestamps when a valid ticker has no rows in the range, e.g. a
+        # weekend. The empty frame lets the price store mark the range as downloaded
+        if isinstance(target_data, dict) and type.lower() == "equity":
+            chart = next(iter(target_data.values()), None)
+            if isinstance(chart, dict) and "meta" in chart:
+                return pd.DataFrame(columns=["date"])
+        # A message instead of a DataFrame when the request failed
+        if not isinstance(target_data, pd.DataFrame):
+            return None
         # Add row index
         target_data["index"] = target_data.reset_index().index
         target_data.reset_index(inplace=True)
@@ -42,102 +72,139 @@ class YahooFinance(object):
 
         return target_data
 
+    def _get_price_store(self) -> PriceStore:
+        # The default store is only created once price history is actually needed
+        if self.price_store is None:
+            self.price_store = PriceStore()
+        return self.price_store
+
+    def _fetch_history(
+        self, ticker: str, start: datetime, end: datetime
+    ) -> Optional[pd.DataFrame]:
+        # Only called by the price store for date ranges it does not have yet, None when the download failed
+        self.metrics.inc("price_history_fetches_total", ticker=ticker)
+        with self.metrics.span("yahoo.history"):
+            return self.get_historical_data(ticker=ticker, start=start, end=end)
+
+    def calculate_returns(
+        self,
+        tickers: List[str],
+        windows: List[Tuple[datetime, datetime]],
+    ) -> pd.DataFrame:
+        """
+        Time weighted yearly return of every ticker over every (start, end) window, see calculate_return.
+        Price history comes from the local price store, which only downloads date ranges it does not have yet.
+        Returns a DataFrame with the columns ticker, start, end and return (NaN when there is no price data).
+        """
+        starts = np.asarray([np.datetime64(w[0], "D") for w in windows])
+        ends = np.asarray([np.datetime64(w[1], "D") for w in windows])
+        store = self._get_price_store()
+
+        frames = []
+        for ticker in tickers:
+            with self.metrics.span("yahoo.price_store"):
+                data = store.get_history(
+                    ticker=ticker,
+                    start=starts.min().astype(datetime),
+                    end=ends.max().astype(datetime),
+                    fetch=self._fetch_history,
+                )
+            with self.metrics.span("yahoo.returns"):
+                returns = yearly_returns(
+                    dates=data["date"].to_numpy().astype("datetime64[D]"),
+                    opens=data["open"].to_numpy(dtype="float64"),
+                    closes=data["close"].to_numpy(dtype="float64"),
+                    dividends=data["dividends"].to_numpy(dtype="float64"),
+                    starts=starts,
+                    ends=ends,
+                )
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "ticker": ticker,
+                        "start": starts,
+                        "end": ends,
+                        "return": returns,
+                    }
+                )
+            )
+
+        return pd.concat(frames, ignore_index=True)
+
     def calculate_return(self, ticker: str, start: datetime, end: datetime) -> float:
         """
         Assumes shares are bought on the open price of the start date and sold at the close on the end date.
         Dividends are reinvested at the next day's opening price.
         Splits are already accounted for in Yahoo Finance data.
         """
-        # Store the following data in a list of tuples: (buy date, price, shares)
-        dividend_list = []
-        shares = 1
-        data = self.get_historical_data(ticker=ticker, start=start, end=end)
-        buy_price = data["open"][0]
-        sell_price = data["close"][data.shape[0] - 1]
-        # Reinvest dividends
-        try:
-            dividend_idx = data.index[data["dividends"] > 0].tolist()
-        except KeyError:
-            dividend_idx = []
-        # Calculate extra shares
-        for idx in dividend_idx:
-            # Handle if the dividend was paid on the last row of the datafame
-            try:
-                div_shares = data.loc[idx, "dividends"] / data.loc[idx + 1, "open"]
-                div_date = data.loc[idx + 1, "date"]
-                share_price = data.loc[idx + 1, "open"]
-                dividend_list.append((div_date, share_price, div_shares))
-            except KeyError:
-                # Add back in to closing price otherwise
-                div_amount = data.loc[idx, "dividends"]
-                sell_price += div_amount
-        # Calculate total dollars received at sale
-        for div in dividend_list:
-            shares += div[2]
-        proceeds = shares * sell_price
-
-        # Calculate time weighted yearly return
-        # First get the weighted share years since we don't want to count holding the partial dividend shares as high as whole shares.
-        total_days = (end - start).days
-        # The single share of stock has the full days
-        share_days = total_days * 1
-        for div in dividend_list:
-            # Holding period of partial stock from dividend reinvestment times the number of shares
-            div_days = (
-                end - datetime(div[0].year, div[0].month, div[0].day)
-            ).days * div[2]
-            share_days += div_days
-
-        # Yearly average return
-        yearly_ret = (proceeds / buy_price) ** (1 / (share_days / 365.0)) - 1
+        returns = self.calculate_returns(tickers=[ticker], windows=[(start, end)])
+        yearly_ret = float(returns["return"][0])
 
         return yearly_ret
 
-    @staticmethod
-    def __http_adapter() -> HTTPAdapter:
-        retry_params = urllib3.Retry(
-            total=3,
-            read=3,
-            connect=3,
-            backoff_factor=0.5,
-            status_forcelist=(400, 404, 500, 502, 504),
-            allowed_methods=frozenset(
-                ["POST", "HEAD", "TRACE", "GET", "PUT", "OPTIONS", "DELETE"]
-            ),
-            raise_on_status=False,
-        )
-        adapter = HTTPAdapter(max_retries=retry_params)
-        http = requests.Session()
-        http.mount("https://", adapter)
-        http.mount("http://", adapter)
-
-        return http
+    def _get_symbol_table(self) -> SymbolTable:
+        if self.symbol_table is None:
+            self.symbol_table = SymbolTable()
+        return self.symbol_table
 
-    def get_company_name(self, ticker: str) -> str:
-        http = self.__http_adapter()
+    def fetch_company_name(self, ticker: str) -> Optional[str]:
+        # Reads the company name from the title of the Yahoo Finance quote page, None if the ticker is unknown
+        http = self.http_client
         company_name = None
         target_url = self.base_url + ticker
         try:
-            response = http.get(target_url, timeout=2)
+            with self.metrics.span("yahoo.company_name"):
+                response = http.get(target_url, source="quote", timeout=2)
         except requests.exceptions.RequestException as e:
             logging.warning(
                 f"Received the exception '{e}' while trying to acquire company name for ticker '{ticker}. Please try again."
             )
             return company_name
 
-        contents = response.text
-        soup = BeautifulSoup(contents, "lxml")
-        dom = etree.HTML(str(soup))
-
+        dom = etree.HTML(response.content)
+        if dom is None:
+            return company_name
         dom_xpath = dom.xpath("//head//title")
+        if len(dom_xpath) == 0 or dom_xpath[0].text is None:
+            return company_name
         # target text will be something like: 'General Electric Company (GE) Stock Price, News, Quote & History - Yahoo Finance'
         target_text = dom_xpath[0].text
-        # find the location of the ticket symbol and subtract two for the left parenthesis and the space
-        loc = target_text.find(ticker.upper()) - 2
-        company_name = target_text[:loc]
+        # Unknown tickers get a generic title without the ticker symbol in parentheses
+        loc = target_text.find(f"({ticker.upper()})")
+        if loc > 0:
+            company_name = target_text[:loc].strip()
 
         return company_name
 
+    def get_company_names(
+        self, tickers: List[str], max_workers: int = 8
+    ) -> Dict[str, Optional[str]]:
+        """
+        Company name for each ticker from the local symbol table. Tickers that are not in the table are looked up
+        on Yahoo Finance concurrently and the names that are found are written back to the table.
+        """
+        table = self._get_symbol_table()
+        names = table.lookup_many(tickers)
+        misses = [ticker for ticker, name in names.items() if name is None]
+        self.metrics.inc("symbol_lookups_total", len(names) - len(misses), result="hit")
+        self.metrics.inc("symbol_lookups_total", len(misses), result="miss")
+        if len(misses) > 0:
+            fetched = ordered_map(
+                lambda ticker: self.fetch_company_name(ticker=ticker.upper()),
+                misses,
+                max_workers=max_workers,
+            )
+            table.add(
+                records=[(t, n) for t, n in zip(misses, fetched) if n is not None],
+                source="yahoo",
+            )
+            names.update(zip(misses, fetched))
+
+        return names
+
+    def get_company_name(self, ticker: str) -> Optional[str]:
+        return self.get_company_names(tickers=[ticker])[ticker]
+
 
 if __name__ == "__main__":
     pass
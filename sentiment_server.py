@@ -0,0 +1,346 @@
+"""
+Local sentiment service that keeps the models and the labeled data embeddings resident between requests.
+
+Endpoints (JSON in, JSON out):
+    POST /score   {"texts": ["...", ...], "k": 100}  -> k-NN and VADER scores for each text
+    POST /ticker  {"ticker": "AAPL"}                  -> the full Google News pipeline summary for a ticker
+    GET  /stats                                       -> request latency and micro-batching statistics
+    GET  /health
+
+Concurrent requests are micro-batched: texts that arrive within `max_wait_ms` of each other are encoded and
+searched together in one score_batch call.
+"""
+
+from modules.sentiment import EmbeddedSentiment, RuleBasedSentiment, INDEX_KINDS
+from modules.googlenews import GoogleNews
+from modules.yahoo_finance import YahooFinance
+from modules.neighbors import NeighborIndex
+from modules.scoring import news_queries, attach_scores
+from modules.utils import logger as lg
+from main_gnews import DATA_PATH, build_summary
+from main_gnews_batch import fetch_ticker
+
+import argparse
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+import numpy as np
+
+stream_handler = lg.StreamLogging()
+logger = lg.CustomLogger(
+    logger_name=os.path.basename(__file__), handlers=[stream_handler]
+).get_logger()
+
+
+class MicroBatcher(object):
+    """
+    Collects texts from concurrent requests and scores them with shared score_batch calls on one worker thread.
+    """
+
+    def __init__(
+        self,
+        embed: EmbeddedSentiment,
+        corpus_embeddings: np.ndarray,
+        sentiment_labels: np.ndarray,
+        index: Optional[NeighborIndex] = None,
+        max_batch_size: int = 256,
+        max_wait_ms: float = 10,
+    ) -> None:
+        self.embed = embed
+        self.corpus_embeddings = corpus_embeddings
+        self.sentiment_labels = sentiment_labels
+        self.index = index
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.batched_texts = 0
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, texts: List[str], k: int) -> np.ndarray:
+        # Blocks the calling request thread until its texts have been scored
+        future = Future()
+        self.queue.put((list(texts), k, future))
+        return future.result()
+
+    def _collect(self) -> list:
+        items = [self.queue.get()]
+        n_texts = len(items[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while n_texts < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            items.append(item)
+            n_texts += len(item[0])
+
+        return items
+
+    @staticmethod
+    def _fail(items: list, e: Exception) -> None:
+        # Futures that were already resolved or cancelled are left as they are
+        for item in items:
+            if not item[2].done():
+                try:
+                    item[2].set_exception(e)
+                except Exception:
+                    pass
+
+    def _score_group(self, group: list, k: int) -> None:
+        texts = [text for item in group for text in item[0]]
+        scores = self.embed.score_batch(
+            queries=texts,
+            corpus_embeddings=self.corpus_embeddings,
+            sentiment_labels=self.sentiment_labels,
+            limit=k,
+            index=self.index,
+        )
+        offset = 0
+        for item in group:
+            if not item[2].done():
+                item[2].set_result(scores[offset : offset + len(item[0])])
+            offset += len(item[0])
+        self.batches += 1
+        self.batched_texts += len(texts)
+
+    def _run(self) -> None:
+        # The worker thread must never die, otherwise every waiting and later request blocks forever
+        while True:
+            items = []
+            try:
+                items = self._collect()
+                # Requests with different k are searched separately but still share the batch window
+                for k in set(item[1] for item in items):
+                    group = [item for item in items if item[1] == k]
+                    try:
+                        self._score_group(group, k)
+                    except Exception as e:
+                        self._fail(group, e)
+            except Exception as e:
+                logger.warning(f"Received the exception '{e}' in the batch worker.")
+                self._fail(items, e)
+
+
+class LatencyTracker(object):
+    def __init__(self, window: int = 1000) -> None:
+        self.window = window
+        self.latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, latency_ms: float) -> None:
+        with self._lock:
+            values = self.latencies.setdefault(endpoint, [])
+            values.append(latency_ms)
+            # Only keep the most recent requests
+            del values[: -self.window]
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                endpoint: {
+                    "requests": len(values),
+                    "mean_ms": float(np.mean(values)),
+                    "p50_ms": float(np.percentile(values, 50)),
+                    "p95_ms": float(np.percentile(values, 95)),
+                }
+                for endpoint, values in self.latencies.items()
+                if len(values) > 0
+            }
+
+
+class SentimentService(object):
+    def __init__(
+        self,
+        sample_size: Optional[int] = 1000,
+        k: int = 100,
+        index_kind: str = "exact",
+        max_batch_size: int = 256,
+        max_wait_ms: float = 10,
+    ) -> None:
+        self.k = k
+        self.embed = EmbeddedSentiment()
+        # The model loads while the corpus embeddings are read
+        self.embed.warm()
+        self.rules = RuleBasedSentiment()
+        self.gn = GoogleNews()
+        self.yfin = YahooFinance()
+
+        logger.info("Retrieving stock data embeddings for sentiment analysis.")
+        corpus_embeddings, sentiment_labels = self.embed.load_stock_data_embed(
+            filepath=DATA_PATH, sample=None if index_kind != "exact" else sample_size
+        )
+        index = None
+        if index_kind != "exact":
+            index = self.embed.load_neighbor_index(filepath=DATA_PATH, kind=index_kind)
+        # Wait for the model here, so the first request is not the one that loads it on the batch worker and the
+        # server only starts answering /health once it is ready
+        logger.info("Loading the sentence embedding model.")
+        self.embed.model
+        self.batcher = MicroBatcher(
+            embed=self.embed,
+            corpus_embeddings=corpus_embeddings,
+            sentiment_labels=sentiment_labels,
+            index=index,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+        )
+        self.latency = LatencyTracker()
+
+    def score_texts(self, texts: List[str], k: Optional[int] = None) -> dict:
+        embed_scores = self.batcher.submit(texts=texts, k=k or self.k)
+        rules_scores = self.rules.score_many(queries=texts)["compound"].tolist()
+
+        return {
+            "sentiment_embed": np.asarray(embed_scores).tolist(),
+            "sentiment_rules": rules_scores,
+        }
+
+    def score_ticker(self, ticker: str, k: Optional[int] = None) -> Optional[dict]:
+        fetched = fetch_ticker(ticker=ticker.upper(), gn=self.gn, yfin=self.yfin)
+        if fetched is None:
+            return None
+        news_df = fetched["news_df"]
+        queries, paragraph_counts = news_queries(news_df)
+        scores = self.score_texts(texts=queries, k=k)
+        news_df = attach_scores(
+            news_df=news_df,
+            embed_scores=np.asarray(scores["sentiment_embed"]),
+            rules_scores=np.asarray(scores["sentiment_rules"]),
+            paragraph_counts=paragraph_counts,
+        )
+
+        return build_summary(
+            ticker=fetched["ticker"],
+            company=fetched["company"],
+            news_df=news_df,
+            yearly_return=fetched["yearly_return"],
+        )
+
+    def stats(self) -> dict:
+        batches = self.batcher.batches
+        return {
+            "latency": self.latency.summary(),
+            "batches": batches,
+            "mean_batch_size": self.batcher.batched_texts / batches if batches else 0,
+        }
+
+
+def make_handler(service: SentimentService):
+    class SentimentRequestHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: dict) -> None:
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _read_json(self) -> dict:
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self) -> None:
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok"})
+            elif self.path == "/stats":
+                self._send_json(200, service.stats())
+            else:
+                self._send_json(404, {"error": f"Unknown endpoint '{self.path}'."})
+
+        def do_POST(self) -> None:
+            start = time.perf_counter()
+            try:
+                body = self._read_json()
+                if self.path == "/score":
+                    texts = body.get("texts")
+                    if type(texts) != list:
+                        self._send_json(400, {"error": "Expecting a list for 'texts'."})
+                        return
+                    result = service.score_texts(texts=texts, k=body.get("k"))
+                elif self.path == "/ticker":
+                    ticker = body.get("ticker")
+                    if not ticker:
+                        self._send_json(400, {"error": "You did not specify a ticker."})
+                        return
+                    result = service.score_ticker(ticker=ticker, k=body.get("k"))
+                    if result is None:
+                        self._send_json(
+                            404, {"error": f"No results for the ticker '{ticker}'."}
+                        )
+                        return
+                else:
+                    self._send_json(404, {"error": f"Unknown endpoint '{self.path}'."})
+                    return
+            except Exception as e:
+                logger.warning(f"Received the exception '{e}' for '{self.path}'.")
+                self._send_json(500, {"error": str(e)})
+                return
+
+            latency_ms = (time.perf_counter() - start) * 1000
+            service.latency.record(self.path, latency_ms)
+            self._send_json(200, {**result, "latency_ms": latency_ms})
+
+        def log_message(self, format: str, *args) -> None:
+            logger.info(format % args)
+
+    return SentimentRequestHandler
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects a (host, port) style client address
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Local sentiment scoring service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8410)
+    parser.add_argument(
+        "--socket", default=None, help="Serve on this Unix socket path instead of TCP."
+    )
+    parser.add_argument("--sample-size", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--index", choices=INDEX_KINDS, default="exact")
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    args = parser.parse_args()
+
+    service = SentimentService(
+        sample_size=args.sample_size,
+        k=args.k,
+        index_kind=args.index,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+    )
+    handler = make_handler(service)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixHTTPServer(args.socket, handler)
+        logger.info(f"Sentiment service listening on '{args.socket}'.")
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler)
+        logger.info(f"Sentiment service listening on http://{args.host}:{args.port}.")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,132 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+import praw
+import requests
+
+from subreddit import HEADERS, RISING_URL, get_post_responses, parse_rising_posts
+
+# Reddit allows 100 requests per minute for an OAuth client
+REDDIT_RATE = 100 / 60
+
+
+class TokenBucket(object):
+    """
+    Shared rate limiter: tokens are added at `rate` per second up to `capacity`, every request takes one.
+    """
+
+    def __init__(self, rate=REDDIT_RATE, capacity=10):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class SubredditCollector(object):
+    """
+    Fetches the rising posts and their comment trees of many subreddits concurrently.
+    Every listing and comment request goes through one token bucket so the whole collector stays within the
+    Reddit rate limit, and comments are yielded as soon as their post has been fetched.
+    """
+
+    def __init__(
+        self,
+        subreddits,
+        client_id,
+        client_secret,
+        max_workers=8,
+        bucket=None,
+    ):
+        self.subreddits = subreddits
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.max_workers = max_workers
+        self.bucket = bucket if bucket is not None else TokenBucket()
+        # PRAW is not thread safe, so every worker thread gets its own client and session
+        self.local = threading.local()
+
+    def get_reddit(self):
+        if not hasattr(self.local, "reddit"):
+            self.local.reddit = praw.Reddit(
+                client_id=self.client_id,
+                client_secret=self.client_secret,
+                user_agent="CS410 BOT",
+            )
+        return self.local.reddit
+
+    def get_session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def fetch_rising_posts(self, subreddit):
+        self.bucket.acquire()
+        res = self.get_session().get(RISING_URL.format(subreddit), headers=HEADERS)
+        return parse_rising_posts(res.json())
+
+    def fetch_responses(self, post_id):
+        self.bucket.acquire()
+        return get_post_responses(self.get_reddit(), post_id)
+
+    def iter_comments(self):
+        """
+        Yields one dict with the subreddit, post id and text for every post title and comment, in the order they
+        arrive. Comment trees of a subreddit are requested as soon as its listing is in, so the wall time follows
+        the slowest subreddit instead of the sum of all posts.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {
+                executor.submit(self.fetch_rising_posts, subreddit): (
+                    "listing",
+                    subreddit,
+                    None,
+                )
+                for subreddit in self.subreddits
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, subreddit, post_id = pending.pop(future)
+                    if kind == "listing":
+                        for post in future.result():
+                            yield {
+                                "subreddit": subreddit,
+                                "post_id": post["id"],
+                                "posts": post["title"],
+                            }
+                            comments = executor.submit(self.fetch_responses, post["id"])
+                            pending[comments] = ("comments", subreddit, post["id"])
+                    else:
+                        for response in future.result():
+                            yield {
+                                "subreddit": subreddit,
+                                "post_id": post_id,
+                                "posts": response,
+                            }
+
+    def get_all_comments(self):
+        # Same 'posts' column as Subreddit.get_all_comments, plus the subreddit and post id of every row
+        return pd.DataFrame(
+            list(self.iter_comments()), columns=["subreddit", "post_id", "posts"]
+        )
+
+
+if __name__ == "__main__":
+    pass
@@ -1,40 +1,32 @@
 import pandas as pd
 
-from subreddit import Subreddit
-from stock_sentiment import StockSentiment
+from collector import SubredditCollector
+from stock_sentiment import StockSentiment, warm
 
 # Register a reddit app at https://www.reddit.com/prefs/apps to get client_id and client_secret
 CLIENT_ID = "****"
 CLIENT_SECRET = "****"
+SUBREDDITS = ["wallstreetbets", "investing", "stocks", "pennystocks"]
+# "spacy" for the ORG entities of spaCy NER, "tickers" for the much faster ticker and company name matcher
+ENTITIES = "spacy"
 
-# Get a single datagram that has titles and comments from rising Reddit posts on 3 popular investment subreddits
+# Get a single datagram that has titles and comments from rising Reddit posts on 4 popular investment subreddits
 def get_trending_subreddits():
-    subreddit1 = Subreddit("wallstreetbets", CLIENT_ID, CLIENT_SECRET)
-    subreddit2 = Subreddit("investing", CLIENT_ID, CLIENT_SECRET)
-    subreddit3 = Subreddit("stocks", CLIENT_ID, CLIENT_SECRET)
-    subreddit4 = Subreddit("pennystocks", CLIENT_ID, CLIENT_SECRET)
+    # All subreddits and comment trees are fetched concurrently under one shared rate limit
+    collector = SubredditCollector(SUBREDDITS, CLIENT_ID, CLIENT_SECRET)
 
-    subreddit1.initialize()
-    subreddit2.initialize()
-    subreddit3.initialize()
-    subreddit4.initialize()
-
-    df1 = subreddit1.get_all_comments()
-    df2 = subreddit2.get_all_comments()
-    df3 = subreddit3.get_all_comments()
-    df4 = subreddit3.get_all_comments()
-    frames = [df1, df2, df3, df4]
-
-    return pd.concat(frames)
+    return collector.get_all_comments()
 
 
 # Perform NER and sentiment analysis on Reddit posts datagram
 def main():
+    # spaCy and flair load in the background while the posts are fetched
+    warm(nlp=ENTITIES == "spacy")
     df = get_trending_subreddits()
     df.to_csv("posts.csv", encoding="utf-8", index=False)
     df = pd.read_csv("posts.csv")
 
-    stock_sentiment = StockSentiment(df)
+    stock_sentiment = StockSentiment(df, entities=ENTITIES)
     df = stock_sentiment.get_stock_sentiment()
     print(df)
 
@@ -1,13 +1,62 @@
-import flair
-import spacy
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
-# python -m spacy download en_core_web_sm
-nlp = spacy.load("en_core_web_sm")
-model = flair.models.TextClassifier.load("en-sentiment")
+from ticker_matcher import TickerMatcher
+
+# The scripts in this directory are run from here. The repository root is added to the path so spaCy and flair go
+# through the same process wide model registry (modules/models.py) as the rest of the repo
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
+from modules.models import get_model_registry  # noqa: E402
+
+NLP_KEY = "spacy:en_core_web_sm"
+MODEL_KEY = "flair:en-sentiment"
+
+
+def _load_nlp():
+    import spacy
+
+    # python -m spacy download en_core_web_sm
+    return spacy.load("en_core_web_sm")
+
+
+def _load_model():
+    import flair.models
+
+    return flair.models.TextClassifier.load("en-sentiment")
+
+
+# spaCy and flair are imported and their models loaded on first use, once per process
+_models = get_model_registry()
+_models.register(NLP_KEY, _load_nlp)
+_models.register(MODEL_KEY, _load_model)
+
+
+def get_nlp():
+    return _models.get(NLP_KEY)
+
+
+def get_model():
+    return _models.get(MODEL_KEY)
+
+
+# Loads the models on background threads, e.g. while the Reddit posts are fetched. spaCy is not needed when the
+# entities come from the TickerMatcher
+def warm(nlp=True):
+    if nlp:
+        _models.warm(NLP_KEY)
+    return _models.warm(MODEL_KEY)
+
+
+# Only the NER component is needed, the others are skipped when posts are processed in batches
+UNUSED_COMPONENTS = ["tagger", "parser", "attribute_ruler", "lemmatizer"]
 
 # Perform NLP and NER, filter out entities that are not organizations
 def get_entities(text):
-    doc = nlp(text)
+    doc = get_nlp()(text)
     entities = []
     for entity in doc.ents:
         if entity.label_ == "ORG":
@@ -19,20 +68,110 @@ def get_entities(text):
 
 # Perform sentiment analysis on text
 def get_sentiment(text):
-    sen = flair.data.Sentence(text)
-    model.predict(sen)
+    from flair.data import Sentence
+
+    sen = Sentence(text)
+    get_model().predict(sen)
     return str(sen.labels[0].score) + " " + sen.labels[0].value
 
 
+def get_entities_batch(texts, batch_size=256, n_process=1):
+    # Same output as get_entities for every text, but the texts are streamed through nlp.pipe
+    nlp = get_nlp()
+    disable = [name for name in UNUSED_COMPONENTS if name in nlp.pipe_names]
+    entities = []
+    for doc in nlp.pipe(
+        texts, batch_size=batch_size, n_process=n_process, disable=disable
+    ):
+        entities.append(
+            list(set(entity for entity in doc.ents if entity.label_ == "ORG"))
+        )
+
+    return entities
+
+
+def get_sentiment_batch(texts, mini_batch_size=32):
+    # Same output as get_sentiment for every text, flair predicts mini_batch_size sentences per forward pass
+    from flair.data import Sentence
+
+    sentences = [Sentence(text) for text in texts]
+    get_model().predict(sentences, mini_batch_size=mini_batch_size)
+
+    return [str(sen.labels[0].score) + " " + sen.labels[0].value for sen in sentences]
+
+
+def _init_sentiment_worker():
+    # One torch thread per worker process, each process loads its own flair model once
+    import torch
+
+    torch.set_num_threads(1)
+    get_model()
+
+
+def get_sentiment_sharded(texts, n_process, mini_batch_size=32):
+    # get_sentiment_batch on n_process worker processes, every worker gets a contiguous shard of the texts
+    shard_size = -(-len(texts) // n_process)
+    shards = [texts[i : i + shard_size] for i in range(0, len(texts), shard_size)]
+    with ProcessPoolExecutor(
+        max_workers=n_process,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_sentiment_worker,
+    ) as executor:
+        results = executor.map(
+            get_sentiment_batch, shards, [mini_batch_size] * len(shards)
+        )
+        return [sentiment for shard in results for sentiment in shard]
+
+
+# 'spacy' keeps the ORG entities found by spaCy NER, 'tickers' the tickers found by the TickerMatcher
+ENTITY_METHODS = ["spacy", "tickers"]
+
+
 class StockSentiment(object):
-    def __init__(self, df):
+    def __init__(
+        self,
+        df,
+        batch_size=256,
+        n_process=1,
+        sentiment_batch_size=32,
+        entities="spacy",
+        matcher=None,
+    ):
+        if entities not in ENTITY_METHODS:
+            raise Exception(
+                f"Unknown entity method '{entities}'. Choose one of {ENTITY_METHODS}."
+            )
         self.df = df
+        # spaCy batch size and number of processes, and the flair mini-batch size
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.sentiment_batch_size = sentiment_batch_size
+        self.entities = entities
+        # Defaults to the tickers and company names in tickers.csv
+        self.matcher = matcher
+
+    def get_entities(self, posts):
+        if self.entities == "tickers":
+            if self.matcher is None:
+                self.matcher = TickerMatcher.from_file()
+            return self.matcher.match_many(posts)
+        return get_entities_batch(
+            posts, batch_size=self.batch_size, n_process=self.n_process
+        )
 
     # Extract investment entities from posts and then perform sentiment analysis
     def get_stock_sentiment(self):
-        self.df["entities"] = self.df["posts"].apply(get_entities)
-        self.df = self.df[self.df["entities"].str.len() > 0]
-        self.df["sentiment"] = self.df["posts"].apply(get_sentiment)
+        self.df["entities"] = self.get_entities(self.df["posts"].fillna("").tolist())
+        self.df = self.df[self.df["entities"].str.len() > 0].copy()
+        posts = self.df["posts"].tolist()
+        if self.n_process > 1 and len(posts) > self.n_process:
+            self.df["sentiment"] = get_sentiment_sharded(
+                posts, self.n_process, mini_batch_size=self.sentiment_batch_size
+            )
+        else:
+            self.df["sentiment"] = get_sentiment_batch(
+                posts, mini_batch_size=self.sentiment_batch_size
+            )
 
         return self.df
 
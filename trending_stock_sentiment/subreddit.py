@@ -2,6 +2,31 @@ import praw
 import requests
 import pandas as pd
 
+RISING_URL = "http://reddit.com/r/{0}/rising.json"
+HEADERS = {"User-Agent": "CS410/1.0.0"}
+
+
+# Title, id and an empty response list for every post in a rising listing
+def parse_rising_posts(data):
+    posts = []
+    for c in data["data"]["children"]:
+        data = c["data"]
+        posts.append({"title": data["title"], "id": data["id"], "responses": []})
+
+    return posts
+
+
+# Bodies of the top level comments of a post
+def get_post_responses(reddit, post_id):
+    submission = reddit.submission(post_id)
+    submission.comments.replace_more(limit=0)
+
+    responses = [top_level_comment.body for top_level_comment in submission.comments]
+    if responses:
+        del responses[0]  # remove metadata from responses
+
+    return responses
+
 
 class Subreddit(object):
     """
@@ -24,30 +49,15 @@ class Subreddit(object):
 
     # Fetch all the top level posts that are considered "rising" on the target subreddit
     def get_top_posts(self):
-        headers = {"User-Agent": "CS410/1.0.0"}
-        url = "http://reddit.com/r/{0}/rising.json".format(self.subreddit)
-
-        res = requests.get(url, headers=headers)
-        data = res.json()
+        url = RISING_URL.format(self.subreddit)
 
-        post_list = data["data"]["children"]
-
-        for c in post_list:
-            data = c["data"]
-            targetData = {"title": data["title"], "id": data["id"], "responses": []}
-            self.posts.append(targetData)
+        res = requests.get(url, headers=HEADERS)
+        self.posts.extend(parse_rising_posts(res.json()))
 
     # Get the responses/comments for all the "rising" posts on the target subreddit
     def populate_post_responses(self):
         for post in self.posts:
-            submission = self.reddit.submission(post["id"])
-            submission.comments.replace_more(limit=0)
-
-            for top_level_comment in submission.comments:
-                post["responses"].append(top_level_comment.body)
-
-            if post["responses"]:
-                del post["responses"][0]  # remove metadata from responses
+            post["responses"].extend(get_post_responses(self.reddit, post["id"]))
 
     # Flatten post titles and comments into a single Pandas dataframe and return it
     def get_all_comments(self):
@@ -0,0 +1,217 @@
+import csv
+import os
+import re
+import sqlite3
+from collections import deque
+
+DEFAULT_TICKERS_PATH = os.path.join(os.path.dirname(__file__), "tickers.csv")
+
+# Words that are also ticker symbols. Written bare they are almost never meant as the ticker, so they only count
+# as cashtags ($ALL), like single letter symbols
+COMMON_WORDS = set(
+    """
+    A AI ALL AM AN AND ANY ARE AS AT ATH ATM BE BEST BIG BY CALL CALLS CAN CEO CFO CPI DD DO EDIT ELON EOD EPS ETF
+    EV FD FDA FED FOMO FOR FUD FUN GDP GO GOOD HAS HE HOLD HOOD HUGE IMO IN IPO IS IT ITM IV LIFE LOL LOVE ME MOON
+    MY NEW NEXT NOW OF OK ON ONE OP OPEN OR OTM OUT PM POST PT PUT PUTS REAL RH SEC SEE SHOP SNAP SO SPOT TA THE TO
+    TOP UK UP US USA USD WSB YOLO COIN WISH
+    """.split()
+)
+
+# '/' separates tokens, so pairs like 'NVDA/AMD' are two symbols
+TOKEN_PATTERN = re.compile(r"\$?[A-Za-z0-9][A-Za-z0-9&'’.\-]*")
+
+# Legal suffixes and share classes that listing files append to company names
+NAME_SUFFIX = re.compile(
+    r"[,\s]+(inc|incorporated|corp|corporation|co|company|ltd|limited|plc|holdings?|group|s\.?a|n\.?v|ag|l\.?p|llc"
+    r"|class [a-c]|common stock|ordinary shares|american depositary shares|trust)\.?$",
+    re.IGNORECASE,
+)
+
+
+def tokenize(text):
+    # Words with their cashtag, trailing punctuation and possessive 's removed
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text):
+        token = match.group().rstrip(".-'’")
+        if token[-2:].lower() in ("'s", "’s"):
+            token = token[:-2]
+        if token and token != "$":
+            tokens.append(token)
+    return tokens
+
+
+def clean_company_name(name):
+    # 'Apple Inc. - Common Stock' -> 'Apple'
+    name = name.split(" - ")[0].strip()
+    if name.lower().startswith("the "):
+        name = name[4:]
+    while True:
+        cleaned = NAME_SUFFIX.sub("", name).strip()
+        if cleaned == name:
+            return cleaned
+        name = cleaned
+
+
+class TickerMatcher(object):
+    """
+    Finds the tickers a post talks about in one pass over its words.
+    Cashtags ($TSLA) match any known symbol. Bare symbols only match when written in upper case, at least
+    min_symbol_length long, not a common word and not in a post that is mostly upper case. Company names
+    (e.g. 'Advanced Micro Devices') are matched by a word level Aho-Corasick automaton, names of a single word
+    only when capitalized. Every match is returned as its normalized ticker.
+    """
+
+    def __init__(
+        self, symbols, names=None, common_words=COMMON_WORDS, min_symbol_length=2
+    ):
+        # symbols maps ticker symbols and their aliases to the ticker, names maps company names to the ticker
+        self.symbols = {
+            symbol.upper(): ticker.upper() for symbol, ticker in symbols.items()
+        }
+        self.common_words = set(w.upper() for w in common_words)
+        self.min_symbol_length = min_symbol_length
+        # Automaton state: transitions, failure links and the (number of words, ticker) of names ending there
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for name, ticker in (names or {}).items():
+            self._add_name(name, ticker.upper())
+        self._build()
+
+    @classmethod
+    def from_file(cls, filepath=DEFAULT_TICKERS_PATH, alias_sep="|", **kwargs):
+        """
+        Loads a CSV listing with 'ticker' and 'name' columns, like the files the modules/symbol_table.py loader
+        reads. 'aliases' holds other symbols of the ticker and 'names' other company names, separated by alias_sep.
+        Without a 'names' column the cleaned company name is matched.
+        """
+        symbols, names = {}, {}
+        with open(filepath, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                ticker = row["ticker"].strip().upper()
+                symbols[ticker] = ticker
+                for alias in (row.get("aliases") or "").split(alias_sep):
+                    if alias.strip():
+                        symbols[alias.strip()] = ticker
+                if "names" in row:
+                    company_names = (row["names"] or "").split(alias_sep)
+                else:
+                    company_names = [clean_company_name(row["name"])]
+                for name in company_names:
+                    if name.strip():
+                        names.setdefault(name.strip(), ticker)
+        return cls(symbols, names, **kwargs)
+
+    @classmethod
+    def from_symbol_table(cls, path="./cache/symbols.sqlite", **kwargs):
+        # Every symbol, alias and cleaned company name in a symbol table built with modules/symbol_table.py
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute("SELECT ticker, name FROM symbols").fetchall()
+            aliases = conn.execute("SELECT alias, ticker FROM aliases").fetchall()
+        finally:
+            conn.close()
+        symbols = {ticker: ticker for ticker, _ in rows}
+        symbols.update(dict(aliases))
+        names = {}
+        for ticker, name in rows:
+            name = clean_company_name(name)
+            # Very short names and names that are common words match too much text
+            if len(name) > 2 and name.upper() not in COMMON_WORDS:
+                names.setdefault(name, ticker)
+        return cls(symbols, names, **kwargs)
+
+    def _add_name(self, name, ticker):
+        words = [word.lower() for word in tokenize(name)]
+        if len(words) == 0:
+            return
+        state = 0
+        for word in words:
+            if word not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][word] = len(self.goto) - 1
+            state = self.goto[state][word]
+        if len(self.output[state]) == 0:
+            self.output[state].append((len(words), ticker))
+
+    def _build(self):
+        # Breadth first, the failure link of a state is the longest proper suffix of its words that is also a state
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(word, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def _is_shouting(self, tokens):
+        # Mostly upper case posts ('ALL IN MY LIFE SAVINGS') make every word look like a symbol
+        words = [
+            t
+            for t in tokens
+            if t.isalpha() and len(t) > 1 and t.upper() not in self.symbols
+        ]
+        upper = sum(1 for t in words if t.isupper())
+        return upper >= 3 and upper * 2 > len(words)
+
+    def _symbol(self, token, shouting):
+        if token[0] == "$":
+            return self.symbols.get(token[1:].upper())
+        if (
+            shouting
+            or not token.isupper()
+            or len(token) < self.min_symbol_length
+            or token in self.common_words
+        ):
+            return None
+        return self.symbols.get(token)
+
+    def match(self, text):
+        """
+        Tickers mentioned in the text, once each and in the order of their first mention.
+        """
+        if not isinstance(text, str):
+            return []
+        tokens = tokenize(text)
+        shouting = self._is_shouting(tokens)
+        # (first word, number of words, ticker) of every match
+        matches = []
+        state = 0
+        for i, token in enumerate(tokens):
+            ticker = self._symbol(token, shouting)
+            if ticker is not None:
+                matches.append((i, 1, ticker))
+            word = token.lower()
+            while state and word not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(word, 0)
+            for length, ticker in self.output[state]:
+                start = i - length + 1
+                if length > 1 or tokens[start][0].isupper():
+                    matches.append((start, length, ticker))
+
+        # Overlapping matches keep the leftmost longest one, e.g. 'Bank of America' over 'America'
+        tickers = []
+        end = 0
+        for start, length, ticker in sorted(matches, key=lambda m: (m[0], -m[1])):
+            if start < end:
+                continue
+            end = start + length
+            if ticker not in tickers:
+                tickers.append(ticker)
+
+        return tickers
+
+    def match_many(self, texts):
+        return [self.match(text) for text in texts]
+
+
+if __name__ == "__main__":
+    pass